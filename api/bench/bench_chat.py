@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Check chat.py converts messages to exactly the same html as bleach's linkify (as was done before),
+then compare messages per second converted by each
+
+    python bench_chat.py [random_messages]
+
+Messages checked are a set of known edge cases plus random ones built from fragments of urls,
+punctuation, entities and whitespace (so likely to hit the edge cases of both)
+
+"""
+
+import sys
+import random
+from html import escape
+from time import perf_counter
+from pathlib import Path
+
+from bleach import linkify
+from bleach.callbacks import nofollow, target_blank
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+
+from chat import message_to_html
+
+
+RANDOM_MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+EDGE_CASES = [
+    "", " ", "\n", "\n\n", "\r\n", "\r", "a\0b", "a\x0cb\x01", "  padded  ",
+    "hi example.com there", "example.com.", "example.com,", "example.com...",
+    "(example.com)", "((example.com))", "(see http://a.com/x_(y))", "http://a.com/x)",
+    "go to https://x.com/a?b=1&c=2 now", "www.google.com/?q='a'", 'http://a.com/"x',
+    "http://a.com/<b>", "a'b\"c<d>e & f", "a&amp;b", "&#x27;", "http://a.com/&#x27;",
+    "http://a.com/?a&amp;b", "http://a.com/?a&amp", "http://a.com/?a&hellip;",
+    "http://a.com/?a&#12z;b", "http://a.com/?a&#x1Fg;b", "http://a.com/?&#0;&#;&#x;&#xz;",
+    "http://a.com/?&#1114112;&#99999999999;", "http://a.com/?&lt;&gt&gt;&AMP;&Amp;",
+    "mailto:a@b.com", "test@example.com", "user:pw@example.com", "ftp://x.com", "HTTP://X.COM/A",
+    "foo.bar", "1.2.3.4", "http://1.2.3.4/", "http://localhost:8000/x", "a.com:8080/x",
+    "é.com", "xn--a.com", "e.g. x.co.uk/p", "a.b.c.com.au/x?y#z~", "a.com.b", "@a.com", ".a.com",
+    "x.com\ny.org", "multi\nline\ntext", "emoji 😀 example.com 😀", "tab\texample.com\t",
+    "a\ud800b", "x.com/\ud800", "\ufffe\uffff", "\x7f\x80\x9f", "x.com/\x85y", "\u2028a.com",
+]
+
+FRAGMENTS = [
+    "a", "B", "1", "_", "-", ".", ",", ":", ";", "/", "//", "?", "#", "&", "=", "~", "@", "(",
+    ")", "'", '"', "<", ">", "[", "]", "{", "}", "|", "\\", "^", "`", " ", "\t", "\n", "\r", "\0",
+    "\x0c", "\x0b", "\xa0", " ", "é", "😀", "com", "co", "uk", "org", "io", ".com", ".co.uk",
+    "http", "http://", "https://", "HTTPS://", "mailto:", "ftp:", "www.", "example", "amp", "lt",
+    "&amp;", "&amp", "&#", "&#x", "&#39;", "&#x27;", "&hellip;", "&nbsp;", "&lt;", "&notin;",
+    "&not;", ":8080", "x_y", "xn--", "a@b",
+]
+
+
+def before(message):
+    """Convert a message as was done before"""
+    html = '<br>'.join(escape(line) for line in message.split('\n'))
+    return linkify(html, [nofollow, target_blank])
+
+
+def random_message(rand):
+    return ''.join(rand.choice(FRAGMENTS) for _ in range(rand.randint(1, 30)))
+
+
+def rate(convert, messages, rounds):
+    start = perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            convert(message)
+    return rounds * len(messages) / (perf_counter() - start)
+
+
+# Differential check
+rand = random.Random(0)
+messages = EDGE_CASES + [random_message(rand) for _ in range(RANDOM_MESSAGES)]
+for message in messages:
+    expected = before(message)
+    actual = message_to_html(message)
+    if actual != expected:
+        sys.exit(f"FAIL: {message!r}\n  bleach: {expected!r}\n  chat.py: {actual!r}")
+print(f"OK: Same html as bleach for {len(messages)} messages\n")
+
+# Throughput
+samples = {
+    'plain': ["Hey everyone, this song is great! Can we play the next one after it?"] * 10,
+    'with link': ["Check out https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42 it's great"] * 10,
+    'multiline': ["first line\nsecond line with example.com\nthird (see docs.python.org/3/)"] * 10,
+    'random': messages[len(EDGE_CASES):len(EDGE_CASES) + 1000],
+}
+print("Messages per second\n")
+print(f"{'':<12}{'before':>12}{'after':>12}{'speedup':>10}")
+for name, sample in samples.items():
+    rounds = max(1, 2000 // len(sample))
+    rates = {'before': rate(before, sample, rounds), 'after': rate(message_to_html, sample, rounds)}
+    print(f"{name:<12}{rates['before']:>12,.0f}{rates['after']:>12,.0f}"
+        f"{rates['after'] / rates['before']:>9.1f}x")
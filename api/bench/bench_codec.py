@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Compare items per second encoded to and decoded from DynamoDB's typed attribute maps by boto3's
+serializer with floats patched to go via Decimal (as was done before) vs the codec in dynamo.py
+
+    python bench_codec.py [rounds]
+
+Uses a page of 100 clients (as queried from the by_room index) and a playlist of 200 media items
+Results of both are first checked to decode to the same values, and items encoded as before are
+checked to be encoded exactly the same again after decoding (so conditions on them still match)
+
+"""
+
+import sys
+from time import perf_counter
+from decimal import Decimal
+from pathlib import Path
+
+from boto3.dynamodb.types import DYNAMODB_CONTEXT, TypeSerializer, TypeDeserializer
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+
+from dynamo import encode_item, decode_item
+
+
+ROUNDS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+ROSTER_PAGE = [{
+    'socket': f'Sock{n:04}Abc=',
+    'room_id': 'aB3dE5gH',
+    'room_joined': 1600000000.123 + n,
+    'name': f"Client {n}",
+    'room_admin': n == 0,
+    'room_synced': 12.5 if n % 2 else None,
+} for n in range(100)]
+
+MEDIA_LIST = [{
+    'room_id': 'aB3dE5gH',
+    'id': f'media{n:04}',
+    'pos': float(n),
+    'name': f"Some video number {n}",
+    'type': 'youtube',
+    'content': {'id': f'dQw4w9WgX{n:02}'},
+    'expire': 1600086400,
+} for n in range(200)]
+
+
+class Serializer(TypeSerializer):
+    """boto3's serializer with the float patch that used to be applied to it"""
+
+    def serialize(self, value):
+        if isinstance(value, float):
+            value = Decimal(value)
+        return super().serialize(value)
+
+
+class Deserializer(TypeDeserializer):
+    """boto3's deserializer with the float patch that used to be applied to it"""
+
+    def deserialize(self, value):
+        value = super().deserialize(value)
+        if isinstance(value, Decimal):
+            value = float(value)
+        return value
+
+
+def rate(func, items):
+    """Return items per second processed by a function"""
+    start = perf_counter()
+    for _ in range(ROUNDS):
+        for item in items:
+            func(item)
+    return ROUNDS * len(items) / (perf_counter() - start)
+
+
+DYNAMODB_CONTEXT.clear_traps()  # As the patch did (for the whole process)
+serializer = Serializer()
+deserializer = Deserializer()
+codecs = {
+    'before': (
+        lambda item: {key: serializer.serialize(val) for key, val in item.items()},
+        lambda item: {key: deserializer.deserialize(val) for key, val in item.items()},
+    ),
+    'after': (encode_item, decode_item),
+}
+
+# Numbers written via Decimal before (e.g. timestamps of clients connected across a deploy) must
+# be written back exactly, as conditions compare them with what's stored
+# NOTE Compared as Decimals (like DynamoDB does) since e.g. '0' and '0.0' are the same number
+exact = TypeDeserializer()
+for item in (*ROSTER_PAGE, *MEDIA_LIST):
+    legacy = codecs['before'][0](item)
+    rewritten = encode_item(decode_item(legacy))
+    if any(exact.deserialize(rewritten[key]) != exact.deserialize(legacy[key]) for key in legacy):
+        sys.exit(f"FAIL: {legacy} not written back exactly")
+
+print(f"Items per second over {ROUNDS} rounds\n")
+print(f"{'':<19}{'before':>12}{'after':>12}{'speedup':>10}")
+for name, items in (('roster page (100)', ROSTER_PAGE), ('media list (200)', MEDIA_LIST)):
+
+    # Both must decode the other's encoding to the original (numbers as floats)
+    expected = [{key: float(val) if isinstance(val, int) and not isinstance(val, bool) else val
+        for key, val in item.items()} for item in items]
+    for encode, _ in codecs.values():
+        for _, decode in codecs.values():
+            if [decode(encode(item)) for item in items] != expected:
+                sys.exit(f"FAIL: {name} not the same after encoding and decoding")
+
+    for action in ('encode', 'decode'):
+        rates = {}
+        for codec, (encode, decode) in codecs.items():
+            if action == 'encode':
+                rates[codec] = rate(encode, items)
+            else:
+                rates[codec] = rate(decode, [encode(item) for item in items])
+        label = f"{name.split(' (')[0]} {action}"
+        print(f"{label:<19}{rates['before']:>12,.0f}{rates['after']:>12,.0f}"
+            f"{rates['after'] / rates['before']:>9.1f}x")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Measure the cold start cost (time and memory) of the sync path and the main handler path, each in a
+fresh interpreter like a new Lambda container, plus the extra cost paid by the first chat message
+
+    python bench_cold.py [runs]
+
+Reports the median wall time and peak RSS of each path, and the modules that took the longest to
+import (as `python -X importtime` would show, but summarised per package)
+
+"""
+
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+from statistics import median
+
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+TOP = 6  # Number of slowest packages to show per path
+CODE = Path(__file__).parent.parent / 'code'
+
+SETUP = '''
+import json
+import resource
+from time import perf_counter
+start = perf_counter()
+'''
+EVENT = '''
+event = {'requestContext': {'connectionId': 'socket', 'domainName': 'example.com',
+    'stage': 'stageless', 'requestTimeEpoch': 0, 'eventType': 'MESSAGE'}, 'body': '0'}
+'''
+REPORT = '''
+print(json.dumps({'seconds': perf_counter() - start,
+    'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+'''
+
+# What each path does before it can start handling (without making any requests)
+PATHS = {
+    'sync': '''
+import entrypoint
+from resources import get_sockets
+get_sockets('example.com', 'stageless')
+''',
+    'handler': '''
+import entrypoint
+import resources
+from handlers import WebsocketHandlers
+resources._cache['config'] = {'domain': 'example.com'}
+WebsocketHandlers(event, None)
+''',
+}
+# The first chat message also imports chat.py (see `handle_room_message`)
+PATHS['handler+chat'] = PATHS['handler'] + '''
+from chat import message_to_html
+'''
+
+ENV = {**os.environ, 'STACK': 'bench', 'AWS_DEFAULT_REGION': 'us-west-2',
+    'AWS_ACCESS_KEY_ID': 'x', 'AWS_SECRET_ACCESS_KEY': 'x'}
+
+
+def run(code, *flags):
+    """Run code in a fresh interpreter and return its result and stderr"""
+    proc = subprocess.run([sys.executable, *flags, '-c', code], cwd=CODE, env=ENV,
+        capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.splitlines()[-1]), proc.stderr
+
+
+def slowest_imports(stderr):
+    """Return (cumulative microseconds, package) from -X importtime output, slowest first
+
+    Packages are credited with the time of their outermost import only, and own modules (in
+    CODE) are skipped so that the dependencies they import are shown instead
+
+    """
+    own = {path.stem for path in CODE.glob('*.py')}
+    totals = {}
+    ancestors = []
+    # NOTE Output lists modules after those they import, so reversed each comes after its parent
+    for line in reversed(stderr.splitlines()):
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        package = name.strip().split('.')[0]
+        ancestors = ancestors[:depth]
+        if package not in own and package not in ancestors:
+            totals[package] = totals.get(package, 0) + int(cumulative)
+        ancestors.append(package)
+    return sorted(((us, package) for package, us in totals.items()), reverse=True)
+
+
+# Compile code ahead of time (as is done when deploying), so only importing is measured
+subprocess.run([sys.executable, '-m', 'compileall', '-q', str(CODE)], check=True)
+
+print(f"Median cold start of {RUNS} fresh interpreters\n")
+print(f"{'path':<14} {'ms':>8} {'RSS MB':>8}")
+for name, code in PATHS.items():
+    results = [run(SETUP + EVENT + code + REPORT)[0] for _ in range(RUNS)]
+    seconds = median(result['seconds'] for result in results)
+    rss = median(result['rss'] for result in results) / 1024  # ru_maxrss is in KB on Linux
+    print(f"{name:<14} {seconds * 1000:>8.1f} {rss:>8.1f}")
+
+for name, code in PATHS.items():
+    print(f"\nSlowest imports for {name} (ms, including what they import)")
+    for cumulative, module in slowest_imports(run(SETUP + EVENT + code + REPORT,
+            '-X', 'importtime')[1])[:TOP]:
+        print(f"  {cumulative / 1000:>7.1f}  {module}")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Compare messages per second through parsing, dispatch and validation when looking up handlers and
+building schemas for every message (as was done before) vs using schemas compiled once per container
+
+    python bench_dispatch.py [messages]
+
+Handlers themselves are replaced by ones that only `expect` their fields, so only the overhead of
+getting a message to its handler is measured (for the most common message types)
+
+"""
+
+import os
+import sys
+import json
+from time import perf_counter
+from numbers import Number
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+os.environ['BACKEND'] = 'memory'
+os.environ.setdefault('STACK', 'bench')
+
+import resources
+import handlers
+from memory import make_event
+from schemas import MESSAGES
+from handlers import WebsocketHandlers
+
+
+MESSAGE_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+COMMON = {
+    'client_synced': {'client_synced': 12.5},
+    'room_message': {'room_id': 'aB3dE5gH', 'room_message': "Hello everyone!"},
+    'room_media_play': {'room_id': 'aB3dE5gH', 'room_start': 1600000000.123},
+}
+resources._cache['config'] = {'domain': 'localhost'}
+NoneType = type(None)
+
+
+class Before(WebsocketHandlers):
+    """Dispatch and validation as was done before"""
+
+    def handle(self):
+        handler = getattr(self, f'handle_{self.msg_type}', None)
+        if handler:
+            handler()
+        else:
+            self.client_error(f"Message type '{self.msg_type}' not valid")
+
+    def expect_from(self, data, types, required=(), nullable=()):
+        all_keys = (*required, *nullable)
+        extraneous = set(data.keys()) - set(all_keys)
+        if extraneous:
+            self.client_error(f"Unknown fields given: {', '.join(extraneous)}")
+        validated = []
+        for key in all_keys:
+            if key not in data:
+                self.client_error(f"Missing '{key}' field")
+            val = data[key]
+            other_types = [NoneType] if key in nullable else []
+            if not isinstance(val, (types[key], *other_types)):
+                self.client_error(f"Invalid value for '{key}' field")
+            if isinstance(val, str):
+                val = val.strip()
+            if val == '':
+                val = None
+            validated.append(val)
+        return validated[0] if len(validated) == 1 else validated
+
+    def expect(self, required=(), nullable=()):
+        types = {
+            'room_id': str, 'room_id_copy': str, 'room_name': str, 'room_secret': str,
+            'room_start': Number, 'room_paused': Number, 'room_loaded': int,
+            'room_admins_only': bool, 'room_message': str, 'client_name': str,
+            'client_synced': Number, 'client_feedback': str, 'client_email': str,
+            'client_user_agent': str, 'payment_amount': int, 'payment_return_url': str,
+            'media_id': str, 'media_id_after': str, 'media_name': str, 'media_type': str,
+            'media_content': dict,
+        }
+        return self.expect_from(self.msg_info, types, required, nullable)
+
+
+def expecting(msg_type):
+    """Return a stand-in handler that only expects the fields of a message type"""
+    required, nullable = MESSAGES[msg_type]
+    def handler(self):
+        self.expected = self.expect(required, nullable)
+    return handler
+
+
+# Replace handlers with stand-ins (for both the old and new way of dispatching)
+for msg_type in COMMON:
+    setattr(Before, f'handle_{msg_type}', expecting(msg_type))
+    handlers.DISPATCH[msg_type] = (expecting(msg_type), handlers.DISPATCH[msg_type][1])
+
+events = [make_event('socket', body=json.dumps({'type': msg_type, 'info': info}))
+    for msg_type, info in COMMON.items()]
+
+print(f"Messages per second through process_input + dispatch + validation\n")
+print(f"{'type':<18} {'before':>10} {'after':>10}")
+for index, msg_type in enumerate(COMMON):
+    rates = {}
+    results = {}
+    for name, cls in (('before', Before), ('after', WebsocketHandlers)):
+        instance = cls(events[index], None)
+        start = perf_counter()
+        for _ in range(MESSAGE_COUNT):
+            instance.process_input()
+            instance.handle()
+        rates[name] = MESSAGE_COUNT / (perf_counter() - start)
+        results[name] = instance.expected
+    if results['before'] != results['after']:
+        sys.exit(f"FAIL: {msg_type} validated differently: {results}")
+    print(f"{msg_type:<18} {rates['before']:>10,.0f} {rates['after']:>10,.0f}")
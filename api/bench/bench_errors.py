@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Check errors like one already reported are only counted until the report window has passed, then
+compare how long failing invocations take when publishing every error synchronously (as was done
+before) vs via reporting.py, with SNS simulated by the memory backend (no network used)
+
+    python bench_errors.py [invocations] [publish_latency_ms]
+
+Invocations all send a message of an invalid type (a different one each time), as a bad client
+build would, so all raise the same client error with a different message
+
+"""
+
+import os
+import sys
+import json
+import traceback
+from time import perf_counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+os.environ['BACKEND'] = 'memory'
+os.environ.setdefault('STACK', 'bench')
+os.environ.setdefault('TOPIC_ERRORS', 'errors')
+os.environ.setdefault('TOPIC_CONTACT', 'contact')
+
+import memory
+import resources
+import entrypoint
+import reporting
+from memory import make_event, LambdaContext
+from reporting import ErrorReporter
+
+
+INVOCATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+PUBLISH_LATENCY = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.03
+resources._cache['config'] = {'domain': 'localhost', 'secrets': {'stripe_key_private': 'x'}}
+
+
+def check(condition, description):
+    if not condition:
+        sys.exit(f"FAIL: {description}")
+
+
+def fail(kind, detail):
+    """Raise an error from one of two places depending on kind"""
+    if kind == 'a':
+        raise ValueError(f"Failed a with {detail}")
+    raise ValueError(f"Failed b with {detail}")
+
+
+def report(reporter, kind, detail):
+    try:
+        fail(kind, detail)
+    except Exception as exc:
+        return reporter.report(exc)
+
+
+# Rate limiting (with a fake clock and publish)
+now = [0.0]
+published = []
+reporter = ErrorReporter(lambda subject, message: published.append(message), window=60,
+    clock=lambda: now[0])
+
+check([report(reporter, 'a', n) for n in range(1000)] == [True] + [False] * 999,
+    "Only first of 1000 like errors published")
+check(report(reporter, 'b', 0), "Error raised from elsewhere published")
+now[0] = 59.9
+check(not report(reporter, 'a', 0), "Like error still suppressed before window ends")
+now[0] = 60
+check(report(reporter, 'a', 0), "Like error published once window ends")
+check(published[-1].startswith("1000 more like this occurred"),
+    "Count of suppressed errors included when next published")
+check("Failed a with 0" in published[-1], "Traceback included")
+check(not report(reporter, 'a', 0), "Window restarts when published")
+check(ErrorReporter(lambda *args: None, window=0).report(ValueError()), "Window of 0 reports all")
+print("OK: Like errors only reported once per window\n")
+
+
+# Latency of failing invocations
+
+
+def publish_synchronously(exc):
+    """How errors were reported before"""
+    resources.get_sns().publish(TopicArn=os.environ['TOPIC_ERRORS'],
+        Subject=f"{os.environ['STACK']} API Error", Message=traceback.format_exc())
+
+
+def run(report_error):
+    """Return mean ms per failing invocation and count of errors published"""
+    memory.reset()
+    memory.sockets.connect('sender')
+    reporting._reporter.seen.clear()
+    original = reporting.report_error
+    reporting.report_error = report_error  # NOTE entrypoint imports it when needed
+    try:
+        start = perf_counter()
+        for n in range(INVOCATIONS):
+            body = json.dumps({'type': f'invalid{n}', 'info': {}})
+            entrypoint.enter(make_event('sender', 'MESSAGE', body), LambdaContext())
+        duration = perf_counter() - start
+    finally:
+        reporting.report_error = original
+    reporting.wait_for_reports()
+    return duration * 1000 / INVOCATIONS, len(memory.sns.published)
+
+
+memory.sns.latency = PUBLISH_LATENCY
+print(f"{INVOCATIONS} failing invocations, publishing takes {PUBLISH_LATENCY * 1000:.0f} ms\n")
+print(f"{'':<8}{'ms each':>10}{'published':>11}")
+for name, report_error in (('before', publish_synchronously), ('after', reporting.report_error)):
+    mean, count = run(report_error)
+    print(f"{name:<8}{mean:>10.2f}{count:>11}")
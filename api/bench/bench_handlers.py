@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Run every handler against rooms of different sizes and report the wall time, database requests,
+messages and posts (frames of merged messages) sent by each, exiting with an error if any doesn't
+make the database requests expected of it (its budget)
+
+    python bench_handlers.py [clients...]
+
+Runs the real entrypoint against the in-memory backend (see memory.py), with the sender being the
+room's admin (or a guest/newcomer where that is more typical), starting from the same room each time
+
+Also checks that deleting a room reports how many clients were evicted, and that a $disconnect
+for a client already reaped is handled as already disconnected
+
+Database request budgets don't depend on room size, as every handler should make a constant number
+of requests regardless of how many clients are in the room (only messages sent should grow)
+
+"""
+
+import os
+import sys
+import json
+from time import perf_counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+os.environ['BACKEND'] = 'memory'
+os.environ['ROSTER_FLUSH_INTERVAL'] = '0'  # Send roster diffs immediately (no coalescing)
+os.environ['ERROR_REPORT_WINDOW'] = '0'  # Report every error (so all are counted)
+os.environ.setdefault('STACK', 'bench')
+os.environ.setdefault('TOPIC_ERRORS', 'errors')
+os.environ.setdefault('TOPIC_CONTACT', 'contact')
+
+import memory
+import resources
+import entrypoint
+import reporting
+from memory import make_event, LambdaContext
+from handlers import WebsocketHandlers
+
+
+SIZES = [int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 1000]
+MEDIA = 3  # Media items in the room
+resources._cache['config'] = {'domain': 'localhost', 'secrets': {'stripe_key_private': 'x'}}
+
+# Database requests each handler is expected to make, derived from what it needs to do
+# NOTE Counted as: client/room/roster reads (get), media/clients queries (one page each for rooms of
+#      this size), and writes. The sender's client is read once and the room once per invocation
+#      (then cached), and writes return the new values so never need reading again.
+# NOTE Broadcasts make one query for the room's sockets (two when guests see less than admins)
+# NOTE Handlers making more than expected is a regression, and fewer means the scenario skipped the
+#      work (e.g. a change that was already made), so either fails
+BUDGETS = {
+    'aws_connect': 1,  # Put client
+    'aws_disconnect': 4,  # Get client, get room, broadcast 'left', transact client+roster
+    # Get room to copy, query its media, put room, batch put media, put roster,
+    # get client, get roster (space for an entry?), transact client+roster
+    'room_create': 8,
+    # Get room, mark deleted, query clients, (evict each), delete room, delete roster,
+    # query media, batch delete media
+    'room_delete': 7,
+    'room_name': 3,  # Get client, update room, broadcast
+    'room_state_resync': 3,  # Get client, get room, query media
+    'room_clients_resync': 3,  # Get client, get room, get roster (summary is exact)
+    'room_message': 3,  # Get client, get room (guest, so check admins_only_chat), broadcast
+    'room_admins_only_dj': 3,  # Get client, update room, broadcast
+    # Get client, update room, broadcast patch, get roster, broadcast clients to admins and guests
+    'room_admins_only_see_clients': 6,
+    'room_admins_only_chat': 3,  # Get client, update room, broadcast
+    'room_media_add': 5,  # Get client, query media, get room, transact room+media, broadcast
+    'room_media_rearrange': 5,  # Get client, query media, get room, transact room+media, broadcast
+    'room_media_play': 4,  # Get client, get room (loaded?), update room, broadcast
+    'room_media_pause': 4,  # Get client, get room (loaded?), update room, broadcast
+    'room_media_load': 5,  # Get client, query media, get room, transact room+media, broadcast
+    'room_media_remove': 5,  # Get client, query media, get room, transact room+media, broadcast
+    # Get room, get client, get roster (space for an entry?), transact client+roster,
+    # get roster (clients list), query media (room state), broadcast 'joined'
+    'client_join': 7,
+    'client_leave': 4,  # Get client, get room, broadcast 'left', transact client+roster
+    'client_name': 4,  # Update client, update roster entry, get room, broadcast
+    'client_synced': 4,  # Update client, update roster entry, get room, broadcast
+    'client_feedback': 0,  # Only publishes to SNS
+    'client_time': 0,  # Deprecated
+    # NOTE Payments are only for singit.cloud, so these are rejected before any requests
+    'payment_session': 0,
+    'payment_paid': 0,
+}
+
+# Extra database requests allowed per client in the room
+# NOTE Deleting a room evicts each of its clients individually (see `handle_room_delete`)
+BUDGETS_PER_CLIENT = {
+    'room_delete': 1,
+}
+# Fewer database requests expected when a guest's message is sent by the admin instead (in a room
+# of 1 client, where there are no guests)
+BUDGETS_ADMIN_SAVES = {
+    'room_message': 1,  # Admins can always chat, so room isn't read to check
+}
+
+
+def invoke(socket, event_type='MESSAGE', msg_type=None, **info):
+    body = json.dumps({'type': msg_type, 'info': info}) if msg_type else None
+    entrypoint.enter(make_event(socket, event_type, body), LambdaContext())
+
+
+def connect(socket):
+    memory.sockets.connect(socket)
+    invoke(socket, 'CONNECT')
+
+
+def setup(clients):
+    """Create a room with an admin, media, and guests, returning its id and secret"""
+    memory.reset()
+    connect('admin')
+    invoke('admin', msg_type='room_create', client_name="Admin", room_id_copy=None,
+        room_name=None)
+    created = memory.sockets.take('admin')[0]['info']
+    room_id = created['room']['id']
+    for n in range(MEDIA):
+        invoke('admin', msg_type='room_media_add', room_id=room_id, media_name=f"Song {n}",
+            media_type='youtube', media_content={'id': 'dQw4w9WgXcQ'})
+
+    # Put the last two songs out of order (so rearranging them has something to do)
+    media = WebsocketHandlers(make_event('admin'), LambdaContext()).media
+    for item, pos in ((media[-2], media[-1]['pos']), (media[-1], media[-2]['pos'])):
+        resources.get_table('media').update_item(Key={'room_id': room_id, 'id': item['id']},
+            UpdateExpression='SET pos=:pos', ExpressionAttributeValues={':pos': pos})
+
+    # Guests join directly (without broadcasting to everyone already there, for speed)
+    for n in range(clients - 1):
+        connect(f'guest{n}')
+        handlers = WebsocketHandlers(make_event(f'guest{n}'), LambdaContext())
+        handlers.client_join_room(room_id, False, f"Guest {n}")
+    connect('newcomer')
+    for socket in list(memory.sockets.connections):
+        memory.sockets.take(socket)
+    return room_id, created['secret']
+
+
+def scenarios(room_id, secret, clients):
+    """Return (handler, sender, event type, info) for every handler"""
+    guest = 'guest0' if clients > 1 else 'admin'
+    media = {item['name']: item['id']
+        for item in WebsocketHandlers(make_event('admin'), LambdaContext()).media}
+    media_id = media[f"Song {MEDIA - 2}"]
+    other_id = media[f"Song {MEDIA - 1}"]
+    return [
+        ('aws_connect', 'newcomer', 'CONNECT', {}),
+        ('aws_disconnect', guest, 'DISCONNECT', {}),
+        ('room_create', 'newcomer', 'MESSAGE', {'client_name': "New", 'room_id_copy': room_id,
+            'room_name': None}),
+        ('room_delete', 'admin', 'MESSAGE', {'room_id': room_id, 'room_secret': secret}),
+        ('room_name', 'admin', 'MESSAGE', {'room_id': room_id, 'room_name': "Renamed"}),
+        ('room_state_resync', guest, 'MESSAGE', {'room_id': room_id}),
+        ('room_clients_resync', guest, 'MESSAGE', {'room_id': room_id}),
+        ('room_message', guest, 'MESSAGE', {'room_id': room_id, 'room_message': "Hello"}),
+        ('room_admins_only_dj', 'admin', 'MESSAGE', {'room_id': room_id,
+            'room_admins_only': False}),
+        ('room_admins_only_see_clients', 'admin', 'MESSAGE', {'room_id': room_id,
+            'room_admins_only': True}),
+        ('room_admins_only_chat', 'admin', 'MESSAGE', {'room_id': room_id,
+            'room_admins_only': True}),
+        ('room_media_add', 'admin', 'MESSAGE', {'room_id': room_id, 'media_name': "Another",
+            'media_type': 'youtube', 'media_content': {'id': 'dQw4w9WgXcQ'}}),
+        # NOTE Moves the song that was added first back before the other (see `setup`)
+        ('room_media_rearrange', 'admin', 'MESSAGE', {'room_id': room_id, 'media_id': media_id,
+            'media_id_after': other_id}),
+        ('room_media_play', 'admin', 'MESSAGE', {'room_id': room_id, 'room_start': 1600000000}),
+        ('room_media_pause', 'admin', 'MESSAGE', {'room_id': room_id, 'room_paused': 12.5}),
+        ('room_media_load', 'admin', 'MESSAGE', {'room_id': room_id, 'media_id': media_id}),
+        ('room_media_remove', 'admin', 'MESSAGE', {'room_id': room_id, 'media_id': media_id}),
+        ('client_join', 'newcomer', 'MESSAGE', {'room_id': room_id, 'room_secret': None,
+            'client_name': "New"}),
+        ('client_leave', guest, 'MESSAGE', {'room_id': room_id}),
+        ('client_name', guest, 'MESSAGE', {'client_name': "Renamed"}),
+        ('client_synced', guest, 'MESSAGE', {'client_synced': True}),
+        ('client_feedback', guest, 'MESSAGE', {'client_feedback': "Great",
+            'client_user_agent': "Bench", 'client_email': None}),
+        ('client_time', guest, 'MESSAGE', {}),
+        # NOTE Payments are only for singit.cloud, so these only exercise rejecting the request
+        ('payment_session', guest, 'MESSAGE', {}),
+        ('payment_paid', guest, 'MESSAGE', {}),
+    ]
+
+
+# Ensure every handler has a budget and scenario
+handler_names = {name[len('handle_'):] for name in dir(WebsocketHandlers)
+    if name.startswith('handle_')}
+if handler_names != set(BUDGETS):
+    sys.exit(f"FAIL: Handlers without budgets: {handler_names ^ set(BUDGETS)}")
+
+failures = []
+for clients in SIZES:
+    room_id, secret = setup(clients)
+    snapshot = memory.database.snapshot()
+    print(f"\nRoom of {clients} clients\n")
+    print(f"{'handler':<30} {'ms':>8} {'db':>4} {'budget':>7} {'msgs':>6} {'posts':>6}"
+        f" {'errors':>7}")
+    for name, sender, event_type, info in scenarios(room_id, secret, clients):
+        memory.database.restore(snapshot)
+        if event_type == 'CONNECT':
+            memory.sockets.connect(sender)
+        elif event_type == 'DISCONNECT':
+            memory.sockets.disconnect(sender)  # Socket is already gone when told of disconnect
+        memory.reset_stats()
+
+        start = perf_counter()
+        try:
+            invoke(sender, event_type, name if event_type == 'MESSAGE' else None, **info)
+        except Exception as exc:
+            failures.append(f"{name} ({clients} clients) raised {exc!r}")
+        wall = (perf_counter() - start) * 1000
+        reporting.wait_for_reports()  # Errors are published in the background
+
+        db_calls = sum(memory.database.calls.values())
+        posts = memory.sockets.calls['post_to_connection']
+        inboxes = {socket: memory.sockets.take(socket)
+            for socket in list(memory.sockets.connections)}
+        msgs = sum(len(inbox) for inbox in inboxes.values())
+        errors = sum(1 for msg in memory.sns.published if 'API Error' in msg['Subject'])
+        budget = BUDGETS[name] + BUDGETS_PER_CLIENT.get(name, 0) * clients
+        if sender == 'admin':
+            budget -= BUDGETS_ADMIN_SAVES.get(name, 0)
+        print(f"{name:<30} {wall:>8.2f} {db_calls:>4} {budget:>7} {msgs:>6} {posts:>6}"
+            f" {errors:>7}")
+        if db_calls != budget:
+            failures.append(f"{name} ({clients} clients) made {db_calls} database requests"
+                f" (expected {budget})")
+        if name == 'room_delete':
+            # Admin should be told how many were evicted (everyone, including themself)
+            reply = [msg['info'] for msg in inboxes[sender] if msg['type'] == 'room_invalid'][-1]
+            if reply.get('evicted') != clients:
+                failures.append(f"room_delete ({clients} clients) reported"
+                    f" {reply.get('evicted')} evicted")
+
+        # Reset any sockets changed by the handler (inboxes were emptied above)
+        memory.sockets.connect(sender)
+
+# A $disconnect can come after the client was already reaped (see reaper.py)
+room_id, secret = setup(2)
+memory.sockets.disconnect('guest0')  # Gone without a $disconnect (yet)
+invoke('admin', msg_type='room_message', room_id=room_id, room_message="Hello")  # Reaps guest0
+if 'Item' in memory.database.Table('bench-clients').get_item(Key={'socket': 'guest0'}):
+    failures.append("Gone client wasn't reaped before its $disconnect")
+for socket in list(memory.sockets.connections):
+    memory.sockets.take(socket)
+memory.reset_stats()
+start = perf_counter()
+try:
+    invoke('guest0', 'DISCONNECT')
+except Exception as exc:
+    failures.append(f"aws_disconnect (after reaped) raised {exc!r}")
+wall = (perf_counter() - start) * 1000
+reporting.wait_for_reports()
+db_calls = sum(memory.database.calls.values())
+posts = memory.sockets.calls['post_to_connection']
+msgs = sum(len(memory.sockets.take(socket)) for socket in list(memory.sockets.connections))
+errors = sum(1 for msg in memory.sns.published if 'API Error' in msg['Subject'])
+print(f"\n{'aws_disconnect (after reaped)':<30} {wall:>8.2f} {db_calls:>4}"
+    f" {BUDGETS['aws_disconnect']:>7} {msgs:>6} {posts:>6} {errors:>7}")
+if posts or errors:
+    failures.append(f"aws_disconnect (after reaped) made {posts} posts and {errors} errors"
+        " (should be treated as already disconnected)")
+
+if failures:
+    sys.exit("\nFAIL:\n  " + "\n  ".join(failures))
+print("\nOK: All handlers made the database requests expected")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Estimate write units used by each playlist edit when the whole media list is stored in the room
+record (as was done before) vs one item per media item (as is done now)
+
+    python bench_playlist.py [items...]
+
+Sizes follow DynamoDB's documented rules (transactions cost double):
+    https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/CapacityUnitCalculations.html
+
+"""
+
+import sys
+from math import ceil
+
+
+SIZES = [int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 300]
+
+
+def value_size(value):
+    if isinstance(value, dict):
+        return 3 + sum(len(key) + 1 + value_size(val) for key, val in value.items())
+    if isinstance(value, list):
+        return 3 + sum(1 + value_size(val) for val in value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bool) or value is None:
+        return 1
+    return ceil(len(str(value).replace('.', '')) / 2) + 1
+
+
+def item_size(item):
+    return sum(len(key) + value_size(value) for key, value in item.items())
+
+
+def wcu(item):
+    return ceil(item_size(item) / 1024)
+
+
+def make_media(n):
+    # Typical YouTube item (see `handle_room_media_add`)
+    return {
+        'id': f'aB3dE{n:03d}',
+        'name': "Some Artist - Some Song Title (Official Music Video)",
+        'type': 'youtube',
+        'content': {'id': 'dQw4w9WgXcQ'},
+    }
+
+
+def make_room(**fields):
+    # Typical room (see `handle_room_create`)
+    return {
+        'id': 'aB3dE5gH',
+        'secret': 'x' * 43,
+        'created': 1600000000.123456,
+        'expire': 1602592000.123456,
+        'name': "Room of Some Person",
+        'start': 1600000000.123456,
+        'paused': None,
+        'admins_only_dj': True,
+        'admins_only_see_clients': False,
+        'admins_only_chat': False,
+        'version': 123,
+        **fields,
+    }
+
+
+print(f"{'items':>6} {'before (any edit)':>18} {'add/remove':>11} {'load':>5} {'rearrange':>10}")
+for size in SIZES:
+    media = [make_media(n) for n in range(size)]
+
+    # Before: every edit rewrote the room record including all of its media
+    before = wcu(make_room(media=media, loaded=0))
+
+    # Now: a transaction that updates the room and puts/deletes only the media items changed
+    room = make_room(media_end=size - 1, loaded_id=media[0]['id'])
+    item = {**media[0], 'room_id': room['id'], 'pos': size - 1, 'expire': room['expire']}
+    load = 2 * wcu(room)
+    single = 2 * (wcu(room) + wcu(item))
+    swap = 2 * (wcu(room) + 2 * wcu(item))
+
+    print(f"{size:>6} {before:>18} {single:>11} {load:>5} {swap:>10}")
+
+print("\nNOTE Now constant regardless of playlist size (though transactions cost double)")
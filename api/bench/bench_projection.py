@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Estimate item sizes and capacity units for the by_room index with its previous projection (ALL)
+vs by_room_lean's (INCLUDE name, room_admin, room_synced) for a room of clients, and while both
+indexes exist (until by_room is removed)
+
+    python bench_projection.py [clients]
+
+Sizes follow DynamoDB's documented rules:
+    https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/CapacityUnitCalculations.html
+    https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/GSI.html#GSI.ThroughputConsiderations
+
+"""
+
+import sys
+from math import ceil
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+INDEX_ITEM_OVERHEAD = 100  # Bytes DynamoDB adds to every index item
+INDEX_KEYS = {'socket', 'room_id', 'room_joined'}  # Table and index keys are always projected
+PROJECTIONS = {
+    'ALL': None,
+    'INCLUDE': INDEX_KEYS | {'name', 'room_admin', 'room_synced'},
+    'KEYS_ONLY': INDEX_KEYS,  # For comparison (clients lists would then need to get every item)
+}
+
+
+def value_size(value):
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bool) or value is None:
+        return 1
+    # Numbers take ~1 byte per 2 significant digits plus 1
+    digits = len(str(Decimal(str(value))).replace('.', '').replace('-', '').strip('0'))
+    return ceil(digits / 2) + 1
+
+
+def item_size(item, attributes=None):
+    return sum(len(key) + value_size(value) for key, value in item.items()
+        if attributes is None or key in attributes)
+
+
+def make_client(n):
+    # Typical client record in a room (see `handle_aws_connect` and `client_join_room`)
+    now = datetime.now()
+    return {
+        'socket': f'L0SM9cOFvHcCI{n:03d}=',  # API Gateway connection ids are 16 chars
+        'expire': (now + timedelta(days=1)).timestamp(),
+        'name': "Participant Name",
+        'room_id': 'aB3dE5gH',
+        'room_joined': now.timestamp(),
+        'room_admin': n == 0,
+        'room_synced': 12,
+    }
+
+
+def costs(indexes, queried):
+    """Return size of a client's index items, the room's size in all indexes, RCU to query the
+    room's clients from the queried index, and WCU to join/leave/sync (for the given projections)
+
+    """
+    sizes = {name: [item_size(client, PROJECTIONS[name]) + INDEX_ITEM_OVERHEAD
+        for client in clients] for name in indexes}
+
+    # Queries are eventually consistent (0.5 RCU per 4 KB read)
+    # NOTE ProjectionExpression doesn't reduce cost, only what index stores does
+    rcu = ceil(sum(sizes[queried]) / 4096) * 0.5
+
+    # Every update to a projected attribute also writes the index item (1 WCU per 1 KB)
+    # NOTE Joining/leaving changes index key (room_id) so costs a delete and a put to the index
+    join_wcu = sync_wcu = 1
+    for name in indexes:
+        index_wcu = ceil(sizes[name][0] / 1024)
+        join_wcu += 2 * index_wcu
+        if PROJECTIONS[name] is None or 'room_synced' in PROJECTIONS[name]:
+            sync_wcu += index_wcu
+
+    item = sum(index_sizes[0] for index_sizes in sizes.values())
+    total = sum(sum(index_sizes) for index_sizes in sizes.values())
+    return item, total, rcu, f"{join_wcu}/{join_wcu}/{sync_wcu}"
+
+
+clients = [make_client(n) for n in range(CLIENTS)]
+print(f"Room of {CLIENTS} clients (table item ~{item_size(clients[0])} bytes)\n")
+print(f"{'projection':<11} {'index item':>11} {'index size':>11} {'query RCU':>10}"
+    f" {'join/leave/sync WCU':>20}")
+rows = [(name, costs([name], name)) for name in PROJECTIONS]
+# While by_room (ALL) remains alongside by_room_lean (INCLUDE), every write goes to both indexes
+# NOTE Until it's removed (see api/FOLLOW_UPS.md), so costs more than either did alone
+rows.append(('ALL+INCLUDE', costs(['ALL', 'INCLUDE'], 'INCLUDE')))
+for name, (item, total, rcu, wcu) in rows:
+    print(f"{name:<11} {item:>9} B {total/1024:>8.1f} KB {rcu:>10.1f} {wcu:>20}")
+
+print("\nNOTE Client items are small enough that every write is 1 WCU either way, so the saving"
+    "\n     is in index storage and query reads (which grow with room size)")
+print("NOTE ALL+INCLUDE is the interim cost while both indexes exist (queries use INCLUDE), which"
+    "\n     is more than before until the ALL index is removed (see api/FOLLOW_UPS.md)")
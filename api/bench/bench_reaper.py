@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Check clients whose sockets went without a $disconnect are removed from their room when a broadcast
+finds them gone (with one diff telling the room) and by the periodic sweep, then compare the posts
+made by later broadcasts before (ghosts posted to every time) vs after reaping
+
+    python bench_reaper.py [clients] [ghosts] [broadcasts]
+
+Runs against the memory backend and exits with an error if any check fails
+
+"""
+
+import os
+import sys
+import json
+from time import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+os.environ['BACKEND'] = 'memory'
+os.environ['ROSTER_FLUSH_INTERVAL'] = '0'
+os.environ.setdefault('STACK', 'bench')
+os.environ.setdefault('TOPIC_ERRORS', 'errors')
+os.environ.setdefault('TOPIC_CONTACT', 'contact')
+
+import memory
+import resources
+import entrypoint
+from memory import make_event, LambdaContext
+from handlers import WebsocketHandlers
+from reaper import SOCKET_MAX_DURATION, sweep_clients
+
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+GHOSTS = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+BROADCASTS = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+resources._cache['config'] = {'domain': 'localhost', 'secrets': {'stripe_key_private': 'x'}}
+
+
+def check(condition, description):
+    if not condition:
+        sys.exit(f"FAIL: {description}")
+
+
+def invoke(socket, event_type='MESSAGE', msg_type=None, **info):
+    body = json.dumps({'type': msg_type, 'info': info}) if msg_type else None
+    entrypoint.enter(make_event(socket, event_type, body), LambdaContext())
+
+
+def setup():
+    """Create a room of an admin and guests, with some guests' sockets gone, returning room id"""
+    memory.reset()
+    memory.sockets.connect('admin')
+    invoke('admin', 'CONNECT')
+    invoke('admin', msg_type='room_create', client_name="Admin", room_id_copy=None,
+        room_name=None)
+    room_id = memory.sockets.take('admin')[0]['info']['room']['id']
+    for n in range(CLIENTS - 1):
+        memory.sockets.connect(f'guest{n}')
+        invoke(f'guest{n}', 'CONNECT')
+        WebsocketHandlers(make_event(f'guest{n}'), LambdaContext()).client_join_room(room_id,
+            False, f"Guest {n}")
+    for n in range(GHOSTS):
+        memory.sockets.disconnect(f'guest{n}')  # Gone without a $disconnect
+    for socket in list(memory.sockets.connections):
+        memory.sockets.take(socket)
+    return room_id
+
+
+def roster(room_id):
+    """Return the room's summary and the sockets of the clients in it"""
+    summary = memory.database.Table('bench-rosters').get_item(Key={'room_id': room_id})['Item']
+    sockets = {item['socket'] for item in memory.database.Table('bench-clients').scan()['Items']
+        if item['room_id'] == room_id}
+    return summary, sockets
+
+
+def count_gone(params, **kwargs):
+    if params['ConnectionId'] not in memory.sockets.connections:
+        posts_to_gone[0] += 1
+
+
+posts_to_gone = [0]
+memory.sockets.events.register('before-parameter-build.apigatewaymanagementapi.PostToConnection',
+    count_gone)
+
+
+def broadcast(room_id):
+    """Send a chat message to the room, returning posts made and how many were to gone sockets"""
+    memory.reset_stats()
+    posts_to_gone[0] = 0
+    invoke('admin', msg_type='room_message', room_id=room_id, room_message="Hello")
+    return memory.sockets.calls['post_to_connection'], posts_to_gone[0]
+
+
+# Reaping when found gone
+room_id = setup()
+posts, gone = broadcast(room_id)
+check(gone == GHOSTS, f"First broadcast found {GHOSTS} gone (found {gone})")
+summary, sockets = roster(room_id)
+check(len(sockets) == CLIENTS - GHOSTS, "Gone clients deleted")
+check(summary['total'] == CLIENTS - GHOSTS, "Roster summary total corrected")
+check(not any(key == f'client:guest{n}' for key in summary for n in range(GHOSTS)),
+    "Gone clients removed from roster summary entries")
+diffs = [msg['info']['diffs'] for msg in memory.sockets.take(f'guest{GHOSTS}')
+    if msg['type'] == 'room_clients_diff']
+check(len(diffs) == 1 and sorted(diff['socket'] for diff in diffs[0])
+    == sorted(f'guest{n}' for n in range(GHOSTS)), "Room told of all reaped in one diff")
+for socket in list(memory.sockets.connections):
+    memory.sockets.take(socket)
+posts, gone = broadcast(room_id)
+diffs = [msg for msg in memory.sockets.take(f'guest{GHOSTS}') if msg['type'] == 'room_clients_diff']
+check(gone == 0 and not diffs, "Next broadcast only posts to live sockets")
+print(f"OK: {GHOSTS} gone clients reaped by first broadcast")
+
+# Reaping when sweeping
+room_id = setup()
+for n in range(GHOSTS):
+    memory.database.Table('bench-clients').items[(f'guest{n}',)]['expire'] -= SOCKET_MAX_DURATION
+check(sweep_clients(resources.get_db(), resources.get_table('clients'),
+    resources.get_table('rosters')) == GHOSTS, "Sweep reaped all connected for too long")
+summary, sockets = roster(room_id)
+check(len(sockets) == CLIENTS - GHOSTS and summary['total'] == CLIENTS - GHOSTS,
+    "Sweep corrected clients and roster summary")
+check(sweep_clients(resources.get_db(), resources.get_table('clients'),
+    resources.get_table('rosters'), now=time()) == 0, "Sweep leaves recent clients")
+print("OK: Clients connected for longer than sockets last reaped by sweep\n")
+
+# Posts made by later broadcasts
+print(f"{BROADCASTS} broadcasts to a room of {CLIENTS} with {GHOSTS} gone\n")
+print(f"{'':<8}{'posts':>8}{'gone':>8}")
+reap_gone_sockets = WebsocketHandlers.reap_gone_sockets
+for name, reap in (('before', lambda self, sockets: None), ('after', reap_gone_sockets)):
+    WebsocketHandlers.reap_gone_sockets = reap
+    room_id = setup()
+    totals = [0, 0]
+    for _ in range(BROADCASTS):
+        posts, gone = broadcast(room_id)
+        totals = [totals[0] + posts, totals[1] + gone]
+    print(f"{name:<8}{totals[0]:>8}{totals[1]:>8}")
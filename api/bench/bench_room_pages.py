@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Check that room membership queries follow every page of results, that broadcasts reach every
+client once the outbox is flushed, and that memory used by paging through a room stays bounded by
+page size (not room size)
+
+    python bench_room_pages.py [clients] [page_size]
+
+Runs against the memory backend (see memory.py) with its page size lowered to fit about
+`page_size` clients (rather than 1 MB) and exits with an error if any check fails
+
+"""
+
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+os.environ['BACKEND'] = 'memory'
+os.environ.setdefault('STACK', 'bench')
+
+import memory
+import resources
+from memory import make_event, LambdaContext, item_size
+from handlers import WebsocketHandlers
+
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+PAGE_SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else 150
+resources._cache['config'] = {'domain': 'localhost', 'secrets': {'stripe_key_private': 'x'}}
+
+
+def make_client(n):
+    return {'socket': f'socket{n}', 'name': f'Name {n}', 'room_id': 'room', 'room_joined': n,
+        'room_admin': n % 10 == 0, 'room_synced': None}
+
+
+def setup(count):
+    """Create a room of clients (without a roster summary, so lists must query the index)"""
+    memory.reset()
+    resources.get_table('rooms').put_item(Item={'id': 'room', 'admins_only_see_clients': False})
+    with resources.get_table('clients').batch_writer() as batch:
+        for n in range(count):
+            batch.put_item(Item=make_client(n))
+            memory.sockets.connect(f'socket{n}')
+    memory.reset_stats()
+    return WebsocketHandlers(make_event('socket0'), LambdaContext())
+
+
+def count_pages(**query):
+    """Return how many pages the by_room_lean index has for the room's clients"""
+    table = resources.get_table('clients')
+    query = {'IndexName': 'by_room_lean', 'KeyConditionExpression': 'room_id=:room_id',
+        'ExpressionAttributeValues': {':room_id': 'room'}, **query}
+    pages = 0
+    while True:
+        resp = table.query(**query)
+        pages += 1
+        if 'LastEvaluatedKey' not in resp:
+            return pages
+        query['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def check(condition, message):
+    if not condition:
+        sys.exit(f"FAIL: {message}")
+    print(f"OK: {message}")
+
+
+# Broadcast to every client
+# NOTE Pages by bytes like DynamoDB, but sized for about PAGE_SIZE clients (all fields projected)
+handlers = setup(CLIENTS)
+memory.MAX_PAGE_SIZE = PAGE_SIZE * item_size(
+    resources.get_table('clients').get_item(Key={'socket': 'socket0'})['Item'])
+memory.reset_stats()
+handlers.send(handlers.get_client_sockets(), 'room_state', {})
+pages = memory.database.calls['query']
+check(pages > 1 and pages == count_pages(ProjectionExpression='socket'),
+    f"Fetched all {pages} pages")
+check(not memory.sockets.calls['post_to_connection'], "Nothing sent until the outbox is flushed")
+handlers.flush_outbox()
+received = [len(memory.sockets.take(f'socket{n}')) for n in range(CLIENTS)]
+check(memory.sockets.calls['post_to_connection'] == CLIENTS and set(received) == {1},
+    f"Sent to all {CLIENTS} clients exactly once")
+
+# Clients list should count everyone but only list those displayed
+admins, guests = handlers.room_clients()
+check(admins['total'] == CLIENTS, f"Clients list counted all {CLIENTS} clients")
+check(len(admins['admins']) + len(admins['guests']) == min(100, CLIENTS), "Clients list limited")
+
+# Filtered queries should still follow all pages (even when some pages have no matches)
+handlers = setup(CLIENTS)
+check(len(list(handlers.get_client_sockets(admins=True))) == -(-CLIENTS // 10),
+    "Found all admins across pages")
+
+# Memory used by broadcasting should be about the same no matter the room size
+# NOTE Measured between pages (as the memory backend itself sorts the whole index for each page),
+#      after iterating once so the interpreter's free lists are already filled
+peaks = []
+for size in (CLIENTS, CLIENTS * 5):
+    handlers = setup(size)
+    for socket in handlers.get_client_sockets():
+        pass
+    tracemalloc.start()
+    peak = 0
+    for socket in handlers.get_client_sockets():
+        peak = max(peak, tracemalloc.get_traced_memory()[0])
+    peaks.append(peak)
+    tracemalloc.stop()
+print(f"\nPeak memory iterating sockets: {peaks[0]/1024:.0f} KiB for {CLIENTS} clients,"
+    f" {peaks[1]/1024:.0f} KiB for {CLIENTS * 5}")
+# NOTE Allowing for small variations (e.g. interpreter free lists) but not even a pointer per client
+check(peaks[1] - peaks[0] < CLIENTS * 4 * 8, "Memory bounded by page size rather than room size")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Compare the size of messages broadcast for common room changes when sending the full room state
+(as was done before) vs only a patch of what changed
+
+    python bench_room_patch.py [media_items]
+
+Runs the real entrypoint against the memory backend (see memory.py) and records what a guest of the
+room is sent
+
+"""
+
+import os
+import sys
+import json
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+os.environ['BACKEND'] = 'memory'
+os.environ.setdefault('STACK', 'bench')
+os.environ.setdefault('TOPIC_ERRORS', 'errors')
+os.environ.setdefault('TOPIC_CONTACT', 'contact')
+os.environ.setdefault('ROSTER_QUEUE_URL', 'rosters')
+
+import memory
+import resources
+import entrypoint
+from memory import make_event, LambdaContext
+from handlers import WebsocketHandlers
+
+
+ITEMS = max(3, int(sys.argv[1]) if len(sys.argv) > 1 else 100)  # Changes need a few items
+resources._cache['config'] = {'domain': 'localhost', 'secrets': {'stripe_key_private': 'x'}}
+
+
+def invoke(socket, event_type='MESSAGE', msg_type=None, **info):
+    body = json.dumps({'type': msg_type, 'info': info}) if msg_type else None
+    entrypoint.enter(make_event(socket, event_type, body), LambdaContext())
+
+
+def make_media(room, n):
+    # Typical YouTube item (see `handle_room_media_add`)
+    return {
+        'room_id': room['id'],
+        'id': f'aB3dE{n:03d}',
+        'pos': n,
+        'name': "Some Artist - Some Song Title (Official Music Video)",
+        'type': 'youtube',
+        'content': {'id': 'dQw4w9WgXcQ'},
+        'expire': room['expire'],
+    }
+
+
+# Create a room with an admin and a guest, and fill its playlist
+for socket in ('admin', 'guest'):
+    memory.sockets.connect(socket)
+    invoke(socket, 'CONNECT')
+invoke('admin', msg_type='room_create', client_name="Admin", room_id_copy=None,
+    room_name="Room of Some Person")
+room = memory.sockets.take('admin')[0]['info']['room']
+room = resources.get_table('rooms').get_item(Key={'id': room['id']})['Item']
+with resources.get_table('media').batch_writer() as batch:
+    for n in range(ITEMS):
+        batch.put_item(Item=make_media(room, n))
+resources.get_table('rooms').update_item(Key={'id': room['id']},
+    UpdateExpression='SET media_end=:end, loaded_id=:loaded, paused=:paused',
+    ExpressionAttributeValues={':end': ITEMS - 1, ':loaded': 'aB3dE000', ':paused': 0})
+invoke('guest', msg_type='client_join', room_id=room['id'], client_name="Guest", room_secret=None)
+memory.sockets.take('guest')
+
+changes = [
+    ('play', 'room_media_play', {'room_start': 1600000000.123}),
+    ('pause', 'room_media_pause', {'room_paused': 12.5}),
+    ('load', 'room_media_load', {'media_id': 'aB3dE001'}),
+    ('add', 'room_media_add', {'media_name': "Another Song", 'media_type': 'youtube',
+        'media_content': {'id': 'dQw4w9WgXcQ'}}),
+    ('rearrange', 'room_media_rearrange', {'media_id': 'aB3dE002',
+        'media_id_after': 'aB3dE001'}),
+    ('remove', 'room_media_remove', {'media_id': 'aB3dE001'}),
+    ('rename', 'room_name', {'room_name': "New Name"}),
+]
+
+print(f"Bytes broadcast for a room with {ITEMS} media items\n")
+print(f"{'change':<10} {'full state':>11} {'patch':>6}")
+for name, msg_type, info in changes:
+    invoke('admin', msg_type=msg_type, room_id=room['id'], **info)
+    patches = [msg for msg in memory.sockets.take('guest') if msg['type'] == 'room_patch']
+    if len(patches) != 1:
+        sys.exit(f"FAIL: Guest wasn't sent a patch for {name}")
+    state = WebsocketHandlers(make_event('guest'), LambdaContext()).room_state()
+    full = len(json.dumps({'type': 'room_state', 'info': state}))
+    print(f"{name:<10} {full:>11} {len(json.dumps(patches[0])):>6}")
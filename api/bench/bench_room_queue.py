@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Compare a burst of DJ actions sent to a room at once by several admins when handled straight away
+vs queued and applied in batches (see room_queue.py), counting room writes, patches broadcast and
+actions rejected because the room was changed by another at the same time
+
+    python bench_room_queue.py [actions] [admins] [guests]
+
+Runs against the memory backend (with its in-memory queue) and exits with an error if the queued
+actions aren't all applied in order, or guests can't apply every patch broadcast
+
+"""
+
+import os
+import sys
+import json
+import threading
+from math import ceil
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+os.environ['BACKEND'] = 'memory'
+os.environ.setdefault('STACK', 'bench')
+os.environ.setdefault('TOPIC_ERRORS', 'errors')
+os.environ.setdefault('TOPIC_CONTACT', 'contact')
+os.environ.setdefault('ROOM_QUEUE_URL', 'rooms.fifo')
+
+import memory
+import resources
+import handlers
+import entrypoint
+from memory import make_event, LambdaContext
+from handlers import WebsocketHandlers
+
+
+ACTIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+ADMINS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+GUESTS = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+BATCH_SIZE = 10  # Max Lambda gives from a FIFO queue at once
+resources._cache['config'] = {'domain': 'localhost', 'secrets': {'stripe_key_private': 'x'}}
+memory.database.latency = 0.002  # So concurrent actions overlap like they would over a network
+
+
+def check(condition, description):
+    if not condition:
+        sys.exit(f"FAIL: {description}")
+
+
+def invoke(socket, msg_type=None, request_id=None, **info):
+    body = json.dumps({'type': msg_type, 'info': info}) if msg_type else None
+    event = make_event(socket, 'MESSAGE' if msg_type else 'CONNECT', body)
+    event['requestContext']['requestId'] = request_id
+    entrypoint.enter(event, LambdaContext())
+
+
+def setup():
+    """Create a room with admins and guests, returning its id"""
+    memory.reset()
+    for n in range(ADMINS):
+        memory.sockets.connect(f'admin{n}')
+        invoke(f'admin{n}')
+    invoke('admin0', 'room_create', client_name="Admin", room_id_copy=None, room_name=None)
+    room_id = memory.sockets.take('admin0')[0]['info']['room']['id']
+    for n in range(1, ADMINS):
+        WebsocketHandlers(make_event(f'admin{n}'), LambdaContext()).client_join_room(room_id,
+            True, f"Admin {n}")
+    for n in range(GUESTS):
+        memory.sockets.connect(f'guest{n}')
+        invoke(f'guest{n}')
+        WebsocketHandlers(make_event(f'guest{n}'), LambdaContext()).client_join_room(room_id,
+            False, f"Guest {n}")
+    invoke('admin0', 'room_media_add', room_id=room_id, media_name="First", media_type='youtube',
+        media_content={'id': 'dQw4w9WgXcQ'})
+    drain()  # In case queued
+    for socket in list(memory.sockets.connections):
+        memory.sockets.take(socket)
+    memory.reset_stats()
+    return room_id
+
+
+def actions(room_id):
+    """Return the burst of (sender, msg_type, info) to send, in order"""
+    burst = []
+    for n in range(ACTIONS):
+        kind = n % 4
+        if kind == 0:
+            info = {'media_name': f"Song {n}", 'media_type': 'youtube',
+                'media_content': {'id': 'dQw4w9WgXcQ'}}
+            msg_type = 'room_media_add'
+        elif kind == 1:
+            info = {'room_start': 1600000000 + n}
+            msg_type = 'room_media_play'
+        elif kind == 2:
+            info = {'room_paused': float(n)}
+            msg_type = 'room_media_pause'
+        else:
+            info = {'room_name': f"Room {n}"}
+            msg_type = 'room_name'
+        burst.append((f'admin{n % ADMINS}', msg_type, {'room_id': room_id, **info}))
+    return burst
+
+
+def send_burst(burst):
+    """Send each admin's actions in order, with admins sending at the same time"""
+    def send_all(admin):
+        for n, (sender, msg_type, info) in enumerate(burst):
+            if sender == admin:
+                invoke(sender, msg_type, f'request{n}', **info)
+    threads = [threading.Thread(target=send_all, args=(f'admin{n}',)) for n in range(ADMINS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def drain():
+    """Give queued messages to the worker in batches (as Lambda does) until none left"""
+    while True:
+        records = memory.queue.take(os.environ['ROOM_QUEUE_URL'], BATCH_SIZE)
+        if not records:
+            return
+        resp = entrypoint.drain({'Records': records}, LambdaContext())
+        failed = {item['itemIdentifier'] for item in resp['batchItemFailures']}
+        check(not failed, "All batches applied")
+
+
+def results(room_id):
+    """Return counts of room writes, patches a guest received, and actions rejected"""
+    writes = memory.database.calls['transact_write_items'] + memory.database.calls['update_item']
+    patches = [msg['info'] for msg in memory.sockets.take('guest0') if msg['type'] == 'room_patch']
+    rejected = sum(1 for n in range(ADMINS) for msg in memory.sockets.take(f'admin{n}')
+        if msg['type'] in ('client_confused', 'client_error'))
+    return writes, patches, rejected
+
+
+print(f"{ACTIONS} DJ actions sent at once by {ADMINS} admins to a room with {GUESTS} guests\n")
+print(f"{'':<10}{'writes':>8}{'patches':>9}{'rejected':>10}")
+
+# Handled straight away
+room_id = setup()
+send_burst(actions(room_id))
+writes, patches, rejected = results(room_id)
+print(f"{'before':<10}{writes:>8}{len(patches):>9}{rejected:>10}")
+
+# Queued and applied in batches
+# NOTE Enabled here rather than via env so both can be compared in one process
+handlers.ROOM_QUEUE = True
+room_id = setup()
+send_burst(actions(room_id))
+queued = [json.loads(record['body'])
+    for record in memory.queue.messages(os.environ['ROOM_QUEUE_URL'])]
+drain()
+writes, patches, rejected = results(room_id)
+print(f"{'queued':<10}{writes:>8}{len(patches):>9}{rejected:>10}\n")
+
+# Check all were applied, in order
+check(len(queued) == ACTIONS, "Every action queued")
+check(writes == ceil(ACTIONS / BATCH_SIZE), "One write per batch")
+check(len(patches) == ceil(ACTIONS / BATCH_SIZE), "One patch per batch")
+check(rejected == 0, "No actions rejected")
+versions = [patch['changes']['version'] for patch in patches]
+check(versions == list(range(versions[0], versions[0] + len(versions))),
+    "Each patch follows the last (so guests can apply all of them)")
+room = resources.get_table('rooms').get_item(Key={'id': room_id})['Item']
+media = resources.get_table('media').query(KeyConditionExpression='room_id=:id',
+    ExpressionAttributeValues={':id': room_id})['Items']
+expected = {}
+for message in queued:
+    info = message['info']
+    if message['type'] == 'room_name':
+        expected.update(name=info['room_name'])
+    elif message['type'] == 'room_media_play':
+        expected.update(start=info['room_start'], paused=None)
+    elif message['type'] == 'room_media_pause':
+        expected.update(start=None, paused=info['room_paused'])
+check(all(room[key] == val for key, val in expected.items()),
+    "Room ends with the effect of the last of each kind of action (in order queued)")
+added = [message['info']['media_name'] for message in queued
+    if message['type'] == 'room_media_add']
+check([item['name'] for item in sorted(media, key=lambda item: item['pos'])][1:] == added,
+    "Every media item added (in order queued)")
+print("OK: All queued actions applied, with one write and one patch per batch")
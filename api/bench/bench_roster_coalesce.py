@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Simulate a storm of client_synced messages (all clients reporting within a couple of seconds of
+play) and count how many roster broadcasts are made, with and without coalescing, and how long
+each message takes to handle (as coalescing mustn't make invocations wait for the interval)
+
+    python bench_roster_coalesce.py [clients] [storm_seconds] [flush_interval]
+
+Each message runs in its own thread (as concurrent invocations would) against the memory backend
+(see memory.py), counting what one client of the room is sent, while another thread drains the
+rosters queue as FunctionRoomQueue would (see `flush_room_clients_diffs`). Also checks that no
+diffs are lost when a flush fails and is retried. Exits with an error if coalescing doesn't reduce
+broadcasts to ~1 per flush window.
+
+"""
+
+import os
+import sys
+import random
+import threading
+from math import ceil
+from time import sleep, perf_counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+os.environ['BACKEND'] = 'memory'
+os.environ.setdefault('STACK', 'bench')
+os.environ.setdefault('TOPIC_ERRORS', 'errors')
+os.environ.setdefault('ROSTER_QUEUE_URL', 'rosters')
+
+import memory
+import handlers
+import resources
+import entrypoint
+from memory import make_event, LambdaContext
+from handlers import WebsocketHandlers
+
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+STORM = float(sys.argv[2]) if len(sys.argv) > 2 else 2
+INTERVAL = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+resources._cache['config'] = {'domain': 'localhost', 'secrets': {'stripe_key_private': 'x'}}
+
+
+def setup():
+    """Create a room of clients (all connected)"""
+    memory.reset()
+    resources.get_table('rooms').put_item(Item={'id': 'room', 'admins_only_see_clients': False})
+    with resources.get_table('clients').batch_writer() as batch:
+        for n in range(CLIENTS):
+            batch.put_item(Item={'socket': f'socket{n}', 'name': None, 'room_id': 'room',
+                'room_joined': n, 'room_admin': False, 'room_synced': None})
+            memory.sockets.connect(f'socket{n}')
+
+
+def drain(done):
+    """Give due roster flushes to the worker (as Lambda would) until done and none are left"""
+    url = os.environ['ROSTER_QUEUE_URL']
+    while True:
+        records = memory.queue.take(url)
+        if records:
+            resp = entrypoint.drain({'Records': records}, LambdaContext())
+            failed = {item['itemIdentifier'] for item in resp['batchItemFailures']}
+            memory.queue.put_back(url, [r for r in records if r['messageId'] in failed])
+        elif done.is_set() and not memory.queue.messages(url):
+            return
+        else:
+            sleep(0.01)
+
+
+def storm(interval):
+    """Have every client report synced at a random time within the storm
+
+    Returns the slowest message's seconds, and the broadcasts and diffs the first client was sent
+
+    """
+    handlers.ROSTER_FLUSH_INTERVAL = interval
+    setup()
+    durations = []
+
+    def client_synced(socket):
+        sleep(random.uniform(0, STORM))
+        start = perf_counter()
+        handler = WebsocketHandlers(make_event(socket), LambdaContext())
+        handler.client['room_synced'] = random.randint(0, 50)
+        handler.broadcast_room_clients_diff('changed', ['synced'])
+        handler.flush_outbox()
+        durations.append(perf_counter() - start)
+
+    done = threading.Event()
+    worker = threading.Thread(target=drain, args=(done,))
+    worker.start()
+    threads = [threading.Thread(target=client_synced, args=(f'socket{n}',)) for n in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    worker.join()
+    broadcasts = [msg['info']['diffs'] for msg in memory.sockets.take('socket0')
+        if msg['type'] == 'room_clients_diff']
+    return max(durations), len(broadcasts), sum(len(diffs) for diffs in broadcasts)
+
+
+def fail_once(method):
+    """Make a method raise the first time it's called (as if the worker died)"""
+    failed = []
+
+    def wrapped(*args, **kwargs):
+        if not failed:
+            failed.append(True)
+            raise Exception("Worker died")
+        return method(*args, **kwargs)
+    return wrapped
+
+
+print(f"{CLIENTS} clients syncing within {STORM}s\n")
+
+slowest, uncoalesced, _ = storm(0)
+print(f"Without coalescing: {uncoalesced} broadcasts (slowest message {slowest * 1000:.0f} ms)")
+
+slowest, broadcasts, diffs_sent = storm(INTERVAL)
+print(f"With {INTERVAL}s window: {broadcasts} broadcasts ({diffs_sent} diffs)"
+    f" (slowest message {slowest * 1000:.0f} ms)")
+
+# A flush that fails before sending is retried without losing any diffs
+send = WebsocketHandlers.send_room_clients_diffs
+WebsocketHandlers.send_room_clients_diffs = fail_once(send)
+_, retried_broadcasts, retried_diffs = storm(INTERVAL)
+WebsocketHandlers.send_room_clients_diffs = send
+print(f"With a failed flush: {retried_broadcasts} broadcasts ({retried_diffs} diffs)")
+
+# Expect about one broadcast per window (allowing one extra for a window straddling the end)
+windows = ceil(STORM / INTERVAL) + 1
+assert uncoalesced == CLIENTS
+assert diffs_sent == CLIENTS, "Diffs were lost"
+assert retried_diffs == CLIENTS, "Diffs were lost when a flush failed"
+assert broadcasts <= windows, f"Expected at most {windows} broadcasts"
+assert slowest < INTERVAL, "Messages waited for the flush interval"
+print(f"\nOK: {uncoalesced} -> {broadcasts} broadcasts (at most {windows} expected)")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Check that room roster summaries stay exact when clients join, leave and disconnect concurrently
+(including the same client leaving and disconnecting at once), then compare the reads needed to
+get a room's clients list from the summary vs querying every client of the room
+
+    python bench_roster_summary.py [clients] [rounds]
+
+Runs against the memory backend (see memory.py), which applies transactions atomically and cancels
+them on failed conditions like DynamoDB, with a little latency so concurrent requests interleave.
+Exits with an error if any check fails
+
+"""
+
+import os
+import sys
+import random
+import threading
+from time import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+os.environ['BACKEND'] = 'memory'
+os.environ.setdefault('STACK', 'bench')
+
+import memory
+import handlers
+import resources
+from memory import make_event, LambdaContext
+from handlers import WebsocketHandlers
+
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+ROUNDS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+resources._cache['config'] = {'domain': 'localhost', 'secrets': {'stripe_key_private': 'x'}}
+memory.database.latency = 0.001
+
+
+def make_handlers(socket):
+    return WebsocketHandlers(make_event(socket), LambdaContext())
+
+
+def connect(socket):
+    resources.get_table('clients').put_item(Item={'socket': socket, 'name': None, 'room_id': '#',
+        'room_joined': 0, 'room_admin': None, 'room_synced': None})
+
+
+def clients():
+    """Return all clients by socket"""
+    return {item['socket']: item for item in resources.get_table('clients').scan()['Items']}
+
+
+def summary():
+    return resources.get_table('rosters').get_item(Key={'room_id': 'room'})['Item']
+
+
+def run(target, *args_list):
+    threads = [threading.Thread(target=target, args=args) for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def ignore_client_errors(func):
+    def wrapped(*args):
+        try:
+            func(*args)
+        except (WebsocketHandlers.ClientError, KeyError):
+            pass  # Client disconnected first (as can happen in production)
+    return wrapped
+
+
+def check(condition, message):
+    if not condition:
+        sys.exit(f"FAIL: {message}")
+    print(f"OK: {message}")
+
+
+def check_summary(message):
+    everyone = clients()
+    members = [c for c in everyone.values() if c['room_id'] == 'room']
+    room = summary()
+    entries = [key[len(handlers.ROSTER_ENTRY_PREFIX):] for key in room
+        if key.startswith(handlers.ROSTER_ENTRY_PREFIX)]
+    check(room['total'] == len(members)
+        and room['admins'] == sum(1 for c in members if c['room_admin'])
+        and all(everyone.get(socket, {}).get('room_id') == 'room' for socket in entries),
+        f"{message}: summary has {room['total']:.0f} ({room['admins']:.0f} admins)"
+        f" for {len(members)} in room")
+
+
+def count_items(event_name, parsed, **kwargs):
+    if parsed and event_name.endswith('.Query'):
+        items_queried[0] += len(parsed['Items'])
+
+
+items_queried = [0]
+memory.database.events.register('after-call.dynamodb', count_items)
+
+resources.get_table('rooms').put_item(Item={'id': 'room', 'admins_only_see_clients': False})
+resources.get_table('rosters').put_item(Item={'room_id': 'room', 'exact': True, 'total': 0,
+    'admins': 0, 'revision': 0, 'changed': time()})
+sockets = [f'socket{n}' for n in range(CLIENTS)]
+for socket in sockets:
+    connect(socket)
+
+for round_num in range(ROUNDS):
+
+    # Everyone joins at once (some rejoining without leaving first)
+    @ignore_client_errors
+    def join(socket):
+        make_handlers(socket).client_join_room('room', random.random() < 0.1, socket)
+    connected = clients()
+    run(join, *((socket,) for socket in sockets if socket in connected))
+    check_summary(f"Round {round_num + 1} joins")
+
+    # Half leave and at the same time disconnect (the race the transaction's condition prevents)
+    @ignore_client_errors
+    def leave(socket):
+        make_handlers(socket).client_leave_room()
+
+    @ignore_client_errors
+    def disconnect(socket):
+        make_handlers(socket).update_client_room(None)
+    connected = clients()
+    racing = random.sample([s for s in sockets if s in connected], len(sockets) // 2)
+    run(lambda func, socket: func(socket),
+        *((func, socket) for socket in racing for func in (leave, disconnect)))
+    check_summary(f"Round {round_num + 1} leave+disconnect races")
+
+    # Those who disconnected reconnect for the next round
+    for socket in racing:
+        connect(socket)
+
+# Compare reads needed for a clients list
+# NOTE Churn will have left too few entries to display, so first list queries and repairs summary
+handlers.ROSTER_REPAIR_DELAY = 0
+memory.database.latency = 0
+handler = make_handlers(next(c['socket'] for c in clients().values() if c['room_id'] == 'room'))
+lists = {}
+reads = {}
+for name in ('repair', 'summary', 'query'):
+    if name == 'query':
+        # Force querying
+        resources.get_table('rosters').update_item(Key={'room_id': 'room'},
+            UpdateExpression='SET exact=:exact', ExpressionAttributeValues={':exact': False})
+    memory.reset_stats()
+    items_queried[0] = 0
+    lists[name] = handler.room_clients()[0]
+    reads[name] = {'get_item': memory.database.calls['get_item'],
+        'query': memory.database.calls['query'], 'items': items_queried[0]}
+check(reads['summary']['query'] == 0, "Clients list read from summary once repaired")
+check(lists['summary'] == lists['query'], "Clients list same from summary or query")
+print(f"\nClients list for a room of {lists['query']['total']}:")
+for name in ('summary', 'query'):
+    print(f"  {name:<8} {reads[name]['get_item']} get, {reads[name]['query']} queries"
+        f" ({reads[name]['items']} items read via query)")
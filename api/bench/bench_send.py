@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Compare broadcasting to a room sequentially vs concurrently with different limits
+Posts are simulated by sleeping for a random round trip time (no network used)
+
+    python bench_send.py [sockets] [mean_round_trip_ms]
+
+"""
+
+import sys
+import random
+from time import sleep, perf_counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+from fanout import fan_out
+
+
+SOCKETS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+ROUND_TRIP = (float(sys.argv[2]) if len(sys.argv) > 2 else 30) / 1000
+
+
+def post(socket):
+    # Round trips vary, with occasional slow ones
+    sleep(random.expovariate(1 / ROUND_TRIP))
+
+
+print(f"Sending to {SOCKETS} sockets with ~{ROUND_TRIP * 1000:.0f}ms round trips\n")
+print(f"{'limit':>6} {'total':>9} {'p50':>8} {'p99':>8} {'max':>8}")
+for limit in (1, 4, 8, 16, 32, 64):
+    start = perf_counter()
+    latencies = sorted(r[3] for r in fan_out(post, (f'socket{n}' for n in range(SOCKETS)), limit))
+    total = perf_counter() - start
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"{limit:>6} {total:>8.2f}s {p50*1000:>6.1f}ms {p99*1000:>6.1f}ms {latencies[-1]*1000:>6.1f}ms")
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Compare throughput and latency of the self-hosted server (see server/server.py) with the Lambda
+path, by having clients split into rooms run the same script of messages against each, each client
+sending its next message once it gets the reply to its last (time syncs, chat messages, and plays
+by admins)
+
+    python bench_server.py [clients] [room_size] [rounds] [admins]
+
+The Lambda path calls the entrypoint for each event in a pool of threads (as concurrent invocations)
+against the server's local store, both as is and with latencies typical of AWS added (invoking the
+function, and each request to DynamoDB and the sockets API). The server is run in its own process
+(so doesn't share this one's interpreter lock) and is connected to over real websockets. Requires
+`websockets`
+
+"""
+
+import os
+import sys
+import json
+import asyncio
+import threading
+import multiprocessing
+from time import time, sleep, perf_counter
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+sys.path.insert(0, str(Path(__file__).parent.parent / 'server'))
+os.environ.setdefault('STACK', 'bench')
+
+import server  # NOTE Sets BACKEND=local
+import local
+import resources
+import entrypoint
+from local import make_event, LambdaContext
+
+import websockets
+
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+ROOM_SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+ROUNDS = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+ADMINS = int(sys.argv[4]) if len(sys.argv) > 4 else 2  # Per room
+PORT = 8765
+TIMEOUT = 10  # Seconds to wait for a reply before failing
+resources._cache['config'] = {'domain': 'localhost', 'secrets': {'stripe_key_private': 'x'}}
+
+# Latencies (seconds) assumed for AWS, for the Lambda path
+INVOKE_LATENCY = 0.010  # API Gateway invoking a warm function
+DB_LATENCY = 0.005  # A DynamoDB request
+SOCKETS_LATENCY = 0.008  # A post to a socket
+
+# Latencies added to the Lambda path (see `add_latency`)
+latency = {'invoke': 0, 'dynamodb': 0, 'apigatewaymanagementapi': 0}
+
+
+def decode(frame):
+    """Return the messages in a frame (sync replies as text)"""
+    frame = frame.decode('utf-8') if isinstance(frame, bytes) else frame
+    if frame[:1] == '{':
+        return [json.loads(frame)]
+    if frame[:1] == '[':
+        return json.loads(frame)
+    return [frame]
+
+
+class Client:
+    """A client that sends a message and waits for the reply to it before sending another"""
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = asyncio.Queue()
+
+    async def request(self, body, match):
+        """Send a message and return seconds until a reply matching it and the reply itself"""
+        start = perf_counter()
+        await self.send(body)
+        while True:
+            frame = await asyncio.wait_for(self.frames.get(), TIMEOUT)
+            for message in decode(frame):
+                if match(message):
+                    return perf_counter() - start, message
+
+    async def script(self, room_id, is_admin, latencies):
+        """Run the script of messages, adding the latency of each to those of its kind"""
+        for n in range(ROUNDS):
+            body = f'p{time() * 1000:.3f}'
+            seconds, _ = await self.request(body,
+                lambda msg: isinstance(msg, str) and msg.startswith(body + '\n'))
+            latencies['sync'].append(seconds)
+
+            text = f"{self.name}x{n}"
+            seconds, _ = await self.request(message('room_message', room_id=room_id,
+                room_message=text), lambda msg: isinstance(msg, dict)
+                    and msg['type'] == 'room_message' and msg['info']['html'] == text)
+            latencies['chat'].append(seconds)
+
+            if is_admin:
+                start = int(time() * 1000) + n
+                seconds, _ = await self.request(message('room_media_play', room_id=room_id,
+                    room_start=start), lambda msg: isinstance(msg, dict)
+                        and msg['type'] == 'room_patch'
+                        and msg['info']['changes'].get('start') == start)
+                latencies['play'].append(seconds)
+
+
+class LambdaClient(Client):
+    """Client whose events are handled by calling the entrypoint, as API Gateway would invoke it"""
+
+    def __init__(self, name, pool):
+        super().__init__(name)
+        self.pool = pool
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        local.sockets.connect(self.name,
+            lambda data: loop.call_soon_threadsafe(self.frames.put_nowait, data))
+        await loop.run_in_executor(self.pool, self.invoke, make_event(self.name, 'CONNECT'))
+
+    async def send(self, body):
+        # NOTE Not waited for, as API Gateway doesn't wait for the function to handle messages
+        asyncio.get_running_loop().run_in_executor(self.pool, self.invoke,
+            make_event(self.name, 'MESSAGE', body))
+
+    async def close(self):
+        local.sockets.disconnect(self.name)
+        await asyncio.get_running_loop().run_in_executor(self.pool, self.invoke,
+            make_event(self.name, 'DISCONNECT'))
+
+    def invoke(self, event):
+        sleep(latency['invoke'])
+        try:
+            entrypoint.enter(event, LambdaContext())
+        except Exception:
+            pass  # Reply won't come so will time out
+
+
+class ServerClient(Client):
+    """Client connected to the server over a websocket"""
+
+    async def open(self):
+        self.websocket = await websockets.connect(f'ws://localhost:{PORT}')
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        async for frame in self.websocket:
+            self.frames.put_nowait(frame)
+
+    async def send(self, body):
+        await self.websocket.send(body)
+
+    async def close(self):
+        await self.websocket.close()
+        self.reader.cancel()
+
+
+def message(msg_type, **info):
+    return json.dumps({'type': msg_type, 'info': info})
+
+
+async def join_room(clients):
+    """Have the first client create a room and the rest join it, returning the room's id"""
+    _, created = await clients[0].request(message('room_create', client_name="Admin",
+        room_id_copy=None, room_name=None), lambda msg: msg['type'] == 'room_created')
+    room_id = created['info']['room']['id']
+    await asyncio.gather(*(client.request(message('client_join', room_id=room_id,
+        client_name=client.name, room_secret=created['info']['secret'] if n < ADMINS else None),
+        lambda msg: msg['type'] == 'room_joined') for n, client in enumerate(clients[1:], 1)))
+    await clients[0].request(message('room_media_add', room_id=room_id, media_name="Song",
+        media_type='youtube', media_content={'id': 'dQw4w9WgXcQ'}),
+        lambda msg: msg['type'] == 'room_patch')
+    return room_id
+
+
+async def run(make_client):
+    """Have clients join rooms and run the script, returning messages/sec and latencies"""
+
+    # Create the rooms and join them
+    clients = [make_client(f'client{n}') for n in range(CLIENTS)]
+    await asyncio.gather(*(client.open() for client in clients))
+    rooms = [clients[start:start + ROOM_SIZE] for start in range(0, CLIENTS, ROOM_SIZE)]
+    room_ids = await asyncio.gather(*(join_room(room) for room in rooms))
+    # For joins' clients diffs to be flushed (see ROSTER_FLUSH_INTERVAL)
+    await asyncio.sleep(server.ROSTER_FLUSH_INTERVAL + 1)
+
+    # Run script for all clients at once
+    latencies = {'sync': [], 'chat': [], 'play': []}
+    start = perf_counter()
+    await asyncio.gather(*(client.script(room_id, n < ADMINS, latencies)
+        for room_id, room in zip(room_ids, rooms) for n, client in enumerate(room)))
+    seconds = perf_counter() - start
+
+    await asyncio.gather(*(client.close() for client in clients))
+    return sum(len(values) for values in latencies.values()) / seconds, latencies
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def report(name, rate, latencies):
+    cells = ''.join(f"{percentile(values, 0.5):>10.1f}{percentile(values, 0.99):>7.1f}"
+        for values in latencies.values())
+    print(f"{name:<18}{rate:>8.0f}{cells}")
+
+
+def add_latency(event_name, **kwargs):
+    """Wait before each request as long as it would take on AWS (see `latency`)"""
+    sleep(latency[event_name.split('.')[1]])
+
+
+def serve():
+    asyncio.run(server.Server().run(port=PORT))
+
+
+def wait_for_server():
+    """Wait until the server is listening"""
+    async def connect():
+        async with websockets.connect(f'ws://localhost:{PORT}'):
+            pass
+    for _ in range(100):
+        try:
+            return asyncio.run(connect())
+        except OSError:
+            sleep(0.1)
+    sys.exit("FAIL: Server didn't start")
+
+
+# Start server (in its own process, which starts with the same modules and config as this one)
+# NOTE Before this process starts any threads, as only the forking thread exists in the child
+process = multiprocessing.get_context('fork').Process(target=serve, daemon=True)
+process.start()
+wait_for_server()
+
+# Do what AWS would for the Lambda path (e.g. flushing clients diffs queued by joins)
+threading.Thread(target=asyncio.run, args=(server.Server().work(),), daemon=True).start()
+local.database.events.register('before-parameter-build.dynamodb', add_latency)
+local.sockets.events.register('before-parameter-build.apigatewaymanagementapi', add_latency)
+
+print(f"{CLIENTS} clients in rooms of {ROOM_SIZE} ({ADMINS} admins each) running {ROUNDS}"
+    " rounds each")
+print(f"Lambda + AWS adds {INVOKE_LATENCY * 1000:.0f}ms per invocation,"
+    f" {DB_LATENCY * 1000:.0f}ms per db request, {SOCKETS_LATENCY * 1000:.0f}ms per post\n")
+print(f"{'':<18}{'msgs/s':>8}{'sync p50':>10}{'p99':>7}{'chat p50':>10}{'p99':>7}"
+    f"{'play p50':>10}{'p99':>7}  (ms)")
+
+# Lambda path, as is and then with AWS latencies
+pool = ThreadPoolExecutor(CLIENTS * 4)  # NOTE Lambda scales to as many invocations as needed
+for name, aws in (('lambda', False), ('lambda + aws', True)):
+    latency.update(invoke=INVOKE_LATENCY * aws, dynamodb=DB_LATENCY * aws,
+        apigatewaymanagementapi=SOCKETS_LATENCY * aws)
+    report(name, *asyncio.run(run(lambda name: LambdaClient(name, pool))))
+
+# Server
+report('server', *asyncio.run(run(ServerClient)))
+process.terminate()
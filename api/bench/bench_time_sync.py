@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Compare how quickly clients' estimates of their clock offset converge when sending one sync per
+round (as was done before) vs a burst of probes per round whose replies include server timings
+
+    python bench_time_sync.py [trials]
+
+Simulates networks with jittery asymmetric latency, and probes sometimes hitting a cold container
+(as a burst invokes the function concurrently), using the same estimates as `handle_client_time`
+The reply format is first checked against the real entrypoint (using the in-memory backend)
+
+"""
+
+import os
+import sys
+import random
+from pathlib import Path
+from statistics import median, quantiles
+
+
+TRIALS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+ROUNDS = 3  # Client syncs once a second until has 3 replies (see api.ts)
+PROBES = 3  # Probes per burst (SYNC_PROBES in api.ts)
+COLD = 0.2  # Chance a probe is handled by a new container
+COLD_SECONDS = (0.15, 0.4)  # Time taken by a new container before replying
+
+
+def check_reply_format():
+    """Ensure the real entrypoint replies to probes in the format simulated below"""
+    sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+    os.environ['BACKEND'] = 'memory'
+    import memory
+    import entrypoint
+    from memory import make_event
+    memory.sockets.connect('socket')
+    event = make_event('socket', body='p1600000000000')
+    entrypoint.enter(event, memory.LambdaContext())
+    lines = memory.sockets.take('socket')[0].decode().split('\n')
+    assert lines[0] == 'p1600000000000' and len(lines) == 4
+    assert int(lines[1]) == event['requestContext']['requestTimeEpoch']
+    assert float(lines[2]) > 0 and float(lines[3]) >= 0
+
+
+def sync(offset, probe):
+    """Simulate a sync and return what client would receive (times in ms)"""
+    up = 15 + random.expovariate(1 / 15)  # Client to gateway
+    down = 25 + random.expovariate(1 / 25)  # Gateway to client (typically slower)
+    invoke = 3 + random.expovariate(1 / 3)  # Gateway to function
+    handling = 0.5
+    if probe and random.random() < COLD:
+        handling += random.uniform(*COLD_SECONDS) * 1000
+    post = 2 + random.expovariate(1 / 2)  # Function to gateway
+
+    server_start = random.uniform(1.6e12, 1.7e12)  # True time client sent (server's clock)
+    client_start = int(server_start + offset)  # Client clock is only ms precision
+    server = int(server_start + up)  # requestTimeEpoch is only ms precision
+    server_entry = server_start + up + invoke
+    server_delta = handling
+    client_end = int(server_entry + handling + post + down + offset)
+    return client_start, client_end, server, server_entry, server_delta
+
+
+def estimate_before(client_start, client_end, server, *unused):
+    """Return (latency, time_diff) as `handle_client_time` does without server timings"""
+    latency = (client_end - client_start) / 2
+    return latency, client_start + latency - server
+
+
+def estimate_after(client_start, client_end, server, server_entry, server_delta):
+    """Return (latency, time_diff) as `handle_client_time` does for probes"""
+    server_time = max(0, server_entry + server_delta - server)
+    server_end = server + server_time
+    latency = (client_end - client_start - server_time) / 2
+    return latency, ((client_start - server) + (client_end - server_end)) / 2
+
+
+def errors_by_round(per_round, estimate, probe):
+    """Return the absolute error of the best estimate after each round, for every trial"""
+    errors = [[] for _ in range(ROUNDS)]
+    for _ in range(TRIALS):
+        offset = random.uniform(-5000, 5000)
+        best = None
+        for round_num in range(ROUNDS):
+            for _ in range(per_round):
+                latency, time_diff = estimate(*sync(offset, probe))
+                if best is None or latency < best[0]:
+                    best = (latency, time_diff)
+            errors[round_num].append(abs(best[1] - offset))
+    return errors
+
+
+check_reply_format()
+print("OK: Reply format matches entrypoint\n")
+print(f"Error of clock offset estimate (ms) after each round of syncs, for {TRIALS} clients\n")
+print(f"{'':<22}" + ''.join(f"{f'round {n + 1}':>18}" for n in range(ROUNDS)))
+print(f"{'':<22}" + f"{'median':>9}{'p90':>9}" * ROUNDS)
+for name, per_round, estimate, probe in (
+        ('before (1 sync)', 1, estimate_before, False),
+        (f'after ({PROBES} probes)', PROBES, estimate_after, True)):
+    row = ''
+    for errors in errors_by_round(per_round, estimate, probe):
+        row += f"{median(errors):>9.1f}{quantiles(errors, n=10)[-1]:>9.1f}"
+    print(f"{name:<22}{row}")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Measure the overhead of tracing requests (see tracing.py) by timing invocations of common handlers
+with tracing disabled vs enabled
+
+    python bench_tracing.py [invocations]
+
+Runs the real entrypoint against the in-memory backend (see memory.py), in a separate interpreter
+for each setting (as TRACE_IO is read when first imported), with trace lines discarded
+
+"""
+
+import os
+import sys
+import json
+import subprocess
+from time import perf_counter
+from pathlib import Path
+from contextlib import redirect_stdout
+
+
+INVOCATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+CHILD = len(sys.argv) > 2
+
+
+def child():
+    """Time invocations by an admin in a room of a few clients and print mean microseconds"""
+    sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+    import memory
+    import resources
+    import entrypoint
+    from memory import make_event, LambdaContext
+    resources._cache['config'] = {'domain': 'localhost'}
+
+    def invoke(socket, msg_type=None, event_type='MESSAGE', **info):
+        body = json.dumps({'type': msg_type, 'info': info}) if msg_type else None
+        entrypoint.enter(make_event(socket, event_type, body), LambdaContext())
+
+    with redirect_stdout(open(os.devnull, 'w')):
+        for socket in ('admin', 'guest0', 'guest1', 'guest2'):
+            memory.sockets.connect(socket)
+            invoke(socket, event_type='CONNECT')
+        invoke('admin', 'room_create', client_name="Admin", room_id_copy=None, room_name=None)
+        room_id = memory.sockets.take('admin')[0]['info']['room']['id']
+        for socket in ('guest0', 'guest1', 'guest2'):
+            invoke(socket, 'client_join', room_id=room_id, room_secret=None, client_name=socket)
+
+        messages = [
+            ('client_synced', {'client_synced': True}),
+            ('room_media_pause', {'room_id': room_id, 'room_paused': 1.5}),
+            ('room_name', {'room_id': room_id, 'room_name': "Name"}),
+        ]
+        start = perf_counter()
+        for n in range(INVOCATIONS):
+            msg_type, info = messages[n % len(messages)]
+            invoke('admin', msg_type, **info)
+        print((perf_counter() - start) / INVOCATIONS * 1e6, file=sys.__stdout__)
+
+
+if CHILD:
+    child()
+    sys.exit()
+
+results = {}
+for setting in ('false', 'true'):
+    env = {**os.environ, 'BACKEND': 'memory', 'TRACE_IO': setting, 'STACK': 'bench',
+        'TOPIC_ERRORS': 'errors', 'ROSTER_FLUSH_INTERVAL': '0'}
+    proc = subprocess.run([sys.executable, __file__, str(INVOCATIONS), 'child'], env=env,
+        capture_output=True, text=True, check=True)
+    results[setting] = float(proc.stdout)
+
+print(f"Mean time of {INVOCATIONS} invocations (in-memory backend, so excludes network)\n")
+print(f"tracing disabled {results['false']:>8.1f}us")
+print(f"tracing enabled  {results['true']:>8.1f}us"
+    f"  (+{results['true'] - results['false']:.1f}us per invocation)")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Compare the setup cost of warm invocations when creating resources every time (as was done before)
+vs reusing those created by previous invocations of the same container
+
+    python bench_warm.py [invocations]
+
+No network requests are made (setup doesn't make any), so this excludes the extra saving of reusing
+kept-alive HTTPS connections rather than negotiating new ones (typically tens of ms per client)
+
+"""
+
+import os
+import sys
+import json
+from time import perf_counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+os.environ.setdefault('STACK', 'bench')
+
+import boto3
+import resources
+from handlers import WebsocketHandlers
+
+
+INVOCATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+CONFIG = json.dumps({'domain': 'selah.cloud', 'secrets': {'stripe_key_private': 'x'}, 'api_id': 'x'})
+EVENT = {
+    'requestContext': {
+        'connectionId': 'socket',
+        'domainName': 'example.execute-api.us-west-2.amazonaws.com',
+        'stage': 'stageless',
+        'requestTimeEpoch': 0,
+        'eventType': 'MESSAGE',
+    },
+    'body': '0',
+}
+
+
+def sync_before():
+    # What `reply_to_sync_request` did before posting
+    domain = EVENT['requestContext']['domainName']
+    stage = EVENT['requestContext']['stage']
+    boto3.client('apigatewaymanagementapi', endpoint_url=f'https://{domain}/{stage}')
+
+
+def sync_after():
+    # What `reply_to_sync_request` does now before posting
+    resources.get_sockets(EVENT['requestContext']['domainName'], EVENT['requestContext']['stage'])
+
+
+def handler_before():
+    # What `WebsocketHandlers.__init__` did
+    json.loads(CONFIG)
+    domain = EVENT['requestContext']['domainName']
+    stage = EVENT['requestContext']['stage']
+    boto3.client('apigatewaymanagementapi', endpoint_url=f'https://{domain}/{stage}')
+    db = boto3.resource('dynamodb')
+    db.Table('bench-rooms')
+    db.Table('bench-clients')
+    db.Table('bench-rosters')
+
+
+def handler_after():
+    WebsocketHandlers(EVENT, None)
+
+
+def measure(func):
+    func()  # First call is the cold one
+    start = perf_counter()
+    for _ in range(INVOCATIONS):
+        func()
+    return (perf_counter() - start) / INVOCATIONS * 1000
+
+
+resources._cache['config'] = json.loads(CONFIG)  # Avoid needing a real app config file
+print(f"Mean setup time of {INVOCATIONS} warm invocations\n")
+print(f"{'path':<10} {'before':>10} {'after':>10}")
+for name, before, after in (('sync', sync_before, sync_after),
+        ('handler', handler_before, handler_after)):
+    print(f"{name:<10} {measure(before):>8.2f}ms {measure(after):>8.3f}ms")
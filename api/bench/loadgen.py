@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Load test the websocket protocol end to end, with many simulated clients acting as the app does
+
+    python loadgen.py [url] [clients] [room_size] [rounds]
+
+Clients are split into rooms (each created by its first client, an admin), and every room runs
+this script at once:
+    1. Connect, and send a burst of time sync probes (as the app does on connecting)
+    2. Join the room (all guests at once), and the admin adds a media item
+    3. Each round, the admin plays, and every client reports its synced status once told of the
+       play. Then every client sends a burst of chat messages
+    4. All guests disconnect at once
+
+Reports latency of messages that get a reply (time until the sender got it), messages sent and
+received per second, how accurately clients estimated the server's clock (see
+`handle_client_time` in the app), how long after a play each client had it (by patch, or by state
+if it had to resync), and how long until admins were told of the mass disconnect
+
+Default url is the self-hosted server's (see server/server.py). Requires `websockets`, and a file
+limit (`ulimit -n`) above the number of clients. Sync accuracy assumes the server shares this
+machine's clock (otherwise it includes the difference between the clocks)
+
+"""
+
+import sys
+import json
+import random
+import asyncio
+from time import time, perf_counter
+
+import websockets
+
+
+URL = sys.argv[1] if len(sys.argv) > 1 else 'ws://localhost:8001'
+CLIENTS = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+ROOM_SIZE = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+ROUNDS = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+SYNC_PROBES = 3  # Same as the app (see api.ts)
+CHAT_BURST = 3  # Chat messages each client sends at once per round
+CONNECT_CONCURRENCY = 100  # Max connections being opened at once
+TIMEOUT = 30  # Seconds to wait for a reply before giving up on it
+
+
+class Stats:
+    """Measurements of all clients"""
+
+    def __init__(self):
+        self.latencies = {}  # Kind of message -> seconds until sender got its reply
+        self.sent = 0
+        self.received = 0
+        self.sync_offsets = []  # Ms off the server's clock that clients estimated (best probe)
+        self.sync_uncertainty = []  # Ms of one-way latency of each client's best probe
+        self.play_each = []  # Seconds after a play that each client had it
+        self.play_all = []  # Seconds after a play that every client in the room had it
+        self.left_all = []  # Seconds after a mass disconnect that the admin was told of them all
+        self.connect_failed = 0
+        self.timeouts = 0
+        self.errors = 0  # Error messages received (client_error, or an internal server error)
+        self.resyncs = 0
+
+    def latency(self, kind, seconds):
+        self.latencies.setdefault(kind, []).append(seconds)
+
+
+class Client:
+    """A simulated client, keeping the room's version as the app does (see `handle_room_patch`)"""
+
+    def __init__(self, name, stats):
+        self.name = name
+        self.stats = stats
+        self.socket = None  # Id the server knows the client by
+        self.room_id = None
+        self.version = None
+        self.waiters = []  # (match, future) for messages awaited
+        self.probes = {}  # Sync probes awaiting replies -> when sent
+        self.sync_latency = None  # One-way latency of best probe so far
+        self.sync_offset = None
+
+    async def open(self, limit):
+        async with limit:
+            try:
+                self.websocket = await websockets.connect(URL, max_size=None, ping_interval=None,
+                    open_timeout=TIMEOUT)
+            except Exception:
+                self.stats.connect_failed += 1
+                return False
+        self.reader = asyncio.create_task(self.read())
+        return True
+
+    async def close(self):
+        await self.websocket.close()
+
+    async def send(self, body):
+        self.stats.sent += 1
+        try:
+            await self.websocket.send(body)
+        except websockets.ConnectionClosed:
+            pass  # Reply won't come so will time out
+
+    async def send_message(self, msg_type, **info):
+        await self.send(json.dumps({'type': msg_type, 'info': info}))
+
+    def expect(self, match):
+        """Return a future for the time a message matching is received and the message"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((match, future))
+        return future
+
+    async def wait(self, future):
+        """Return what future resolves to, or None if it doesn't in time"""
+        try:
+            return await asyncio.wait_for(future, TIMEOUT)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            return None
+
+    async def request(self, kind, match, msg_type, **info):
+        """Send a message and record seconds until a reply matching it, returning the reply"""
+        future = self.expect(match)
+        sent = perf_counter()
+        await self.send_message(msg_type, **info)
+        result = await self.wait(future)
+        if result:
+            self.stats.latency(kind, result[0] - sent)
+            return result[1]
+
+    async def sync(self):
+        """Send a burst of time sync probes and wait for their replies"""
+        future = self.expect(lambda msg: not self.probes)
+        for _ in range(SYNC_PROBES):
+            body = f'p{time() * 1000:.3f}'
+            self.probes[body] = perf_counter()
+            await self.send(body)
+        await self.wait(future)
+
+    async def read(self):
+        try:
+            async for frame in self.websocket:
+                received = perf_counter()
+                if frame[:1] == '{':
+                    messages = [json.loads(frame)]
+                elif frame[:1] == '[':
+                    messages = json.loads(frame)
+                else:
+                    self.handle_sync(frame, received)
+                    messages = [None]
+                self.stats.received += len(messages)
+                for message in messages:
+                    if message:
+                        self.handle(message)
+                    for waiter in list(self.waiters):
+                        match, future = waiter
+                        if not future.done() and match(message):
+                            future.set_result((received, message))
+                            self.waiters.remove(waiter)
+        except websockets.ConnectionClosed:
+            pass
+
+    def handle_sync(self, frame, received):
+        """Estimate the server's clock from a probe's reply, as the app does"""
+        client_start, server, server_entry, server_delta = frame.split('\n')
+        sent = self.probes.pop(client_start, None)
+        if sent is None:
+            return
+        self.stats.latency('sync', received - sent)
+        client_start = float(client_start[1:])
+        client_end = time() * 1000
+        server_time = max(0, float(server_entry) + float(server_delta) - int(server))
+        latency = (client_end - client_start - server_time) / 2
+        if self.sync_latency is None or latency < self.sync_latency:
+            self.sync_latency = latency
+            self.sync_offset = ((client_start - int(server))
+                + (client_end - int(server) - server_time)) / 2
+
+    def handle(self, message):
+        if message.get('type') in ('client_error', None):
+            # NOTE Internal server errors have no type (see server/server.py)
+            self.stats.errors += 1
+            return
+        info = message['info']
+        if message['type'] in ('room_created', 'room_joined'):
+            self.socket = info['you']
+            self.room_id = info['room']['id']
+            self.version = info['room']['version']
+        elif message['type'] == 'room_state':
+            self.version = info['version']
+        elif message['type'] == 'room_patch' and self.version is not None:
+            version = info['changes']['version']
+            if version > self.version + 1:
+                # Missed a patch so get the full state instead
+                self.stats.resyncs += 1
+                asyncio.create_task(self.send_message('room_state_resync', room_id=self.room_id))
+            elif version == self.version + 1:
+                self.version = version
+
+
+def has_play(start):
+    """Return a match for the patch of a play (or a state including it)"""
+    def match(msg):
+        return msg and (msg['type'] == 'room_patch' and msg['info']['changes'].get('start') == start
+            or msg['type'] == 'room_state' and msg['info']['start'] == start)
+    return match
+
+
+async def run_room(number, size, stats, limit):
+    """Run the script for a room of the given number of clients"""
+
+    # Connect and sync time
+    clients = [Client(f'r{number}c{n}', stats) for n in range(size)]
+    connected = await asyncio.gather(*(client.open(limit) for client in clients))
+    clients = [client for client, ok in zip(clients, connected) if ok]
+    if not clients:
+        return
+    await asyncio.gather(*(client.sync() for client in clients))
+    for client in clients:
+        if client.sync_offset is not None:
+            stats.sync_offsets.append(client.sync_offset)
+            stats.sync_uncertainty.append(client.sync_latency)
+
+    # Create room and join it
+    admin, guests = clients[0], clients[1:]
+    created = await admin.request('room_create', lambda msg: msg and msg['type'] == 'room_created',
+        'room_create', client_name=admin.name, room_id_copy=None, room_name=None)
+    if not created:
+        return
+    room_id = created['info']['room']['id']
+    joined = await asyncio.gather(*(guest.request('client_join',
+        lambda msg: msg and msg['type'] == 'room_joined', 'client_join', room_id=room_id,
+        room_secret=None, client_name=guest.name) for guest in guests))
+    guests = [guest for guest, ok in zip(guests, joined) if ok]
+    clients = [admin, *guests]
+    await admin.request('room_media_add', lambda msg: msg and msg['type'] == 'room_patch'
+        and 'media' in msg['info'], 'room_media_add', room_id=room_id, media_name="Song",
+        media_type='youtube', media_content={'id': 'dQw4w9WgXcQ'})
+
+    for n in range(ROUNDS):
+
+        # Play, then every client reports its synced status once it has the play
+        start = int(time() * 1000) + 1000 + n
+        futures = [client.expect(has_play(start)) for client in clients]
+        sent = perf_counter()
+        await admin.send_message('room_media_play', room_id=room_id, room_start=start)
+        async def synced(client, future):
+            result = await client.wait(future)
+            if result:
+                await client.send_message('client_synced', client_synced=random.randint(-50, 50))
+                return result[0] - sent
+        delays = await asyncio.gather(*(synced(client, future)
+            for client, future in zip(clients, futures)))
+        if delays[0] is not None:
+            stats.latency('room_media_play', delays[0])  # Admin's
+        if None not in delays:
+            stats.play_each.extend(delays)
+            stats.play_all.append(max(delays))
+
+        # Chat burst
+        def chat(client, text):
+            return client.request('room_message', lambda msg: msg and msg['type'] == 'room_message'
+                and msg['info']['html'] == text, 'room_message', room_id=room_id,
+                room_message=text)
+        await asyncio.gather(*(chat(client, f"{client.name}x{n}x{k}") for client in clients
+            for k in range(CHAT_BURST)))
+
+    # Mass disconnect of guests, timing until admin told of them all
+    remaining = {guest.socket for guest in guests}
+    def all_left(msg):
+        if msg and msg['type'] == 'room_clients_diff':
+            remaining.difference_update(diff['socket'] for diff in msg['info']['diffs']
+                if diff['change'] == 'left')
+        return not remaining
+    future = admin.expect(all_left)
+    sent = perf_counter()
+    await asyncio.gather(*(guest.close() for guest in guests))
+    result = await admin.wait(future) if guests else None
+    if result:
+        stats.left_all.append(result[0] - sent)
+    await admin.close()
+
+
+def percentiles(values, scale=1000):
+    """Return p50, p95 and p99 of values (seconds as ms by default) formatted as cells"""
+    if not values:
+        return f"{'-':>8}{'-':>8}{'-':>8}"
+    values = sorted(values)
+    cells = [values[min(len(values) - 1, int(len(values) * fraction))] * scale
+        for fraction in (0.5, 0.95, 0.99)]
+    return ''.join(f"{cell:>8.1f}" for cell in cells)
+
+
+def report(stats, seconds):
+    rooms = -(-CLIENTS // ROOM_SIZE)
+    print(f"\n{CLIENTS} clients in {rooms} rooms of up to {ROOM_SIZE}, {ROUNDS} rounds, {URL}")
+    print(f"Took {seconds:.1f}s: sent {stats.sent} ({stats.sent / seconds:.0f}/s),"
+        f" received {stats.received} ({stats.received / seconds:.0f}/s)\n")
+
+    print(f"{'':<28}{'count':>8}{'p50':>8}{'p95':>8}{'p99':>8}  (ms)")
+    for kind, values in stats.latencies.items():
+        print(f"{'Latency: ' + kind:<28}{len(values):>8}{percentiles(values)}")
+    every = [value for values in stats.latencies.values() for value in values]
+    print(f"{'Latency: all':<28}{len(every):>8}{percentiles(every)}")
+    print(f"{'Sync: offset from server':<28}{len(stats.sync_offsets):>8}"
+        f"{percentiles([abs(offset) for offset in stats.sync_offsets], 1)}")
+    print(f"{'Sync: uncertainty':<28}{len(stats.sync_uncertainty):>8}"
+        f"{percentiles(stats.sync_uncertainty, 1)}")
+    print(f"{'Play: had by each client':<28}{len(stats.play_each):>8}"
+        f"{percentiles(stats.play_each)}")
+    print(f"{'Play: had by all in room':<28}{len(stats.play_all):>8}"
+        f"{percentiles(stats.play_all)}")
+    print(f"{'Disconnect: admin told all':<28}{len(stats.left_all):>8}"
+        f"{percentiles(stats.left_all)}")
+
+    print(f"\nFailed to connect: {stats.connect_failed}, timed out: {stats.timeouts},"
+        f" errors: {stats.errors}, resyncs: {stats.resyncs}")
+
+
+async def main():
+    stats = Stats()
+    limit = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    sizes = [min(ROOM_SIZE, CLIENTS - start) for start in range(0, CLIENTS, ROOM_SIZE)]
+    start = perf_counter()
+    await asyncio.gather(*(run_room(number, size, stats, limit)
+        for number, size in enumerate(sizes)))
+    report(stats, perf_counter() - start)
+    return stats
+
+
+if __name__ == '__main__':
+    stats = asyncio.run(main())
+    sys.exit(1 if stats.connect_failed or stats.timeouts or stats.errors else 0)
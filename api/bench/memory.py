@@ -0,0 +1,604 @@
+
+# In-memory stand-ins for the AWS services used by the handlers (DynamoDB, sockets API, SNS, SQS)
+# NOTE Used when BACKEND=memory (see resources.py), for benchmarking. Unlike the server's local
+#      services (see server/local.py), requests are counted and can be delayed (to simulate
+#      network), reads are paged by size as DynamoDB's are, and tables can be snapshot and restored
+#      Both apply conditions and updates with the same code though (see server/expressions.py)
+# NOTE Kept out of code/ so it isn't deployed, so BACKEND=memory only works for scripts in bench/
+# WARN Not used in production and not optimised, everything is done under a single lock
+
+
+import sys
+import json
+import threading
+from copy import deepcopy
+from types import SimpleNamespace
+from functools import wraps
+from operator import itemgetter
+from time import time, monotonic, sleep
+from uuid import uuid4
+from collections import Counter, deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'server'))
+
+from expressions import (normalize, item_size, error, ConditionalCheckFailedException,
+    TransactionCanceledException, ValidationException, DynamoExceptions, Parser, build_expression,
+    check_condition, apply_update, project)
+from local import TABLES, GoneException, SocketsExceptions, Events, LambdaContext, make_event
+
+
+# Limits that DynamoDB enforces
+MAX_ITEM_SIZE = 400 * 1024
+MAX_PAGE_SIZE = 1024 * 1024
+MAX_TRANSACT_ITEMS = 100
+MAX_BATCH_GET_KEYS = 100
+
+# Seconds that SQS ignores messages sent with a deduplication id already sent
+QUEUE_DEDUP_INTERVAL = 5 * 60
+
+
+# SERVICES
+
+
+class _Service:
+    """Base for stand-ins of services, recording the requests made to them"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.calls = Counter()  # Number of requests made per operation
+        self.latency = 0  # Seconds to wait before every request (to simulate network)
+        self.events = Events()
+
+
+def _operation(service_id, name):
+    """Decorate a method as a request to a service
+
+    Requests are counted, delayed by the service's latency, and emit the events botocore does
+    when starting and finishing a request (e.g. `before-parameter-build.dynamodb.GetItem`), with
+    the response given to `after-call` handlers as `parsed` (None if the request failed)
+
+    """
+    operation = ''.join(word.title() for word in name.split('_'))
+    def decorator(method):
+        @wraps(method)
+        def wrapped(self, *args, **kwargs):
+            service = getattr(self, 'database', self)
+            context = {}
+            service.events.emit(f'before-parameter-build.{service_id}.{operation}',
+                params=kwargs, model=None, context=context)
+            if service.latency:
+                sleep(service.latency)
+            with service.lock:
+                service.calls[name] += 1
+            parsed = None
+            try:
+                parsed = method(self, *args, **kwargs)
+                return parsed
+            finally:
+                service.events.emit(f'after-call.{service_id}.{operation}', http_response=None,
+                    parsed=parsed, model=None, context=context)
+        return wrapped
+    return decorator
+
+
+# DYNAMODB
+
+
+class MemoryDatabase(_Service):
+    """Stand-in for the DynamoDB service resource (`boto3.resource('dynamodb')`)
+
+    Tables are created when first accessed, using their schema in TABLES
+
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tables = {}
+        self.meta = SimpleNamespace(client=MemoryDatabaseClient(self))
+
+    def Table(self, name):
+        with self.lock:
+            if name not in self.tables:
+                self.tables[name] = MemoryTable(self, name, TABLES[name.rsplit('-', 1)[-1]])
+            return self.tables[name]
+
+    @_operation('dynamodb', 'batch_get_item')
+    def batch_get_item(self, RequestItems):
+        """Get items from multiple tables by key (all are processed)"""
+        if sum(len(request['Keys']) for request in RequestItems.values()) > MAX_BATCH_GET_KEYS:
+            raise error(ValidationException, 'ValidationException', "Too many items requested",
+                'BatchGetItem')
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            names = request.get('ExpressionAttributeNames') or {}
+            with self.lock:
+                items = [table.items.get(table.key_of(normalize(key))) for key in request['Keys']]
+            responses[name] = [project(deepcopy(item), request.get('ProjectionExpression'), names)
+                for item in items if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def sweep(self, now=None):
+        """Delete all expired items (as DynamoDB's TTL does eventually)"""
+        with self.lock:
+            return sum(table.sweep(now) for table in self.tables.values())
+
+    def snapshot(self):
+        """Return a copy of all items (to later restore)"""
+        with self.lock:
+            return {name: deepcopy(table.items) for name, table in self.tables.items()}
+
+    def restore(self, snapshot):
+        """Replace all items with those of a snapshot"""
+        with self.lock:
+            for name, table in self.tables.items():
+                table.items = deepcopy(snapshot.get(name, {}))
+
+    def clear(self):
+        with self.lock:
+            for table in self.tables.values():
+                table.items.clear()
+            self.calls.clear()
+
+
+class MemoryDatabaseClient:
+    """Stand-in for the DynamoDB low-level client (only what's used via `db.meta.client`)"""
+
+    exceptions = DynamoExceptions
+
+    def __init__(self, database):
+        self.database = database
+        self.meta = SimpleNamespace(events=database.events)
+
+    @_operation('dynamodb', 'transact_write_items')
+    def transact_write_items(self, TransactItems, **kwargs):
+        """Apply all writes or none (if any condition fails)"""
+        operation = 'TransactWriteItems'
+        if len(TransactItems) > MAX_TRANSACT_ITEMS:
+            raise error(ValidationException, 'ValidationException',
+                "Too many items in transaction", operation)
+
+        with self.database.lock:
+            # Determine the result of every write before applying any
+            writes = []
+            reasons = []
+            for transact_item in TransactItems:
+                (kind, params), = transact_item.items()
+                table = self.database.Table(params['TableName'])
+                if kind == 'Put':
+                    key = table.key_of(params['Item'])
+                else:
+                    key = table.key_of(params['Key'])
+                if any(other is table and other_key == key for other, other_key, new in writes):
+                    raise error(ValidationException, 'ValidationException',
+                        "Transaction cannot include multiple operations on one item", operation)
+                old = table.items.get(key)
+                ok = check_condition(params.get('ConditionExpression'),
+                    params.get('ExpressionAttributeNames'),
+                    params.get('ExpressionAttributeValues'), old, operation)
+                reasons.append({'Code': 'None' if ok else 'ConditionalCheckFailed'})
+                if kind == 'Put':
+                    new = table.validate(normalize(params['Item']), operation)
+                elif kind == 'Update':
+                    new, updated = apply_update(old or dict(params['Key']),
+                        params['UpdateExpression'], params.get('ExpressionAttributeNames'),
+                        params.get('ExpressionAttributeValues'), table.key_names, operation)
+                    new = table.validate(new, operation)
+                elif kind == 'Delete':
+                    new = None
+                else:  # ConditionCheck
+                    new = old
+                writes.append((table, key, new))
+
+            if any(reason['Code'] != 'None' for reason in reasons):
+                error = error(TransactionCanceledException, 'TransactionCanceledException',
+                    "Transaction cancelled", operation)
+                error.response['CancellationReasons'] = reasons
+                raise error
+
+            for table, key, new in writes:
+                if new is None:
+                    table.items.pop(key, None)
+                else:
+                    table.items[key] = new
+        return {}
+
+
+class MemoryTable:
+    """Stand-in for a DynamoDB Table resource"""
+
+    def __init__(self, database, name, schema):
+        self.database = database
+        self.name = name
+        self.schema = schema
+        self.key_names = [key for key in (schema['hash'], schema['range']) if key]
+        self.items = {}  # key tuple -> item
+
+    def key_of(self, item):
+        return tuple(item[key] for key in self.key_names)
+
+    def validate(self, item, operation):
+        """Return item if it can be stored, otherwise raise a validation error"""
+        for key in self.key_names:
+            if not isinstance(item.get(key), (str, float, bytes)) or item[key] == '':
+                raise error(ValidationException, 'ValidationException',
+                    f"Invalid value for key attribute {key}", operation)
+        if item_size(item) > MAX_ITEM_SIZE:
+            raise error(ValidationException, 'ValidationException',
+                "Item size has exceeded the maximum allowed size", operation)
+        return item
+
+    @_operation('dynamodb', 'get_item')
+    def get_item(self, Key, ConsistentRead=False, ProjectionExpression=None,
+            ExpressionAttributeNames=None):
+        with self.database.lock:
+            item = self.items.get(self.key_of(Key))
+            if item is None:
+                return {}
+            return {'Item': project(deepcopy(item), ProjectionExpression,
+                ExpressionAttributeNames or {})}
+
+    @_operation('dynamodb', 'put_item')
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+            ExpressionAttributeValues=None, ReturnValues='NONE'):
+        item = self.validate(normalize(Item), 'PutItem')
+        with self.database.lock:
+            key = self.key_of(item)
+            old = self.items.get(key)
+            if not check_condition(ConditionExpression, ExpressionAttributeNames,
+                    ExpressionAttributeValues, old, 'PutItem'):
+                raise error(ConditionalCheckFailedException, 'ConditionalCheckFailedException',
+                    "The conditional request failed", 'PutItem')
+            self.items[key] = item
+            return {'Attributes': deepcopy(old)} if ReturnValues == 'ALL_OLD' and old else {}
+
+    @_operation('dynamodb', 'update_item')
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None,
+            ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues='NONE'):
+        with self.database.lock:
+            key = self.key_of(Key)
+            old = self.items.get(key)
+            if not check_condition(ConditionExpression, ExpressionAttributeNames,
+                    ExpressionAttributeValues, old, 'UpdateItem'):
+                raise error(ConditionalCheckFailedException, 'ConditionalCheckFailedException',
+                    "The conditional request failed", 'UpdateItem')
+            new, updated = apply_update(old or normalize(dict(Key)), UpdateExpression,
+                ExpressionAttributeNames, ExpressionAttributeValues, self.key_names, 'UpdateItem')
+            self.items[key] = self.validate(new, 'UpdateItem')
+
+            if ReturnValues == 'ALL_NEW':
+                return {'Attributes': deepcopy(new)}
+            if ReturnValues == 'ALL_OLD':
+                return {'Attributes': deepcopy(old)} if old else {}
+            if ReturnValues in ('UPDATED_NEW', 'UPDATED_OLD'):
+                source = new if ReturnValues == 'UPDATED_NEW' else (old or {})
+                attributes = {k: deepcopy(source[k]) for k in updated if k in source}
+                return {'Attributes': attributes} if attributes else {}
+            return {}
+
+    @_operation('dynamodb', 'delete_item')
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+            ExpressionAttributeValues=None, ReturnValues='NONE'):
+        with self.database.lock:
+            key = self.key_of(Key)
+            old = self.items.get(key)
+            if not check_condition(ConditionExpression, ExpressionAttributeNames,
+                    ExpressionAttributeValues, old, 'DeleteItem'):
+                raise error(ConditionalCheckFailedException, 'ConditionalCheckFailedException',
+                    "The conditional request failed", 'DeleteItem')
+            self.items.pop(key, None)
+            return {'Attributes': deepcopy(old)} if ReturnValues == 'ALL_OLD' and old else {}
+
+    @_operation('dynamodb', 'query')
+    def query(self, KeyConditionExpression, IndexName=None, **kwargs):
+        if IndexName and kwargs.get('ConsistentRead'):
+            raise error(ValidationException, 'ValidationException',
+                "Consistent reads are not supported on global secondary indexes", 'Query')
+        expression, names, values = build_expression(KeyConditionExpression,
+            kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues'),
+            is_key_condition=True)
+        condition = Parser(expression, names, values).condition()
+        return self._read('Query', condition, IndexName, **kwargs)
+
+    @_operation('dynamodb', 'scan')
+    def scan(self, IndexName=None, **kwargs):
+        return self._read('Scan', None, IndexName, **kwargs)
+
+    def _read(self, operation, key_condition, index_name, *, ExpressionAttributeNames=None,
+            ExpressionAttributeValues=None, ProjectionExpression=None, FilterExpression=None,
+            ExclusiveStartKey=None, Limit=None, ConsistentRead=False, ScanIndexForward=True):
+        """Read a page of items from the table or an index (in key order)"""
+
+        # Determine keys to order by (index items also include table's keys)
+        schema = self.schema['indexes'][index_name] if index_name else self.schema
+        index_keys = [key for key in (schema['hash'], schema['range']) if key]
+        order = itemgetter(*index_keys[1:], *self.key_names)
+
+        # Index only has projected attributes
+        keep = None
+        if index_name and schema['include'] is not None:
+            keep = {*index_keys, *self.key_names, *schema['include']}
+
+        with self.database.lock:
+            # Items without the index's keys aren't in the index
+            # NOTE Only the page read is copied, so paging through a table isn't quadratic
+            items = [item for item in self.items.values()
+                if all(key in item for key in index_keys)]
+            if key_condition:
+                items = [item for item in items if key_condition(item)]
+            items.sort(key=order, reverse=not ScanIndexForward)
+
+            # Continue from end of last page
+            if ExclusiveStartKey:
+                start = order(normalize(ExclusiveStartKey))
+                items = [item for item in items
+                    if (order(item) > start if ScanIndexForward else order(item) < start)]
+
+            # Read a page (limited by size, or number of items if given) before filtering
+            page = []
+            size = 0
+            for item in items:
+                if (Limit and len(page) >= Limit) or size >= MAX_PAGE_SIZE:
+                    break
+                if keep is not None:
+                    item = {key: val for key, val in item.items() if key in keep}
+                page.append(deepcopy(item))
+                size += item_size(page[-1])
+        resp = {'ScannedCount': len(page)}
+        if len(page) < len(items):
+            resp['LastEvaluatedKey'] = {key: page[-1][key] for key in {*index_keys, *self.key_names}}
+
+        # Filter and project
+        if FilterExpression is not None:
+            expression, names, values = build_expression(FilterExpression, ExpressionAttributeNames,
+                ExpressionAttributeValues)
+            condition = Parser(expression, names, values).condition()
+            page = [item for item in page if condition(item)]
+        names = ExpressionAttributeNames or {}
+        resp['Items'] = [project(item, ProjectionExpression, names) for item in page]
+        resp['Count'] = len(page)
+        return resp
+
+    @_operation('dynamodb', 'batch_write_item')
+    def batch_write_item(self, writes):
+        """Apply a batch of ('put', item) and ('delete', key) writes (see MemoryBatchWriter)"""
+        with self.database.lock:
+            for action, item in writes:
+                if action == 'put':
+                    self.items[self.key_of(item)] = item
+                else:
+                    self.items.pop(self.key_of(item), None)
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return MemoryBatchWriter(self)
+
+    def sweep(self, now=None):
+        """Delete expired items and return how many"""
+        now = time() if now is None else now
+        ttl = self.schema['ttl']
+        with self.database.lock:
+            expired = [key for key, item in self.items.items()
+                if isinstance(item.get(ttl), float) and item[ttl] < now]
+            for key in expired:
+                del self.items[key]
+        return len(expired)
+
+
+class MemoryBatchWriter:
+    """Stand-in for a Table's batch writer (writes in batches of 25 when exiting or full)"""
+
+    def __init__(self, table):
+        self.table = table
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def put_item(self, Item):
+        self.pending.append(('put', self.table.validate(normalize(Item), 'BatchWriteItem')))
+        if len(self.pending) >= 25:
+            self.flush()
+
+    def delete_item(self, Key):
+        self.pending.append(('delete', normalize(Key)))
+        if len(self.pending) >= 25:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.table.batch_write_item(self.pending)
+        self.pending = []
+
+
+# SOCKETS
+
+
+class MemorySockets(_Service):
+    """Stand-in for the API Gateway management API client (`apigatewaymanagementapi`)
+
+    Connections either have a callback that is given every message, or messages are kept in an
+    inbox until taken
+
+    """
+
+    exceptions = SocketsExceptions
+
+    def __init__(self):
+        super().__init__()
+        self.connections = {}  # socket -> callback or inbox list
+        self.meta = SimpleNamespace(events=self.events)
+
+    def connect(self, socket, callback=None):
+        with self.lock:
+            self.connections[socket] = callback or []
+
+    def disconnect(self, socket):
+        with self.lock:
+            self.connections.pop(socket, None)
+
+    def take(self, socket):
+        """Return (and remove) messages sent to a socket's inbox, decoded
+
+        NOTE Frames of multiple messages are unpacked (see `flush_outbox` in handlers.py)
+
+        """
+        with self.lock:
+            inbox = self.connections.get(socket)
+            frames = inbox[:] if isinstance(inbox, list) else []
+            if frames:
+                inbox.clear()
+        messages = []
+        for data in frames:
+            if data[:1] == b'{':
+                messages.append(json.loads(data))
+            elif data[:1] == b'[':
+                messages.extend(json.loads(data))
+            else:
+                messages.append(data)
+        return messages
+
+    @_operation('apigatewaymanagementapi', 'post_to_connection')
+    def post_to_connection(self, Data, ConnectionId):
+        data = Data.encode('utf-8') if isinstance(Data, str) else Data
+        with self.lock:
+            receiver = self.connections.get(ConnectionId)
+            if receiver is None:
+                self.calls['gone'] += 1
+                raise error(GoneException, 'GoneException', "Connection is gone",
+                    'PostToConnection')
+            if isinstance(receiver, list):
+                receiver.append(data)
+                return {}
+        receiver(data)  # NOTE Outside lock so callback can send more messages
+        return {}
+
+    def clear(self):
+        with self.lock:
+            self.connections.clear()
+            self.calls.clear()
+
+
+# SNS
+
+
+class MemorySNS(_Service):
+    """Stand-in for the SNS client (keeps published messages)"""
+
+    def __init__(self):
+        super().__init__()
+        self.published = []
+        self.meta = SimpleNamespace(events=self.events)
+
+    @_operation('sns', 'publish')
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        with self.lock:
+            self.published.append({'TopicArn': TopicArn, 'Subject': Subject, 'Message': Message})
+        return {'MessageId': str(len(self.published))}
+
+    def clear(self):
+        with self.lock:
+            self.published.clear()
+            self.calls.clear()
+
+
+# SQS
+
+
+class MemoryQueue(_Service):
+    """Stand-in for the SQS client with a queue per URL (each keeps messages until taken)
+
+    Messages are taken in the order sent (once any delay has passed), in the format Lambda gives
+    them to functions, and those sent with a deduplication id already sent are ignored (as SQS
+    does for FIFO queues, see QUEUE_DEDUP_INTERVAL)
+
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.queues = {}  # Queue URL -> deque of (when visible, record)
+        self.dedup_ids = {}  # Deduplication id -> when sent (oldest first)
+        self.meta = SimpleNamespace(events=self.events)
+
+    @_operation('sqs', 'send_message')
+    def send_message(self, QueueUrl, MessageBody, MessageGroupId=None, MessageDeduplicationId=None,
+            DelaySeconds=0):
+        now = monotonic()
+        with self.lock:
+            # Forget ids sent long enough ago (so a long running server doesn't keep them all)
+            while self.dedup_ids:
+                dedup_id, sent = next(iter(self.dedup_ids.items()))
+                if now - sent < QUEUE_DEDUP_INTERVAL:
+                    break
+                del self.dedup_ids[dedup_id]
+            if MessageDeduplicationId in self.dedup_ids:
+                return {'MessageId': None}
+            if MessageDeduplicationId:
+                self.dedup_ids[MessageDeduplicationId] = now
+            message_id = str(uuid4())
+            # NOTE Only messages of FIFO queues have a group
+            attributes = {} if MessageGroupId is None else {'MessageGroupId': MessageGroupId}
+            self.queues.setdefault(QueueUrl, deque()).append((now + DelaySeconds, {
+                'messageId': message_id,
+                'body': MessageBody,
+                'attributes': attributes,
+            }))
+        return {'MessageId': message_id}
+
+    def messages(self, queue_url):
+        """Return the records of all messages in a queue (without taking them)"""
+        with self.lock:
+            return [record for visible, record in self.queues.get(queue_url, ())]
+
+    def take(self, queue_url, limit=10):
+        """Return (and remove) up to limit messages, as the records of a Lambda SQS event"""
+        now = monotonic()
+        records = []
+        with self.lock:
+            messages = self.queues.get(queue_url, deque())
+            for message in list(messages):
+                if len(records) == limit:
+                    break
+                if message[0] <= now:
+                    messages.remove(message)
+                    records.append(message[1])
+        return records
+
+    def put_back(self, queue_url, records):
+        """Return records to the front of a queue (e.g. those that failed to be processed)"""
+        with self.lock:
+            self.queues.setdefault(queue_url, deque()).extendleft(
+                (0, record) for record in reversed(records))
+
+    def clear(self):
+        with self.lock:
+            self.queues.clear()
+            self.dedup_ids.clear()
+            self.calls.clear()
+
+
+# Services shared by all invocations (like AWS's are)
+database = MemoryDatabase()
+sockets = MemorySockets()
+sns = MemorySNS()
+queue = MemoryQueue()
+
+
+def reset():
+    """Clear all data and stats (tables and clients remain valid)"""
+    database.clear()
+    sockets.clear()
+    sns.clear()
+    queue.clear()
+
+
+def reset_stats():
+    """Clear stats of requests made (keeping all data)"""
+    database.calls.clear()
+    sockets.calls.clear()
+    sns.calls.clear()
+    sns.published.clear()
+    queue.calls.clear()
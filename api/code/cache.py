@@ -0,0 +1,97 @@
+
+import os
+import threading
+from time import monotonic
+
+
+# Seconds room records may be reused by later invocations of the same container (0 = never)
+# NOTE Rooms are read on almost every message (e.g. to check chat permission) but rarely change
+ROOM_CACHE_TTL = float(os.environ.get('ROOM_CACHE_TTL', 0))
+
+
+# Represents "not cached" since records themselves may be None (i.e. known to not exist)
+MISSING = object()
+
+
+class RecordCache:
+    """An identity map of the db records read or written during a single request
+
+    Records are cached by table and key, so each is only fetched once per request, and updates made
+    via the handlers' setters replace the cached record so reads stay strongly consistent within
+    the request (though may miss other requests' updates, it's own are most important).
+
+    WARN If put/update outside of setters, cached record may be old/missing
+
+    """
+
+    def __init__(self):
+        self._records = {}
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, table, key):
+        """Return the cached record or MISSING"""
+        record = self._records.get((table, key), MISSING)
+        self.stats['misses' if record is MISSING else 'hits'] += 1
+        return record
+
+    def set(self, table, key, record):
+        """Cache the latest version of a record (None if known to not exist)"""
+        self._records[(table, key)] = record
+
+    def discard(self, table, key):
+        """Forget a record (e.g. if it may have been changed by another request)"""
+        self._records.pop((table, key), None)
+
+
+class SharedRecordCache:
+    """A cache of versioned records that persists across invocations (for up to `ttl` seconds)
+
+    Records must have a `version` that increases with every write, so that an older record (e.g.
+    from an earlier read that finished later) never replaces a newer one. Updates by other
+    containers can't be known however, so records are only trusted until they expire.
+
+    WARN Only use for records that can be slightly stale when read (verify version when writing)
+
+    NOTE Thread safe, as the self-hosted server shares it between all the invocations it handles
+         at once (see server/server.py)
+
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (expires, record)
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidated': 0}
+
+    def get(self, key):
+        """Return the cached record or MISSING"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] < monotonic():
+                del self._entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            self.stats['hits' if entry else 'misses'] += 1
+        return entry[1] if entry else MISSING
+
+    def put(self, key, record):
+        """Cache a record unless disabled or a newer version is already cached"""
+        if self.ttl <= 0 or record is None:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1].get('version', 0) > record.get('version', 0):
+                return
+            self._entries[key] = (monotonic() + self.ttl, record)
+
+    def invalidate(self, key, version=None):
+        """Forget a record (or only if cached version is older than given version)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (version is None or entry[1].get('version', 0) < version):
+                del self._entries[key]
+                self.stats['invalidated'] += 1
+
+
+# Room records shared by all invocations of the container
+room_cache = SharedRecordCache(ROOM_CACHE_TTL)
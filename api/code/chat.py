@@ -0,0 +1,153 @@
+
+# Conversion of chat messages (plain text) to html with line breaks and links
+# NOTE Output is identical to escaping each line, joining with <br> and then running
+#      `bleach.linkify(html, [nofollow, target_blank])` (which is what was done before), but in a
+#      single pass over the text rather than building and serializing an html5lib parse tree
+#      Uses the same url regex as bleach 3.x and reproduces how its serializer escapes things
+#      See bench/bench_chat.py for a differential check against bleach
+
+
+import re
+
+
+# Same TLDs and protocols as bleach uses to recognise urls (bleach.linkifier.TLDS and
+# html5lib's sanitizer's allowed_protocols)
+TLDS = """ac ad ae aero af ag ai al am an ao aq ar arpa as asia at au aw ax az
+    ba bb bd be bf bg bh bi biz bj bm bn bo br bs bt bv bw by bz ca cat
+    cc cd cf cg ch ci ck cl cm cn co com coop cr cu cv cx cy cz de dj dk
+    dm do dz ec edu ee eg er es et eu fi fj fk fm fo fr ga gb gd ge gf gg
+    gh gi gl gm gn gov gp gq gr gs gt gu gw gy hk hm hn hr ht hu id ie il
+    im in info int io iq ir is it je jm jo jobs jp ke kg kh ki km kn kp
+    kr kw ky kz la lb lc li lk lr ls lt lu lv ly ma mc md me mg mh mil mk
+    ml mm mn mo mobi mp mq mr ms mt mu museum mv mw mx my mz na name nc ne
+    net nf ng ni nl no np nr nu nz om org pa pe pf pg ph pk pl pm pn post
+    pr pro ps pt pw py qa re ro rs ru rw sa sb sc sd se sg sh si sj sk sl
+    sm sn so sr ss st su sv sx sy sz tc td tel tf tg th tj tk tl tm tn to
+    tp tr travel tt tv tw tz ua ug uk us uy uz va vc ve vg vi vn vu wf ws
+    xn xxx ye yt yu za zm zw""".split()
+PROTOCOLS = ('afs', 'aim', 'callto', 'data', 'ed2k', 'feed', 'ftp', 'gopher', 'http', 'https',
+    'irc', 'mailto', 'news', 'nntp', 'rsync', 'rtsp', 'sftp', 'ssh', 'tag', 'telnet', 'urn',
+    'webcal', 'xmpp')
+
+URL_RE = re.compile(
+    r"""\(*  # Match any opening parentheses.
+    \b(?<![@.])(?:(?:{0}):/{{0,3}}(?:(?:\w+:)?\w+@)?)?  # http://
+    ([\w-]+\.)+(?:{1})(?:\:[0-9]+)?(?!\.\w)\b   # xx.yy.tld(:##)?
+    (?:[/?][^\s\{{\}}\|\\\^\[\]`<>"]*)?
+        # /path/zz (excluding "unsafe" chars from RFC 1738,
+        # except for # and ~, which happen in practice)
+    """.format('|'.join(sorted(PROTOCOLS)), '|'.join(sorted(TLDS))),
+    re.IGNORECASE | re.VERBOSE | re.UNICODE,
+)
+PROTO_RE = re.compile(r'^[\w-]+:/{0,3}', re.IGNORECASE)
+
+# Characters that end a character reference (when bleach looks for them)
+_REF_END = frozenset('<&=;' + ' \t\n\r\x0b\x0c')
+
+
+def _escape_text(text):
+    # NOTE html5lib's serializer only escapes these in text (not quotes)
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _match_ref(text):
+    """Return the character reference (without & and ;) that text starts with, if valid
+
+    Matches what bleach's `match_entity` and `convert_entity` accept, including the quirk that
+    numeric references end at the first invalid character, which is then skipped over
+
+    """
+    if text.startswith('#'):
+        hexa = text[1:2] in ('x', 'X')
+        allowed = '0123456789abcdefABCDEF' if hexa else '0123456789'
+        start = end = 2 if hexa else 1
+        while end < len(text) and text[end] in allowed:
+            end += 1
+        semicolon = end
+        if end < len(text) and text[end] not in _REF_END:
+            semicolon += 1
+        if end > start and text.startswith(';', semicolon) and \
+                0 < int(text[start:end], 16 if hexa else 10) < 0x110000:
+            return text[:end]
+        return None
+
+    # Named references are only valid if a name that doesn't need a semicolon is followed by one
+    # (as bleach looks up the name without it)
+    end = 0
+    while end < len(text) and text[end] not in _REF_END:
+        end += 1
+    if end and text.startswith(';', end):
+        from html.entities import html5  # NOTE Rarely needed so only imported if so
+        if text[:end] in html5:
+            return text[:end]
+    return None
+
+
+def _escape_href(href):
+    """Escape an href the same way bleach's serializer does
+
+    Ampersands are escaped unless they start a valid character reference, and quotes never need
+    escaping as urls can't contain them
+
+    """
+    if '&' not in href:
+        return href
+    parts = href.split('&')
+    out = [parts[0]]
+    for part in parts[1:]:
+        ref = _match_ref(part)
+        if ref:
+            # NOTE Same as bleach, continues after ref's length + 1 (not always the semicolon)
+            out.append(f'&{ref};{part[len(ref) + 1:]}')
+        else:
+            out.append(f'&amp;{part}')
+    return ''.join(out)
+
+
+def _strip_non_url_bits(url):
+    """Return (url, prefix, suffix) with brackets and punctuation not part of url moved out"""
+    prefix = suffix = ''
+    while url:
+        if url.startswith('('):
+            prefix += '('
+            url = url[1:]
+            if url.endswith(')'):
+                suffix = ')' + suffix
+                url = url[:-1]
+        elif url[-1] in ',.' or (url[-1] == ')' and '(' not in url):
+            suffix = url[-1] + suffix
+            url = url[:-1]
+        else:
+            break
+    return url, prefix, suffix
+
+
+def _link(url):
+    """Return html for a matched url"""
+    url, prefix, suffix = _strip_non_url_bits(url)
+    href = url if PROTO_RE.search(url) else f'http://{url}'
+    attrs = '' if href.startswith('mailto:') else ' rel="nofollow" target="_blank"'
+    return (f'{_escape_text(prefix)}<a href="{_escape_href(href)}"{attrs}>'
+        f'{_escape_text(url)}</a>{_escape_text(suffix)}')
+
+
+def message_to_html(message):
+    """Return a chat message as html, with newlines as <br> and urls as links"""
+    # NOTE html5lib normalises carriage returns to newlines and drops null characters
+    html = []
+    for line in message.split('\n'):
+        if '\r' in line or '\0' in line:
+            line = line.replace('\r', '\n').replace('\0', '')
+        if '.' not in line:  # Quick check as all urls must have a dot
+            html.append(_escape_text(line))
+            html.append('<br>')
+            continue
+        pos = 0
+        for match in URL_RE.finditer(line):
+            html.append(_escape_text(line[pos:match.start()]))
+            html.append(_link(match.group()))
+            pos = match.end()
+        html.append(_escape_text(line[pos:]))
+        html.append('<br>')
+    html.pop()
+    return ''.join(html)
@@ -0,0 +1,328 @@
+
+# DynamoDB via the low-level client, with values converted to/from typed attribute maps directly
+# NOTE Tables have the same interface as boto3's Table resource (for the methods handlers use), but
+#      numbers are given and returned as floats without going through Decimal or boto3's
+#      serializer, and without changing any global state (like DYNAMODB_CONTEXT's traps)
+# NOTE Low-level clients are also quicker to create than resources (no resource model to load)
+# WARN Numbers are always returned as floats, so may lose precision beyond 15 significant digits
+#      (which is fine for the timestamps, counts and positions stored)
+# NOTE Numbers a float can't hold exactly (e.g. timestamps written via Decimal before this codec)
+#      are returned as `ExactNumber` so they're written back unchanged, as conditions comparing
+#      them to what's stored (e.g. `room_joined=:_old_joined`) would otherwise never match
+
+
+from math import isfinite
+from time import sleep
+from decimal import Decimal
+from types import SimpleNamespace
+
+from boto3.dynamodb.conditions import ConditionExpressionBuilder
+
+
+class ExactNumber(float):
+    """A float that also keeps the exact number it was decoded from (for writing it back)"""
+
+    __slots__ = ('exact',)
+
+    def __new__(cls, exact):
+        number = super().__new__(cls, exact)
+        number.exact = exact
+        return number
+
+
+# ENCODING
+
+
+def _encode_exact(value):
+    return {'N': value.exact}
+
+
+def _encode_number(value):
+    if not isfinite(value):
+        raise TypeError(f"DynamoDB does not support {value} as a number")
+    return {'N': repr(value)}
+
+
+def _encode_decimal(value):
+    _encode_number(value)  # Check finite
+    return {'N': str(value)}
+
+
+def _encode_set(value):
+    if not value:
+        raise TypeError("DynamoDB does not support empty sets")
+    sample = next(iter(value))
+    if isinstance(sample, str):
+        return {'SS': list(value)}
+    if isinstance(sample, bytes):
+        return {'BS': list(value)}
+    return {'NS': [encode(num)['N'] for num in value]}
+
+
+def _encode_map(value):
+    return {'M': {key: encode(val) for key, val in value.items()}}
+
+
+def _encode_list(value):
+    return {'L': [encode(val) for val in value]}
+
+
+# Encoders by exact type (bool must not be treated as a number)
+_ENCODERS = {
+    str: lambda value: {'S': value},
+    float: _encode_number,
+    ExactNumber: _encode_exact,
+    int: lambda value: {'N': str(value)},
+    bool: lambda value: {'BOOL': value},
+    type(None): lambda value: {'NULL': True},
+    dict: _encode_map,
+    list: _encode_list,
+    tuple: _encode_list,
+    bytes: lambda value: {'B': value},
+    Decimal: _encode_decimal,
+    set: _encode_set,
+    frozenset: _encode_set,
+}
+
+
+def encode(value):
+    """Return a value as a typed attribute value (e.g. 1.5 -> {'N': '1.5'})"""
+    try:
+        return _ENCODERS[type(value)](value)
+    except KeyError:
+        pass
+    # Subclasses of supported types
+    for cls, encoder in _ENCODERS.items():
+        if isinstance(value, cls):
+            return encoder(value)
+    raise TypeError(f"Unsupported type for DynamoDB: {type(value)}")
+
+
+def encode_item(item):
+    """Return a dict of values as a map of typed attribute values"""
+    return {key: encode(val) for key, val in item.items()}
+
+
+# DECODING
+
+
+def _decode_map(value):
+    return {key: decode(val) for key, val in value.items()}
+
+
+def _decode_list(value):
+    return [decode(val) for val in value]
+
+
+def _decode_number(value):
+    number = float(value)
+    # NOTE Only long numbers can have more significant digits than a float holds (so checked)
+    if len(value) > 16 and repr(number) != value:
+        return ExactNumber(value)
+    return number
+
+
+_DECODERS = {
+    'S': lambda value: value,
+    'N': _decode_number,
+    'BOOL': lambda value: value,
+    'NULL': lambda value: None,
+    'M': _decode_map,
+    'L': _decode_list,
+    'B': lambda value: value,
+    'SS': set,
+    'NS': lambda value: set(map(float, value)),
+    'BS': set,
+}
+
+
+def decode(value):
+    """Return a typed attribute value as a value (e.g. {'N': '1.5'} -> 1.5)"""
+    # NOTE Strings and numbers are by far the most common so checked before a general lookup
+    if 'S' in value:
+        return value['S']
+    if 'N' in value:
+        return _decode_number(value['N'])
+    (tag, val), = value.items()
+    return _DECODERS[tag](val)
+
+
+def decode_item(item):
+    """Return a map of typed attribute values as a dict of values"""
+    return {key: decode(val) for key, val in item.items()}
+
+
+# REQUESTS
+
+
+# Params whose values are items (or maps of values)
+_ITEM_PARAMS = ('Key', 'Item', 'ExclusiveStartKey', 'ExpressionAttributeValues')
+
+# Params that may be given as boto3 condition objects (e.g. `Attr('id').exists()`)
+_CONDITION_PARAMS = ('ConditionExpression', 'KeyConditionExpression', 'FilterExpression')
+
+
+def encode_params(params):
+    """Return params for a low-level request with conditions built and values encoded"""
+    params = dict(params)
+
+    # Build any condition objects (with placeholders unique for the whole request)
+    builder = None
+    for name in _CONDITION_PARAMS:
+        condition = params.get(name)
+        if condition is None or isinstance(condition, str):
+            continue
+        builder = builder or ConditionExpressionBuilder()
+        built = builder.build_expression(condition,
+            is_key_condition=name == 'KeyConditionExpression')
+        params[name] = built.condition_expression
+        if built.attribute_name_placeholders:
+            params['ExpressionAttributeNames'] = {**params.get('ExpressionAttributeNames', {}),
+                **built.attribute_name_placeholders}
+        if built.attribute_value_placeholders:
+            params['ExpressionAttributeValues'] = {**params.get('ExpressionAttributeValues', {}),
+                **built.attribute_value_placeholders}
+
+    for name in _ITEM_PARAMS:
+        if name in params:
+            params[name] = encode_item(params[name])
+    return params
+
+
+def decode_response(resp):
+    """Decode the items in a low-level response (in place) and return it"""
+    for name in ('Item', 'Attributes', 'LastEvaluatedKey'):
+        if name in resp:
+            resp[name] = decode_item(resp[name])
+    if 'Items' in resp:
+        resp['Items'] = [decode_item(item) for item in resp['Items']]
+    return resp
+
+
+class Client:
+    """Wraps a low-level DynamoDB client so values are encoded/decoded
+
+    NOTE Has the client's `meta` (for registering events) and `exceptions`
+
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.meta = client.meta
+        self.exceptions = client.exceptions
+
+    def call(self, operation, params):
+        """Make a request with params of native values and return response with native values"""
+        return decode_response(getattr(self.client, operation)(**encode_params(params)))
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        items = [{action: encode_params(params) for action, params in item.items()}
+            for item in TransactItems]
+        return self.client.transact_write_items(TransactItems=items, **kwargs)
+
+
+class Table:
+    """A table with the same interface as boto3's Table resource (for the methods used)"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def get_item(self, **params):
+        return self.client.call('get_item', {'TableName': self.name, **params})
+
+    def put_item(self, **params):
+        return self.client.call('put_item', {'TableName': self.name, **params})
+
+    def update_item(self, **params):
+        return self.client.call('update_item', {'TableName': self.name, **params})
+
+    def delete_item(self, **params):
+        return self.client.call('delete_item', {'TableName': self.name, **params})
+
+    def query(self, **params):
+        return self.client.call('query', {'TableName': self.name, **params})
+
+    def scan(self, **params):
+        return self.client.call('scan', {'TableName': self.name, **params})
+
+    def batch_writer(self):
+        return BatchWriter(self)
+
+
+class UnprocessedItemsError(Exception):
+    """DynamoDB kept leaving writes of a batch unprocessed (e.g. as the table is throttled)"""
+
+
+class BatchWriter:
+    """Buffers puts/deletes and writes them in batches (like boto3's batch_writer)"""
+
+    BATCH_SIZE = 25  # Max per request allowed by DynamoDB
+    MAX_ATTEMPTS = 6  # Times to send writes DynamoDB leaves unprocessed before giving up
+    BACKOFF = 0.05  # Seconds to wait before retrying unprocessed writes (doubled each time)
+
+    def __init__(self, table):
+        self.table = table
+        self.requests = []
+        self.attempts = 0  # Times the writes at the front of the queue have been left unprocessed
+
+    def put_item(self, Item):
+        self.requests.append({'PutRequest': {'Item': encode_item(Item)}})
+        if len(self.requests) >= self.BATCH_SIZE:
+            self.flush()
+
+    def delete_item(self, Key):
+        self.requests.append({'DeleteRequest': {'Key': encode_item(Key)}})
+        if len(self.requests) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Write a batch, keeping any unprocessed requests to be retried first in the next
+
+        DynamoDB leaves requests unprocessed when throttled, so retries are backed off
+        exponentially (like AWS advises) and an error raised if still unprocessed after
+        MAX_ATTEMPTS, rather than retrying in a tight loop until the function times out
+
+        """
+        batch = self.requests[:self.BATCH_SIZE]
+        self.requests = self.requests[self.BATCH_SIZE:]
+        resp = self.table.client.client.batch_write_item(RequestItems={self.table.name: batch})
+        unprocessed = resp.get('UnprocessedItems', {}).get(self.table.name)
+        if not unprocessed:
+            self.attempts = 0
+            return
+        self.attempts += 1
+        if self.attempts >= self.MAX_ATTEMPTS:
+            raise UnprocessedItemsError(f"{len(unprocessed)} writes to {self.table.name} still"
+                f" unprocessed after {self.attempts} attempts")
+        self.requests[:0] = unprocessed
+        sleep(self.BACKOFF * 2 ** (self.attempts - 1))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        while self.requests:
+            self.flush()
+
+
+class Database:
+    """The DynamoDB service with the same interface as boto3's resource (for the parts used)"""
+
+    def __init__(self, client):
+        self.meta = SimpleNamespace(client=Client(client))
+
+    def Table(self, name):
+        return Table(self.meta.client, name)
+
+    def batch_get_item(self, RequestItems):
+        requests = {name: {**request, 'Keys': [encode_item(key) for key in request['Keys']]}
+            for name, request in RequestItems.items()}
+        resp = self.meta.client.client.batch_get_item(RequestItems=requests)
+        resp['Responses'] = {name: [decode_item(item) for item in items]
+            for name, items in resp['Responses'].items()}
+        # NOTE Unprocessed keys are decoded so they can be given again as is
+        resp['UnprocessedKeys'] = {
+            name: {**request, 'Keys': [decode_item(key) for key in request['Keys']]}
+            for name, request in resp.get('UnprocessedKeys', {}).items()}
+        return resp
@@ -2,18 +2,44 @@
 # WARN No imports allowed here to keep sync responses as fast as possible
 
 
+def is_sync_request(event):
+    """Whether event is a sync request (body is present and not JSON)"""
+    body = event.get('body')
+    return bool(body) and body[0] != '{'
+
+
 def reply_to_sync_request(event):
-    """Reply to a sync request by adding own timestamp"""
+    """Reply to a sync request by adding own timestamps
+
+    Sync requests are either just the client's timestamp (ms), or a probe which is the same but
+    prefixed with 'p' (and may have a fraction). A client usually sends a burst of probes at once
+    and then estimates its clock offset from the reply with the least delay (like NTP does).
+    Replies are the request's body and when API Gateway received it (`requestTimeEpoch`, ms), and
+    replies to probes also have (ms):
+        1. When this function started handling it (wall clock, with fraction)
+        2. Time taken by this function before replying (monotonic, so unaffected by clock changes)
+    So client can tell time spent on the server apart from the network round trip
+
+    """
+
+    # Note when started handling probes
+    # NOTE time is built into Python, so importing it is practically free
+    probe = event['body'][0] == 'p'
+    if probe:
+        from time import time, perf_counter
+        received = time()
+        started = perf_counter()
 
     # Get access to sockets to send reply
-    import boto3
-    domain = event['requestContext']['domainName']
-    stage = event['requestContext']['stage']
-    sockets = boto3.client('apigatewaymanagementapi', endpoint_url=f'https://{domain}/{stage}')
+    # NOTE Client only created on first sync, and then reused by later invocations
+    from resources import get_sockets
+    sockets = get_sockets(event['requestContext']['domainName'], event['requestContext']['stage'])
 
     # Add this request's timestamp to existing one
     # WARN We are echoing untested user input (should be safe as only echoing to the sender)
     data = event['body'] + '\n' + str(event['requestContext']['requestTimeEpoch'])
+    if probe:
+        data += f'\n{received * 1000:.3f}\n{(perf_counter() - started) * 1000:.3f}'
 
     # Send the data back to the client (ignore if just disconnected)
     sender = event['requestContext']['connectionId']
@@ -38,35 +64,41 @@ def handle(event, context):
     """
 
     # Directly respond to time syncs to make response as fast as possible
-    body = event.get('body')
-    if body and body[0] != '{':
-        # Body is present and not JSON so assuming it is a sync message
+    if is_sync_request(event):
         reply_to_sync_request(event)
         return
 
-    # Handle regular message
+    # Handle regular message (tracing its requests if enabled)
+    from tracing import start_trace
+    start_trace()
     from handlers import WebsocketHandlers
     handlers = WebsocketHandlers(event, context)
-    handlers.process_input()
-    handlers.handle()
+    try:
+        handlers.process_input()
+        handlers.handle()
+    except Exception:
+        # Still send messages queued before the handler failed (e.g. the client error reply)
+        # NOTE Failing to do so is only reported, so not to mask why the handler failed
+        try:
+            handlers.flush_outbox()
+        except Exception as exc:
+            from reporting import report_error
+            report_error(exc)
+        raise
+
+    # Send all messages queued by the handler
+    handlers.flush_outbox()
 
 
 def enter(event, context):
-    """Wrap all handling to catch any errors and report via SNS"""
+    """Wrap all handling to catch any errors and report via SNS (and log trace if enabled)"""
     try:
         handle(event, context)
         return {'statusCode': 200}
     except Exception as exc:
-        # Send traceback info to errors SNS topic
-        import os
-        import boto3
-        import traceback
-        stack = os.environ['STACK']
-        boto3.client('sns').publish(
-            TopicArn=os.environ['TOPIC_ERRORS'],
-            Subject=f"{stack} API Error",
-            Message=traceback.format_exc(),
-        )
+        # Send traceback info to errors SNS topic (in background, unless a like one just was)
+        from reporting import report_error
+        report_error(exc)
 
         # If was a client error, don't fail as not a server error
         # NOTE But still probs issue with own code, so still notified above
@@ -76,3 +108,58 @@ def enter(event, context):
 
         # Reraise exc so also exists in normal lambda logs and client knows something went wrong
         raise
+    finally:
+        # Log the requests made by the invocation (see tracing.py)
+        # NOTE Sync requests aren't traced, so not to import anything for them
+        if not is_sync_request(event):
+            from tracing import end_trace
+            end_trace()
+            finish_reports(context)
+
+
+def finish_reports(context):
+    """Wait for errors reported to be published before returning (see reporting.py)
+
+    WARN Lambda freezes the container once the function returns, so they could be lost otherwise
+
+    """
+    # NOTE reporting.py is only imported once something is reported, so nothing to wait for if not
+    #      (sys itself is always already loaded)
+    import sys
+    if 'reporting' in sys.modules:
+        from reporting import ERROR_REPORT_WAIT, wait_for_reports
+        remaining = context.get_remaining_time_in_millis() / 1000 - 1  # Leave time to return
+        wait_for_reports(max(0, min(ERROR_REPORT_WAIT, remaining)))
+
+
+def sweep(event, context):
+    """Remove clients whose sockets can't still be connected and finish deleting rooms
+
+    Run on a schedule (see reaper.py)
+
+    """
+    from resources import get_db, get_table
+    from reaper import sweep_clients, sweep_deleted_rooms
+    try:
+        reaped = sweep_clients(get_db(), get_table('clients'), get_table('rosters'))
+        deleted, evicted = sweep_deleted_rooms(get_table('rooms'), context)
+        print(f"Reaped {reaped} clients, deleted {deleted} rooms ({evicted} clients evicted)")
+    except Exception as exc:
+        from reporting import report_error
+        report_error(exc)
+        raise
+    finally:
+        finish_reports(context)
+
+
+def drain(event, context):
+    """Apply messages from the room queue and flush rosters (see room_queue.py), returning those
+    to retry
+
+    """
+    from room_queue import drain_records
+    try:
+        failed = drain_records(event['Records'], context)
+    finally:
+        finish_reports(context)
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
@@ -0,0 +1,83 @@
+
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from tracing import current_trace, set_trace
+
+
+# Thread pools are kept for the life of the container so warm invocations don't recreate them
+# NOTE Keyed by size so different callers can have different limits
+_executors = {}
+
+
+def _get_executor(limit):
+    """Return a (possibly already existing) thread pool of the given size"""
+    if limit not in _executors:
+        _executors[limit] = ThreadPoolExecutor(max_workers=limit)
+    return _executors[limit]
+
+
+def _timed_call(task, item):
+    """Call task with item and return a result tuple (never raising)"""
+    start = perf_counter()
+    try:
+        result = task(item)
+    except Exception as exc:
+        return (item, None, exc, perf_counter() - start)
+    return (item, result, None, perf_counter() - start)
+
+
+def _traced_call(trace, task, item):
+    """Call task with item in a pool thread, recording requests in the caller's trace"""
+    set_trace(trace)
+    try:
+        return _timed_call(task, item)
+    finally:
+        set_trace(None)
+
+
+def fan_out(task, items, limit):
+    """Call `task(item)` for every item, with at most `limit` calls in flight at once
+
+    Yields `(item, result, exception, seconds)` for each call as it completes
+    Exceptions are returned rather than raised so one failure doesn't prevent the other calls
+
+    NOTE `items` may be a generator, and it is only consumed as fast as calls complete
+        So memory stays bounded by `limit` (and sending can start before all items are known)
+    NOTE If results stop being iterated early (e.g. `break`), calls not yet started are cancelled
+        (though those in progress will still finish in the background)
+    WARN Calls are only made as the results are iterated, so always consume all results
+        unless intending to stop early
+    WARN `task` is called from multiple threads, so must be thread safe (boto3 clients are)
+
+    """
+
+    # No point using threads if can't do more than one at a time
+    if limit <= 1:
+        for item in items:
+            yield _timed_call(task, item)
+        return
+
+    executor = _get_executor(limit)
+    trace = current_trace()
+    pending = set()
+    try:
+        for item in items:
+
+            # If already at the limit, wait for at least one call to finish before adding another
+            if len(pending) >= limit:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+            pending.add(executor.submit(_traced_call, trace, task, item))
+
+        # Wait for the remaining calls
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # Cancel calls not yet started if stopped early
+        for future in pending:
+            future.cancel()
@@ -1,15 +1,20 @@
 
 import os
 import json
-from pathlib import Path
-from numbers import Number
+from time import time
 from datetime import datetime
 from contextlib import contextmanager
+from secrets import token_urlsafe
 
-import boto3
 from boto3.dynamodb.conditions import Attr
 
-from utils import add_support_for_floats_to_dynamodb
+from fanout import fan_out
+from cache import RecordCache, MISSING, room_cache
+from resources import SEND_CONCURRENCY, get_config, get_sockets, get_db, get_table
+from tracing import tag, tag_max
+from schemas import FIELD_TYPES, Schema, InvalidMessage, compile_dispatch
+from utils import merge_room_clients_diffs, pack_frames
+from room_queue import ROOM_QUEUE, QUEUED_TYPES, queue_room_message, queue_roster_flush
 from handlers_aws import HandlersAWS
 from handlers_room import HandlersRoom
 from handlers_media import HandlersMedia
@@ -17,42 +22,82 @@ from handlers_client import HandlersClient
 from handlers_payment import HandlersPayment
 
 
-# Avoid having to convert floats to decimals when using dynamodb
-# NOTE Must call before interacting with dynamodb, but don't want to import in entrypoint
-# WARN Call this only once or will get recursion error (as lambda may execute multiple times)
-add_support_for_floats_to_dynamodb()
+# Seconds to collect changes to a room's clients before broadcasting them together (0 = don't)
+# NOTE Flushed by the room queue's worker (see `flush_room_clients_diffs`), and whole seconds as
+#      that's all SQS can delay a message by
+ROSTER_FLUSH_INTERVAL = int(os.environ.get('ROSTER_FLUSH_INTERVAL', 1))
 
+# Seconds after a room's flush was due before assuming it was never queued and another can be
+# NOTE Flushes that fail are retried by the queue, so this is only needed if queuing one failed
+ROSTER_FLUSH_STALE = 30
 
-NoneType = type(None)  # Not importable and not normally in global scope
+# Max diffs removed from a roster summary's queue at once (keeps the update expression small)
+ROSTER_FLUSH_CHUNK = 100
+
+# Max admins and max guests included in a clients list
+# WARN Client assumes the same limit when applying diffs
+ROSTER_DISPLAY_LIMIT = 100
+
+# Prefix of attributes in a room's roster summary that hold an entry for a displayed client
+ROSTER_ENTRY_PREFIX = 'client:'
+
+# Fields of a client record kept in roster summary entries (what `client_display` needs + order)
+ROSTER_ENTRY_FIELDS = ('socket', 'name', 'room_admin', 'room_synced', 'room_joined')
+
+# Seconds a roster summary must be unchanged before repairing its entries from the clients index
+# NOTE The index is eventually consistent so may not reflect the latest joins/leaves straight away
+ROSTER_REPAIR_DELAY = 5
+
+# Seconds a roster summary is kept after last changed (same as rooms, which it is deleted with)
+ROSTER_EXPIRE = 60 * 60 * 24 * 30
+
+# Fields of a room's state sent to clients (in addition to version and media)
+ROOM_STATE_FIELDS = ('id', 'name', 'loaded', 'start', 'paused', 'admins_only_dj',
+    'admins_only_see_clients', 'admins_only_chat')
+
+# Times to attempt moving a client between rooms if the client changes concurrently
+ROSTER_TRANSACT_ATTEMPTS = 3
 
 
 class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient, HandlersPayment):
 
+    # Schema and values of message if validated by `handle` (see `expect`)
+    msg_schema = None
+    msg_values = None
+
 
     def __init__(self, event, context):
         """Unpack event and context and extract useful elements"""
         # WARN `client_error` cannot be used within __init__
 
         # Load app config
-        config_path = Path(__file__).parent / 'app_config.json'
-        self.config = json.loads(config_path.read_text())
+        self.config = get_config()
 
         # Useful data
         self.event = event
         self.context = context
         self.sender = event['requestContext']['connectionId']
 
-        # Access to sockets
-        # See https://docs.aws.amazon.com/apigateway/latest/developerguide/apigateway-how-to-call-websocket-api-connections.html
-        domain = event['requestContext']['domainName']
-        stage = event['requestContext']['stage']
-        self.sockets = boto3.client('apigatewaymanagementapi', endpoint_url=f'https://{domain}/{stage}')
+        # Access to sockets and db
+        # NOTE These are created only once per container and reused by later invocations
+        self.sockets = get_sockets(event['requestContext']['domainName'],
+            event['requestContext']['stage'])
+        self.db = get_db()
+        self.db_rooms = get_table('rooms')
+        self.db_media = get_table('media')
+        self.db_clients = get_table('clients')
+        self.db_rosters = get_table('rosters')
+        self.db_payments = get_table('payments')
+
+        # Cache of db records for this request (see DATABASE section)
+        self.cache = RecordCache()
+        self._rooms_from_shared_cache = set()
 
-        # Access to db
-        stack = os.environ['STACK']
-        self.db = boto3.resource('dynamodb')
-        self.db_rooms = self.db.Table(f'{stack}-rooms')
-        self.db_clients = self.db.Table(f'{stack}-clients')
+        # Messages to send when the invocation ends, by socket (see MESSAGES section)
+        self.outbox = {}
+
+        # Changes to the room to write together, if applying a batch of messages (see room_queue.py)
+        self.room_draft = None
 
 
     def process_input(self):
@@ -82,12 +127,34 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
 
 
     def handle(self):
-        """Call an appropriate handler for the given message type"""
-        handler = getattr(self, f'handle_{self.msg_type}', None)
-        if handler:
-            handler()
-        else:
+        """Validate the message's info and call the handler for its type (see DISPATCH)"""
+        entry = DISPATCH.get(self.msg_type) if isinstance(self.msg_type, str) else None
+        if not entry:
             self.client_error(f"Message type '{self.msg_type}' not valid")
+        handler, schema = entry
+
+        # NOTE Only tag valid types as tag is a metric dimension (see tracing.py)
+        tag(handler=self.msg_type)
+
+        # Validate info before handling so `expect` only needs to return its values
+        if schema:
+            self.msg_schema = schema
+            try:
+                self.msg_values = schema.validate(self.msg_info)
+            except InvalidMessage as exc:
+                self.client_error(str(exc))
+
+        # Queue messages that change a room to be applied in order and in batches (if enabled)
+        # NOTE Unless already applying a batch of them (see room_queue.py)
+        if ROOM_QUEUE and self.room_draft is None and self.msg_type in QUEUED_TYPES:
+            queue_room_message(self)
+            return
+        try:
+            handler(self)
+        except self.RoomDeleted:
+            # Tell client so it leaves the room (as when joining one that doesn't exist)
+            self.reply('room_invalid', {'room_id': self.client['room_id']})
+            raise
 
 
     # ERROR HANDLING
@@ -97,6 +164,10 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
         """Raised when an error has occured and only the client can resolve it"""
 
 
+    class RoomDeleted(ClientError):
+        """Raised when the sender's room is being deleted (see `room` and `handle_room_delete`)"""
+
+
     @contextmanager
     def condition_to_client_error(self):
         """A context manager that turns DynamoDB condition failures into ClientError
@@ -149,45 +220,21 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
     # VALIDATION
 
 
-    def expect_from(self, data, types, required=(), nullable=()):
-        """Return data's values in order, checking with given types
+    def expect_from(self, data, schema, required=(), nullable=()):
+        """Return data's values in order, checking them with a schema (see schemas.py)
 
+        Schema can be precompiled, or a dict of types to compile with the required/nullable keys
         If multiple keys, a list is returned for easy unpacking
         If a single key, only that value is returned for easy variable assignment
         If no keys, an empty list is returned and client error still raised if extraneous fields
 
         """
-
-        # Don't allow extraneous fields
-        all_keys = (*required, *nullable)
-        extraneous = set(data.keys()) - set(all_keys)
-        if extraneous:
-            self.client_error(f"Unknown fields given: {', '.join(extraneous)}")
-
-        # Check each item
-        validated = []
-        for key in all_keys:
-
-            # Ensure every key is provided
-            if key not in data:
-                self.client_error(f"Missing '{key}' field")
-            val = data[key]
-
-            # Ensure value is of correct type
-            other_types = [NoneType] if key in nullable else []
-            if not isinstance(val, (types[key], *other_types)):
-                self.client_error(f"Invalid value for '{key}' field")
-
-            # Strip strings
-            if isinstance(val, str):
-                val = val.strip()
-
-            # Map empty strings to None for consistency (dynamodb also doesn't allow empty strings)
-            if val == '':
-                val = None
-
-            # Add to output
-            validated.append(val)
+        if not isinstance(schema, Schema):
+            schema = Schema(schema, required, nullable)
+        try:
+            validated = schema.validate(data)
+        except InvalidMessage as exc:
+            self.client_error(str(exc))
 
         # Return values in order requested
         # NOTE If single item, does not wrap in a list
@@ -195,31 +242,16 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
 
 
     def expect(self, required=(), nullable=()):
-        """A shortcut for running `expect_from` on `msg_info`"""
-        types = {
-            'room_id': str,
-            'room_id_copy': str,
-            'room_name': str,
-            'room_secret': str,
-            'room_start': Number,
-            'room_paused': Number,
-            'room_loaded': int,
-            'room_admins_only': bool,
-            'room_message': str,
-            'client_name': str,
-            'client_synced': Number,
-            'client_feedback': str,
-            'client_email': str,
-            'client_user_agent': str,
-            'payment_amount': int,
-            'payment_return_url': str,
-            'media_id': str,
-            'media_id_after': str,
-            'media_name': str,
-            'media_type': str,
-            'media_content': dict,
-        }
-        return self.expect_from(self.msg_info, types, required, nullable)
+        """Return `msg_info`'s values in order, as already validated by its schema in MESSAGES
+
+        If the keys differ from those of the message's schema, or the handler wasn't called via
+        `handle`, then `msg_info` is validated against the keys given instead
+
+        """
+        if self.msg_schema and self.msg_schema.keys == (*required, *nullable):
+            validated = self.msg_values
+            return validated[0] if len(validated) == 1 else validated
+        return self.expect_from(self.msg_info, FIELD_TYPES, required, nullable)
 
 
     def check_permission(self, expected_room_id, specific=None, *, admins_only=False):
@@ -248,14 +280,8 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
 
 
     # By caching and updating after updates, reads will be strongly consistant within the request
-    # NOTE Change of missing another request's updates, but within own request is most important
-    # WARN Values may be None (as with room) so False represents "not cached"
-    # WARN If put/update outside of setters, getter may get old/missing value
-    _cached_client = False
-    _cached_room = {
-        'id': False,  # Client may change room, so need to remember which room cached
-        'value': False,
-    }
+    # NOTE See `RecordCache` in cache.py for caveats
+    # NOTE Rooms may also be cached across invocations if ROOM_CACHE_TTL set (see `room_cache`)
 
 
     @property
@@ -263,16 +289,17 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
         """DB client record for the sender"""
 
         # Return cached data if available
-        if self._cached_client is not False:
-            return self._cached_client
+        record = self.cache.get('clients', self.sender)
+        if record is not MISSING:
+            return record
 
         # Fetch fresh data
         resp = self.db_clients.get_item(Key={'socket': self.sender})
-        record = resp['Item']  # NOTE Expected to always exist
+        record = resp['Item']  # NOTE Exists until disconnected/reaped (see handle_aws_disconnect)
 
         # Cache and return
-        self._cached_client = record
-        return self._cached_client
+        self.cache.set('clients', self.sender, record)
+        return record
 
 
     @client.setter
@@ -301,24 +328,48 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
         # Update the record and update the cache with the result
         with self.condition_to_client_error():
             resp = self.db_clients.update_item(**update_kwargs)
-        self._cached_client = resp['Attributes']
+        self.cache.set('clients', self.sender, resp['Attributes'])
 
 
     @property
     def room(self):
         """DB room record for the sender"""
 
-        # If cached room is same as sender's current room, return that
+        # Return cached data if available
         # NOTE This means `room` relies on `client` being requested/cached
-        if self._cached_room['id'] == self.client['room_id']:
-            return self._cached_room['value']
-
-        # Fetch fresh data, cache, and return
-        # NOTE Since room state is critical and infrequently accessed, strongly consistent read used
-        self._cached_room['id'] = self.client['room_id']
-        resp = self.db_rooms.get_item(Key={'id': self._cached_room['id']}, ConsistentRead=True)
-        self._cached_room['value'] = resp.get('Item')
-        return self._cached_room['value']
+        room_id = self.client['room_id']
+        record = self.cache.get('rooms', room_id)
+        if record is MISSING:
+
+            # See if another invocation recently got the room
+            record = room_cache.get(room_id)
+            if record is not MISSING:
+                self._rooms_from_shared_cache.add(room_id)
+            else:
+                # Fetch fresh data
+                # NOTE Room state is critical and infrequently accessed, so strongly consistent read
+                resp = self.db_rooms.get_item(Key={'id': room_id}, ConsistentRead=True)
+                record = resp.get('Item')
+                if record and 'media' in record:
+                    record = self.migrate_room_media(record)
+                room_cache.put(room_id, record)
+
+            # Cache
+            self.cache.set('rooms', room_id, record)
+
+        # Rooms being deleted can't be used, as their remaining clients are still being evicted
+        # NOTE Use `in_room` to check without raising (e.g. when leaving)
+        if record and record.get('deleted'):
+            raise self.RoomDeleted(f"Room {room_id} is being deleted")
+        return record
+
+
+    def in_room(self):
+        """Whether sender is in a room that can be used (see `room`)"""
+        try:
+            return bool(self.room)
+        except self.RoomDeleted:
+            return False
 
 
     @room.setter
@@ -326,9 +377,8 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
         """Update the db room record for the sender"""
 
         # Ensure only ever update sender's room (and saves needing that kwarg)
-        # NOTE In case room changed, reset _room_id
-        self._cached_room['id'] = self.client['room_id']
-        update_kwargs['Key'] = {'id': self._cached_room['id']}
+        room_id = self.client['room_id']
+        update_kwargs['Key'] = {'id': room_id}
 
         # Ensure only ever update (and not create)
         # WARN This avoids: start-handler/$disconnect/update&end-handler leaving behind a "new"
@@ -336,20 +386,369 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
         # NOTE For docs on condition chaining, see:
         #      https://boto3.amazonaws.com/v1/documentation/api/latest/guide/dynamodb.html
         condition = Attr('id').exists()
+
+        # If room came from shared cache it may be stale, so ensure it's still the latest version
+        # NOTE Handler may have based the update on the cached values
+        from_shared_cache = room_id in self._rooms_from_shared_cache
+        if from_shared_cache:
+            condition = condition & Attr('version').eq(self.room.get('version', 0))
+
         if 'ConditionExpression' in update_kwargs:
             update_kwargs['ConditionExpression'] = condition & update_kwargs['ConditionExpression']
         else:
             update_kwargs['ConditionExpression'] = condition
 
+        # Increase version with every update
+        # NOTE New actions merely separated by a space (e.g. "SET a=a, b=b ADD c :c")
+        update_kwargs['UpdateExpression'] += ' ADD version :_version_increment'
+        update_kwargs.setdefault('ExpressionAttributeValues', {})[':_version_increment'] = 1
+
         # Request result to be returned so can know latest values without costing another read
         # NOTE AWS does not charge this as a read, so only overhead is slight network usage
         # TODO Could make this a fraction more effecient by only returning updated keys and merging
         update_kwargs['ReturnValues'] = 'ALL_NEW'
 
-        # Update the record and update the cache with the result
-        with self.condition_to_client_error():
-            resp = self.db_rooms.update_item(**update_kwargs)
-        self._cached_room['value'] = resp['Attributes']
+        # Update the record and update the caches with the result
+        try:
+            with self.condition_to_client_error():
+                resp = self.db_rooms.update_item(**update_kwargs)
+        except self.ClientError:
+            if not from_shared_cache:
+                raise
+            # Cached room was probably stale, so forget it and have client try again
+            room_cache.invalidate(room_id)
+            self.client_confused("Room was changed by someone else, please try again")
+        self._rooms_from_shared_cache.discard(room_id)
+        self.cache.set('rooms', room_id, resp['Attributes'])
+        room_cache.put(room_id, resp['Attributes'])
+
+
+    @property
+    def media(self):
+        """Media items of the sender's room, in order"""
+
+        # Return cached data if available
+        room_id = self.client['room_id']
+        items = self.cache.get('media', room_id)
+        if items is not MISSING:
+            return items
+
+        # Fetch fresh data, cache, and return
+        items = self.query_room_media(room_id)
+        self.cache.set('media', room_id, items)
+        return items
+
+
+    def query_room_media(self, room_id):
+        """Return all media items of a room in order
+
+        NOTE Strongly consistent (like rooms) since needs to match the room's version
+
+        """
+        items = []
+        query = {
+            'KeyConditionExpression': 'room_id=:room_id',
+            'ExpressionAttributeValues': {':room_id': room_id},
+            'ConsistentRead': True,
+        }
+        while True:
+            resp = self.db_media.query(**query)
+            items.extend(resp.get('Items', ()))
+            if 'LastEvaluatedKey' not in resp:
+                break
+            query['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+        items.sort(key=lambda item: item['pos'])
+        return items
+
+
+    def legacy_room_media(self, room):
+        """Return media items and loaded item id of a room from before media was stored separately"""
+        items = [{**item, 'pos': pos} for pos, item in enumerate(room['media'])]
+        loaded = room.get('loaded')
+        return (items, None if loaded is None else items[int(loaded)]['id'])
+
+
+    def update_room_media(self, put=(), delete=(), room_changes=None):
+        """Put/delete media items of the sender's room and update the room in a single transaction
+
+        Each item is a separate db item with a position (`pos`) to order by, so any change to a
+        playlist only writes the items changed. The room's version must be the same as when the
+        playlist was read (and is incremented) so changes are never based on an outdated playlist,
+        and the loaded item is referred to by id so it can't drift when items are added/removed.
+
+        If applying a batch of messages, changes are only made to the cached room and media, and
+        written along with the rest of the batch's (see `commit_room_draft`)
+
+        """
+        room_id = self.client['room_id']
+        room_changes = room_changes or {}
+
+        if self.room_draft is not None:
+            self.room_draft.apply(put, delete, room_changes)
+            self.cache.set('rooms', room_id, {**self.room, **room_changes})
+            self._update_media_cache(room_id, put, delete)
+            return
+
+        # Write and have client try again if the room changed since read
+        try:
+            self._write_room_media(put, delete, room_changes)
+        except self.db.meta.client.exceptions.TransactionCanceledException:
+            room_cache.invalidate(room_id)
+            self.client_confused("Playlist was changed by someone else, please try again")
+
+
+    def _write_room_media(self, put, delete, room_changes):
+        """Write changes for `update_room_media` and update the caches with them"""
+        room_id = self.client['room_id']
+        room = self.room
+
+        # Room must be the same version as read
+        fields = list(room_changes)
+        update = 'ADD version :_one'
+        if fields:
+            update = 'SET ' + ', '.join(f'#_{n}=:_{n}' for n in range(len(fields))) + ' ' + update
+        values = {f':_{n}': room_changes[field] for n, field in enumerate(fields)}
+        values[':_one'] = 1
+        if 'version' in room:
+            condition = 'version=:_version'
+            values[':_version'] = room['version']
+        else:
+            condition = 'attribute_exists(id) AND attribute_not_exists(version)'
+        room_update = {
+            'TableName': self.db_rooms.name,
+            'Key': {'id': room_id},
+            'UpdateExpression': update,
+            'ConditionExpression': condition,
+            'ExpressionAttributeValues': values,
+        }
+        if fields:
+            room_update['ExpressionAttributeNames'] = {f'#_{n}': f for n, f in enumerate(fields)}
+
+        # Media items expire with the room
+        items = [{'Update': room_update}]
+        for item in put:
+            item = {**item, 'room_id': room_id, 'expire': room['expire']}
+            items.append({'Put': {'TableName': self.db_media.name, 'Item': item}})
+        for item in delete:
+            items.append({'Delete': {
+                'TableName': self.db_media.name,
+                'Key': {'room_id': room_id, 'id': item['id']},
+            }})
+        self.db.meta.client.transact_write_items(TransactItems=items)
+
+        # Update the caches with what was written
+        room = {**room, **room_changes, 'version': room.get('version', 0) + 1}
+        self._rooms_from_shared_cache.discard(room_id)
+        self.cache.set('rooms', room_id, room)
+        room_cache.put(room_id, room)
+        self._update_media_cache(room_id, put, delete)
+
+
+    def _update_media_cache(self, room_id, put, delete):
+        changed_ids = {item['id'] for item in (*put, *delete)}
+        media = [item for item in self.media if item['id'] not in changed_ids]
+        media.extend(put)
+        media.sort(key=lambda item: item['pos'])
+        self.cache.set('media', room_id, media)
+
+
+    def update_room_fields(self, changes):
+        """Set fields of the sender's room (or of its draft if applying a batch of messages)"""
+        if self.room_draft is not None:
+            self.update_room_media(room_changes=changes)
+            return
+        fields = list(changes)
+        self.room = {
+            'UpdateExpression': 'SET ' + ', '.join(f'#_{n}=:_{n}' for n in range(len(fields))),
+            'ExpressionAttributeNames': {f'#_{n}': field for n, field in enumerate(fields)},
+            'ExpressionAttributeValues': {
+                f':_{n}': changes[field] for n, field in enumerate(fields)},
+        }
+
+
+    def commit_room_draft(self):
+        """Write all changes made to the room's draft at once and broadcast them in one patch
+
+        Returns False if the room was changed by something else since read (nothing is written)
+
+        """
+        draft, self.room_draft = self.room_draft, None
+        if not draft:
+            return True
+        room_id = self.client['room_id']
+
+        # NOTE Cached room still has the version read (as drafts don't increment it)
+        try:
+            self._write_room_media(list(draft.put.values()), list(draft.delete.values()),
+                draft.room_changes)
+        except self.db.meta.client.exceptions.TransactionCanceledException:
+            room_cache.invalidate(room_id)
+            return False
+        self.broadcast_room_patch(draft.fields, media_put=list(draft.put.values()),
+            media_delete=list(draft.delete.values()))
+        return True
+
+
+    def migrate_room_media(self, room):
+        """Move a room's media list into media items (for rooms from before stored separately)
+
+        Returns the room record after migrating
+        NOTE Safe if done concurrently as items are identical and only one room update succeeds
+
+        """
+        items, loaded_id = self.legacy_room_media(room)
+        with self.db_media.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item={**item, 'room_id': room['id'], 'expire': room['expire']})
+        try:
+            resp = self.db_rooms.update_item(
+                Key={'id': room['id']},
+                UpdateExpression=('SET loaded_id=:loaded_id, media_end=:media_end'
+                    ' REMOVE media, loaded ADD version :one'),
+                ConditionExpression=Attr('media').exists(),
+                ExpressionAttributeValues={
+                    ':loaded_id': loaded_id,
+                    ':media_end': len(items) - 1,
+                    ':one': 1,
+                },
+                ReturnValues='ALL_NEW',
+            )
+        except self.db.meta.client.exceptions.ConditionalCheckFailedException:
+            # Another invocation migrated it first
+            return self.db_rooms.get_item(Key={'id': room['id']}, ConsistentRead=True).get('Item')
+        return resp['Attributes']
+
+
+    def update_client_room(self, changes):
+        """Change the room fields of the sender's record (or delete it) and their rooms' rosters
+
+        The client record and the roster summaries' counters are written in a single transaction
+        that is conditional on the client still being in the same stay of a room as when read. So if
+        the same client joins/leaves concurrently (e.g. leaving while disconnecting), only one can
+        adjust the counts for that stay, and the other retries with the client's latest record.
+
+        changes: new values for the record's room fields, or None to delete the record
+
+        """
+        for attempt in range(ROSTER_TRANSACT_ATTEMPTS):
+
+            # Get what the client record is thought to be (strongly consistent if retrying)
+            if attempt == 0:
+                old = self.client
+            else:
+                old = self.db_clients.get_item(Key={'socket': self.sender},
+                    ConsistentRead=True).get('Item')
+                if not old:
+                    if changes is None:
+                        return  # Already deleted
+                    # Client has disconnected (see `condition_to_client_error`)
+                    raise self.ClientError("Database condition failed (notify support)")
+
+            # Attempt transaction and retry if client changed (or conflicted with another)
+            try:
+                self.db.meta.client.transact_write_items(
+                    TransactItems=self._client_room_transaction(old, changes))
+            except self.db.meta.client.exceptions.TransactionCanceledException:
+                self.cache.discard('clients', self.sender)
+                continue
+
+            # Update the cache (transactions can't return the new values, but only room fields set)
+            if changes is None:
+                self.cache.discard('clients', self.sender)
+            else:
+                self.cache.set('clients', self.sender, {**old, **changes})
+            return
+
+        raise self.ClientError("Database transaction failed (notify support)")
+
+
+    def _client_room_transaction(self, old, changes):
+        """Return the items of a transaction for `update_client_room`"""
+
+        # Only write client if still in the same stay of the same room as when read
+        # NOTE This also ensures the record exists so a new partial item is never created
+        key = {'socket': self.sender}
+        condition = 'room_id=:_old_room AND room_joined=:_old_joined'
+        condition_values = {':_old_room': old['room_id'], ':_old_joined': old['room_joined']}
+        if changes is None:
+            items = [{'Delete': {
+                'TableName': self.db_clients.name,
+                'Key': key,
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': condition_values,
+            }}]
+        else:
+            fields = list(changes)
+            items = [{'Update': {
+                'TableName': self.db_clients.name,
+                'Key': key,
+                'ConditionExpression': condition,
+                'UpdateExpression': 'SET ' + ', '.join(f'#_{n}=:_{n}' for n in range(len(fields))),
+                'ExpressionAttributeNames': {f'#_{n}': field for n, field in enumerate(fields)},
+                'ExpressionAttributeValues': {
+                    **{f':_{n}': changes[field] for n, field in enumerate(fields)},
+                    **condition_values,
+                },
+            }}]
+
+        # Determine changes to the summaries of the rooms left and joined (may be the same room)
+        # NOTE '#' represents not being in a room (see `handle_aws_connect`)
+        rosters = {}
+        new = None if changes is None else {**old, **changes}
+        if old['room_id'] != '#':
+            roster = rosters.setdefault(old['room_id'], {'total': 0, 'admins': 0, 'entry': None})
+            roster['total'] -= 1
+            roster['admins'] -= 1 if old['room_admin'] else 0
+        if new and new['room_id'] != '#':
+            roster = rosters.setdefault(new['room_id'], {'total': 0, 'admins': 0, 'entry': None})
+            roster['total'] += 1
+            roster['admins'] += 1 if new['room_admin'] else 0
+            if self.roster_has_space(new['room_id'], new['room_admin']):
+                roster['entry'] = {field: new[field] for field in ROSTER_ENTRY_FIELDS}
+
+        # Adjust counters and add/remove the client's entry
+        # NOTE If the summary doesn't exist (e.g. room deleted) a partial one will be created, but
+        #      it won't be trusted as it lacks `exact` (see `roster_summary_clients`)
+        now = time()
+        for room_id, roster in rosters.items():
+            update = ('ADD #total :total, admins :admins, revision :one'
+                ' SET changed=:now, expire=:expire')
+            names = {'#total': 'total'}
+            values = {
+                ':total': roster['total'],
+                ':admins': roster['admins'],
+                ':one': 1,
+                ':now': now,
+                ':expire': now + ROSTER_EXPIRE,
+            }
+            names['#entry'] = ROSTER_ENTRY_PREFIX + self.sender
+            if roster['entry']:
+                update += ', #entry=:entry'
+                values[':entry'] = roster['entry']
+            else:
+                update += ' REMOVE #entry'
+            items.append({'Update': {
+                'TableName': self.db_rosters.name,
+                'Key': {'room_id': room_id},
+                'UpdateExpression': update,
+                'ExpressionAttributeNames': names,
+                'ExpressionAttributeValues': values,
+            }})
+        return items
+
+
+    def roster_has_space(self, room_id, admin):
+        """Whether a room's roster summary has space to display another admin/guest
+
+        NOTE Not strongly consistent so may exceed the limit slightly, but lists are limited anyway
+
+        """
+        resp = self.db_rosters.get_item(Key={'room_id': room_id},
+            ProjectionExpression='#total, admins', ExpressionAttributeNames={'#total': 'total'})
+        summary = resp.get('Item', {})
+        admins = summary.get('admins', 0)
+        count = admins if admin else summary.get('total', 0) - admins
+        return count < ROSTER_DISPLAY_LIMIT
 
 
     # STATE
@@ -361,67 +760,150 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
         WARN Careful not to return the secret!
 
         """
-        keys_to_add = ['id', 'name', 'media', 'loaded', 'start', 'paused', 'admins_only_dj',
-            'admins_only_see_clients', 'admins_only_chat']
-        state = {}
-        for key in keys_to_add:
-            state[key] = self.room[key]
+        state = self.room_state_fields(ROOM_STATE_FIELDS)
+        state['media'] = [self.media_display(item) for item in self.media]
         return state
 
 
+    def room_state_fields(self, fields):
+        """Return the given fields of the current state of sender's room (and its version)
+
+        NOTE `loaded` is an index of the media list since that's what clients expect
+
+        """
+        state = {'version': int(self.room.get('version', 0))}
+        for key in fields:
+            if key == 'loaded':
+                media_ids = [item['id'] for item in self.media]
+                loaded_id = self.room.get('loaded_id')
+                state[key] = media_ids.index(loaded_id) if loaded_id in media_ids else None
+            else:
+                state[key] = self.room[key]
+        return state
+
+
+    def media_display(self, item):
+        """Return only the data of a media item that clients need (incl. position for ordering)"""
+        return {
+            'id': item['id'],
+            'pos': item['pos'],
+            'name': item['name'],
+            'type': item['type'],
+            'content': item['content'],
+        }
+
+
+    def client_display(self, client):
+        """Return only the relevant and non-sensitive data of a client record (for clients lists)"""
+        return {
+            'socket': client['socket'],
+            'name': client['name'],
+            'admin': client['room_admin'],
+            'synced': client['room_synced'],
+        }
+
+
+    def query_room_clients(self, room_id, projection=None, *, admins=None):
+        """Yield every client in the given room, fetching a page at a time
+
+        Dynamo returns at most 1 MB per query, so large rooms need multiple requests, and pages are
+        only requested as consumed so callers can start using clients before all are fetched (and
+        memory is bounded by page size rather than room size).
+
+        projection: attributes to get (e.g. 'socket') otherwise gets all that index projects
+            WARN Index only projects attributes needed for clients lists (see template.yaml)
+        admins: if True/False, only yields admins/guests (otherwise all clients)
+        NOTE Mainly just for display and broadcasting, so not strongly consistant
+
+        """
+        query = {
+            'IndexName': 'by_room_lean',
+            'KeyConditionExpression': 'room_id=:room_id',
+            'ExpressionAttributeValues': {':room_id': room_id},
+        }
+        if projection:
+            query['ProjectionExpression'] = projection
+            if '#_name' in projection:
+                query['ExpressionAttributeNames'] = {'#_name': 'name'}  # name is a reserved word
+        if admins is not None:
+            query['FilterExpression'] = 'room_admin=:admin'
+            query['ExpressionAttributeValues'][':admin'] = admins
+
+        while True:
+            resp = self.db_clients.query(**query)
+            yield from resp.get('Items', ())  # NOTE May be missing recent joins due to dynamo delay
+            if 'LastEvaluatedKey' not in resp:
+                return
+            query['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
     def room_clients(self, *, exclude_self=False):
-        """Return all clients who are in the sender's room"""
-
-        # Get room's clients
-        # NOTE Mainly just for display so not strongly consistant
-        resp = self.db_clients.query(
-            IndexName='by_room',
-            KeyConditionExpression='room_id=:room_id',
-            ExpressionAttributeValues={':room_id': self.room['id']},
-        )
-        clients = resp.get('Items', [])  # NOTE This may be empty due to dynamo delay
+        """Return lists of clients who are in the sender's room (for admins and for guests)
 
-        # Exclude self if desired (used when about to leave the room)
-        if exclude_self:
-            clients = [c for c in clients if c['socket'] != self.sender]
+        Clients are taken from the room's roster summary (a single small read) when it has enough
+        entries to display, otherwise all the room's clients are queried (and the summary repaired).
+
+        """
+        room_id = self.room['id']
 
         # Prepare results
-        display_limit = 100
         results = {
             'admins': [],
             'guests': [],
             'hidden': False,
-            'limited': len(clients) > display_limit,
-            'total': len(clients),  # NOTE Non-limited total
+            'limited': False,
+            'total': 0,  # NOTE Non-limited total
         }
 
-        # Need unlimited list of sockets so can broadcast results to all clients
-        sockets = {
-            'admins': [],
-            'guests': [],
-        }
+        # Get displayable clients from the room's roster summary if possible
+        # NOTE Strongly consistent so includes any change the sender just made
+        summary = self.db_rosters.get_item(Key={'room_id': room_id},
+            ConsistentRead=True).get('Item')
+        clients = self.roster_summary_clients(summary)
+        from_summary = clients is not None
+        if not from_summary:
+            projection = 'socket, #_name, room_admin, room_synced, room_joined'
+            clients = self.query_room_clients(room_id, projection)
 
         # Add clients to results
-        # NOTE Dynamo already sorts clients by join time by default
+        # NOTE Dynamo already sorts clients by join time by default (and summary entries sorted)
+        # NOTE Only keeping as many as can display so that memory isn't relative to room size
+        includes_self = False
+        kept = {'admins': [], 'guests': []}
         for client in clients:
 
-            # Return only relevant and non-sensitive data
-            data = {
-                'socket': client['socket'],
-                'name': client['name'],
-                'admin': client['room_admin'],
-                'synced': client['room_synced'],
-            }
+            # Exclude self if desired (used when about to leave the room)
+            if client['socket'] == self.sender:
+                if exclude_self:
+                    continue
+                includes_self = True
 
             # Keep admins and guests separate (for easier display AND limiting)
-            list_key = 'admins' if data['admin'] else 'guests'
-            results[list_key].append(data)
-            sockets[list_key].append(client['socket'])
+            results['total'] += 1
+            list_key = 'admins' if client['room_admin'] else 'guests'
+            if len(kept[list_key]) < ROSTER_DISPLAY_LIMIT:
+                kept[list_key].append(client)
+
+        if from_summary:
+            # Summary counts clients that aren't displayed too
+            results['total'] = int(summary['total'])
+            if exclude_self and self.client['room_id'] == room_id:
+                results['total'] -= 1
+        elif not exclude_self and not includes_self and self.client['room_id'] == room_id:
+            # Ensure self is included if in the room (query may not include if only just joined)
+            results['total'] += 1
+            list_key = 'admins' if self.client['room_admin'] else 'guests'
+            kept[list_key].append(self.client)
+
+        # Fix summary's entries if it couldn't be used
+        if not from_summary and not exclude_self:
+            self.repair_roster_summary(summary, kept['admins'] + kept['guests'], results['total'])
 
         # Limit results, including admins before guests
-        results['admins'] = results['admins'][:display_limit]
-        guests_limit = max(0, display_limit - len(results['admins']))
-        results['guests'] = results['guests'][:guests_limit]
+        results['limited'] = results['total'] > ROSTER_DISPLAY_LIMIT
+        results['admins'] = [self.client_display(c) for c in kept['admins'][:ROSTER_DISPLAY_LIMIT]]
+        guests_limit = max(0, ROSTER_DISPLAY_LIMIT - len(results['admins']))
+        results['guests'] = [self.client_display(c) for c in kept['guests'][:guests_limit]]
 
         # Prepare version of results for guests
         guest_results = results
@@ -434,32 +916,209 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
                 'total': results['total'],
             }
 
-        return (results, guest_results, sockets)
+        return (results, guest_results)
+
+
+    # ROSTER SUMMARIES
+
+
+    # Each room has a summary of who's in it, stored in the rosters table, with:
+    #     total/admins: Counts of clients in the room (atomically adjusted by `update_client_room`)
+    #     client:<socket>: Entries for the first admins and guests to join, up to the display limit
+    #     exact: Whether counts are exact (only true if created with the room)
+    #     revision: Incremented whenever who's in the room changes
+    # NOTE Entries can't be limited within the transaction (a failed condition would cancel it)
+    #      so a client leaving may leave too few to display, which is fixed by the next full query
+
+
+    def roster_summary_clients(self, summary):
+        """Return the entries of a roster summary in join order (or None if can't be relied on)"""
+
+        # Summaries of rooms from before summaries existed (or deleted rooms) lack exact counts
+        if not summary or not summary.get('exact') or summary['total'] < 0 or summary['admins'] < 0:
+            return None
+
+        # Ensure there are as many entries as can be displayed
+        clients = sorted((value for key, value in summary.items()
+            if key.startswith(ROSTER_ENTRY_PREFIX)), key=lambda client: client['room_joined'])
+        admins = sum(1 for client in clients if client['room_admin'])
+        guests = len(clients) - admins
+        if admins < min(summary['admins'], ROSTER_DISPLAY_LIMIT) or \
+                guests < min(summary['total'] - summary['admins'], ROSTER_DISPLAY_LIMIT):
+            return None
+        return clients
+
+
+    def repair_roster_summary(self, summary, clients, total):
+        """Replace a summary's entries with the given clients if its counts agree with them
+
+        Only done if unchanged for a while (as clients index may not reflect the latest changes),
+        and conditional on no changes having been made since the summary was read
+
+        """
+        if not summary or not summary.get('exact') or summary['total'] != total \
+                or time() - summary['changed'] < ROSTER_REPAIR_DELAY:
+            return
+
+        # Set entries for the given clients and remove any others
+        names = {}
+        values = {':revision': summary['revision']}
+        actions = []
+        for n, client in enumerate(clients):
+            names[f'#_set{n}'] = ROSTER_ENTRY_PREFIX + client['socket']
+            values[f':_set{n}'] = {field: client[field] for field in ROSTER_ENTRY_FIELDS}
+        if names:
+            actions.append('SET ' + ', '.join(f'{name}=:{name[1:]}' for name in names))
+        remove = [key for key in summary
+            if key.startswith(ROSTER_ENTRY_PREFIX) and key not in names.values()]
+        if remove:
+            names.update({f'#_remove{n}': key for n, key in enumerate(remove)})
+            actions.append('REMOVE ' + ', '.join(f'#_remove{n}' for n in range(len(remove))))
+        if not actions:
+            return
+
+        try:
+            self.db_rosters.update_item(
+                Key={'room_id': summary['room_id']},
+                UpdateExpression=' '.join(actions),
+                ConditionExpression='revision=:revision',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+            )
+        except self.db.meta.client.exceptions.ConditionalCheckFailedException:
+            pass  # Room's clients changed since read, so leave for next time
+
+
+    def update_roster_entry(self, fields):
+        """Update fields of the sender's entry in their room's roster summary (if displayed)"""
+        if self.client['room_id'] == '#':
+            return
+        names = {'#entry': ROSTER_ENTRY_PREFIX + self.sender}
+        names.update({f'#_{n}': field for n, field in enumerate(fields)})
+        try:
+            self.db_rosters.update_item(
+                Key={'room_id': self.client['room_id']},
+                UpdateExpression='SET ' + ', '.join(
+                    f'#entry.#_{n}=:_{n}' for n in range(len(fields))),
+                ConditionExpression='attribute_exists(#entry)',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues={
+                    f':_{n}': self.client[field] for n, field in enumerate(fields)},
+            )
+        except self.db.meta.client.exceptions.ConditionalCheckFailedException:
+            pass  # Not displayed (or has left since)
 
 
     # MESSAGES
 
 
     def send(self, connections, msg_type, info):
-        """Send info to a connection or multiple connections"""
+        """Queue info to be sent to a connection or multiple connections
+
+        Messages are only sent when the invocation ends (see `flush_outbox`), so that all those to
+        the same connection can be posted together, as each post is billed and a round trip
+
+        """
         if isinstance(connections, str):
-            connections = [connections]
+            connections = (connections,)
         data = json.dumps({'type': msg_type, 'info': info}).encode('utf-8')
-        exception = None
+        outbox = self.outbox
         for connection in connections:
-            # Be sure to not fail on one and ignore the others
-            try:
-                self.sockets.post_to_connection(Data=data, ConnectionId=connection)
-            except self.sockets.exceptions.GoneException:
+            if connection in outbox:
+                outbox[connection].append(data)
+            else:
+                outbox[connection] = [data]
+
+
+    def flush_outbox(self):
+        """Send all queued messages, merging those to the same connection into one frame
+
+        Called when the invocation ends (see entrypoint.py) or before waiting for anything
+        Connections are posted to concurrently (up to SEND_CONCURRENCY at once)
+        Returns stats for the posts (counts and per-post latencies) to help tune concurrency
+
+        """
+        outbox, self.outbox = self.outbox, {}
+        if not outbox:
+            return None
+
+        def post(connection):
+            # NOTE A connection's frames are posted in order (only more than one if very large)
+            for frame in pack_frames(outbox[connection]):
+                self.sockets.post_to_connection(Data=frame, ConnectionId=connection)
+
+        stats = {
+            'sent': 0,
+            'gone': 0,
+            'failed': 0,
+            'latencies': [],  # Seconds taken by each connection's posts (in order of completion)
+        }
+        exception = None
+        gone = []
+        limit = SEND_CONCURRENCY if len(outbox) > 1 else 1
+        # NOTE fan_out doesn't stop on failures so one won't prevent sending to the others
+        for connection, result, exc, seconds in fan_out(post, outbox, limit):
+            stats['latencies'].append(seconds)
+            if exc is None:
+                stats['sent'] += 1
+            elif isinstance(exc, self.sockets.exceptions.GoneException):
                 # The socket has disconnected already (Dynamo probably just returned stale data)
-                # If client record wasn't deleted (as AWS doesn't guarantee it), will expire anyway
-                pass
-            except Exception as exc:
+                # NOTE If its record wasn't deleted (AWS doesn't guarantee it) it's reaped below
+                stats['gone'] += 1
+                gone.append(connection)
+            else:
                 # Something bad happened so record (but don't prevent sending to other clients)
-                # NOTE Assuming if an exception than only reporting one is sufficient
-                exception = exc
+                # NOTE Assuming if an exception than only reporting the first is sufficient
+                stats['failed'] += 1
+                if exception is None:
+                    exception = exc
+        # Room size for tracing is the most sockets sent to at once (see tracing.py)
+        if limit > 1:
+            tag_max('room_size', len(outbox))
+        if gone:
+            self.reap_gone_sockets(gone)
+            self.flush_outbox()  # Send any corrections to rosters
         if exception:
-            self.client_error(exception)
+            # Tell sender like `client_error` does, but immediately (as the outbox is being flushed)
+            info = self._generate_error_info(str(exception))
+            data = json.dumps({'type': 'client_error', 'info': info}).encode('utf-8')
+            try:
+                self.sockets.post_to_connection(Data=data, ConnectionId=self.sender)
+            except Exception:
+                pass  # Already reporting a failure to post
+            raise self.ClientError(info)
+        return stats
+
+
+    def reap_gone_sockets(self, sockets):
+        """Remove clients whose sockets were found to be gone, and tell their rooms they've left
+
+        NOTE Each room is told of all its clients that were reaped in a single diff
+
+        """
+        from reaper import get_clients, reap_clients  # NOTE Only imported when needed
+        clients = get_clients(self.db, self.db_clients, sockets)
+        reaped = reap_clients(self.db, self.db_clients, self.db_rosters, clients)
+
+        rooms = {}
+        for client in reaped:
+            self.cache.discard('clients', client['socket'])
+            rooms.setdefault(client['room_id'], []).append({
+                'change': 'left',
+                'socket': client['socket'],
+                'fields': {},
+            })
+        rooms.pop('#', None)  # Weren't in a room
+        for room_id, diffs in rooms.items():
+            room = self.cache.get('rooms', room_id)
+            if room is MISSING:
+                room = self.db_rooms.get_item(Key={'id': room_id}).get('Item')
+            if room:  # NOTE None if room deleted
+                self.send_room_clients_diffs(diffs, room=room)
+
+        # Don't post corrections to the reaped (in case the clients index hasn't caught up yet)
+        for client in reaped:
+            self.outbox.pop(client['socket'], None)
 
 
     def reply(self, msg_type, info):
@@ -467,49 +1126,281 @@ class WebsocketHandlers(HandlersAWS, HandlersRoom, HandlersMedia, HandlersClient
         self.send(self.sender, msg_type, info)
 
 
-    def get_client_sockets(self, *, force_room_id=None):
-        """Return tuple of client sockets for those in the sender's room"""
+    def get_client_sockets(self, *, force_room_id=None, exclude_self=False, admins=None):
+        """Yield sockets of clients in the sender's room (optionally only admins/guests)
+
+        NOTE Sockets are fetched a page at a time as consumed (see `query_room_clients`)
+
+        """
 
         # This method is required by `handle_room_delete` which may need to pass in room_id manually
-        # WARN No other method should use force_room_id (could cause security issues)
+        # WARN Only pass room ids the server determined itself (could cause security issues)
         room_id = force_room_id if force_room_id else self.client['room_id']
 
-        resp = self.db_clients.query(
-            IndexName='by_room',
-            KeyConditionExpression='room_id=:room_id',
-            ExpressionAttributeValues={':room_id': room_id},
-            ProjectionExpression='socket',  # Only need the socket in this case
-        )
-        return (client['socket'] for client in resp.get('Items', tuple()))
+        # Only need the socket in this case
+        for client in self.query_room_clients(room_id, 'socket', admins=admins):
+            if not (exclude_self and client['socket'] == self.sender):
+                yield client['socket']
+
+
+    def broadcast_room_patch(self, fields=(), *, media_put=(), media_delete=()):
+        """Send only the fields of the room's state that changed to all clients of the room
 
+        Patches have the room's version after the change, so clients can apply them only if they
+        have the previous version, ignoring older ones (e.g. out of order due to lag) and
+        requesting the full state if they've missed one (see `handle_room_state_resync`).
 
-    def broadcast_room_state(self):
-        """Send latest room state to all clients of the room"""
-        self.send(self.get_client_sockets(), 'room_state', self.room_state())
+        NOTE Changing media also changes `loaded` (index) so is always included then
+        NOTE If applying a batch of messages, fields are only noted to broadcast with the others
+
+        """
+        if self.room_draft is not None:
+            self.room_draft.fields.update(fields)
+            return
+
+        patch = {'room_id': self.room['id']}
+        if media_put or media_delete:
+            fields = {*fields, 'loaded'}
+            patch['media'] = {
+                'put': [self.media_display(item) for item in media_put],
+                'delete': [item['id'] for item in media_delete],
+            }
+        patch['changes'] = self.room_state_fields(fields)
+        self.send(self.get_client_sockets(), 'room_patch', patch)
 
 
     def broadcast_room_clients(self, *, exclude_self=False):
         """Broadcast who's in a room to all the participants
 
-        This may get executed frequently (especially when starting play and all clients sync)
-        However, trying to debounce would involve many more db queries and so sending many messages
-        is favoured instead.
+        WARN This sends the whole clients list, so only use when clients may not already have it
+             or when what they can see has changed (use `broadcast_room_clients_diff` otherwise)
 
         """
 
-        # Sender may not actually be in a room, so do nothing if so
-        if not self.room:
+        # Sender may not actually be in a room (or it's being deleted), so do nothing if so
+        if not self.in_room():
             return
 
         # Broadcast clients data
-        admin_clients, guest_clients, sockets = self.room_clients(exclude_self=exclude_self)
-        for socket in sockets['admins']:
-            self.send(socket, 'room_clients', {
+        # NOTE Guests see the same as admins unless clients are hidden from them
+        admin_clients, guest_clients = self.room_clients(exclude_self=exclude_self)
+        if guest_clients is admin_clients:
+            self.send(self.get_client_sockets(exclude_self=exclude_self), 'room_clients', {
                 'room_id': self.room['id'],
                 'clients': admin_clients,
             })
-        for socket in sockets['guests']:
-            self.send(socket, 'room_clients', {
-                'room_id': self.room['id'],
-                'clients': guest_clients,
-            })
+            return
+        self.send(self.get_client_sockets(exclude_self=exclude_self, admins=True), 'room_clients', {
+            'room_id': self.room['id'],
+            'clients': admin_clients,
+        })
+        self.send(self.get_client_sockets(exclude_self=exclude_self, admins=False), 'room_clients', {
+            'room_id': self.room['id'],
+            'clients': guest_clients,
+        })
+
+
+    def room_clients_diff(self, change, fields=()):
+        """Return a change to the sender's entry in the room's clients list
+
+        change: 'joined' (all fields included), 'changed' (only given fields included), or 'left'
+
+        """
+        diff = {
+            'change': change,
+            'socket': self.sender,
+            'fields': {},
+        }
+        if change != 'left':
+            display = self.client_display(self.client)
+            del display['socket']
+            if change == 'changed':
+                display = {key: display[key] for key in fields}
+            diff['fields'] = display
+        return diff
+
+
+    def broadcast_room_clients_diff(self, change, fields=()):
+        """Broadcast a change to the sender's entry in the room's clients list
+
+        Only the sender's entry is sent (rather than the whole list) and clients apply it to the
+        list they already have, so the size of the message doesn't grow with the room.
+
+        If ROSTER_FLUSH_INTERVAL is set, changes are collected and broadcast together instead, as
+        many often happen at once (e.g. all clients syncing after play, or leaving at the end).
+
+        """
+
+        # Sender may not actually be in a room (or it's being deleted), so do nothing if so
+        if not self.in_room():
+            return
+
+        diff = self.room_clients_diff(change, fields)
+        if ROSTER_FLUSH_INTERVAL > 0:
+            self.queue_room_clients_diff(diff)
+        else:
+            # NOTE Sender already has a full list when joining, and doesn't need one when leaving
+            self.send_room_clients_diffs([diff], exclude_self=change != 'changed')
+
+
+    def send_room_clients_diffs(self, diffs, *, exclude_self=False, room=None):
+        """Send diffs of the room's clients list to all clients of the room
+
+        room: the room record if not the sender's (only for rooms read by the server itself)
+        NOTE Clients treat 'joined' for an entry they already have as an update, and ignore 'left'
+             for an entry they don't have (unless their list is limited or hidden)
+
+        """
+        room = room or self.room
+
+        # If guests can't see clients, then only tell them when the total changes
+        info = {
+            'room_id': room['id'],
+            'diffs': diffs,
+        }
+        if room['admins_only_see_clients']:
+            self.send(self.get_client_sockets(force_room_id=room['id'], exclude_self=exclude_self,
+                admins=True), 'room_clients_diff', info)
+            guest_diffs = [{**diff, 'socket': None, 'fields': {}} for diff in diffs
+                if diff['change'] != 'changed']
+            if guest_diffs:
+                self.send(self.get_client_sockets(force_room_id=room['id'],
+                    exclude_self=exclude_self, admins=False),
+                    'room_clients_diff', {**info, 'diffs': guest_diffs})
+        else:
+            self.send(self.get_client_sockets(force_room_id=room['id'], exclude_self=exclude_self),
+                'room_clients_diff', info)
+
+
+    def queue_room_clients_diff(self, diff):
+        """Queue a diff to be broadcast with any others made to the room within the flush interval
+
+        The first invocation to queue a diff for a room becomes its flusher, and has the room
+        queue's worker broadcast all the queued diffs once the interval has passed (see
+        `flush_room_clients_diffs`). Other invocations merely queue their diff, so there's only
+        ever one flush pending per room, and none waits for the interval itself.
+
+        """
+        room_id = self.room['id']
+        flusher = token_urlsafe(6)
+        now = time()
+
+        # Queue the diff and become the flusher if there isn't one already
+        # NOTE Shares the roster summary item, so only set expiry if none (see ROSTER SUMMARIES)
+        resp = self.db_rosters.update_item(
+            Key={'room_id': room_id},
+            UpdateExpression=(
+                'SET pending=list_append(if_not_exists(pending, :empty), :diffs),'
+                ' flusher=if_not_exists(flusher, :flusher),'
+                ' flush_due=if_not_exists(flush_due, :due),'
+                ' flushed=if_not_exists(flushed, :zero),'
+                ' expire=if_not_exists(expire, :expire)'),
+            ExpressionAttributeValues={
+                ':empty': [],
+                ':zero': 0,
+                ':diffs': [diff],
+                ':flusher': flusher,
+                ':due': now + ROSTER_FLUSH_INTERVAL,
+                ':expire': now + 60 * 60,  # Only needed while there are changes to flush
+            },
+            ReturnValues='UPDATED_NEW',
+        )
+        current = resp['Attributes']
+
+        # If the room's flush seems to have never been queued, take over as its flusher
+        if current['flusher'] != flusher and current['flush_due'] < now - ROSTER_FLUSH_STALE:
+            try:
+                self.db_rosters.update_item(
+                    Key={'room_id': room_id},
+                    UpdateExpression='SET flusher=:flusher, flush_due=:due',
+                    ConditionExpression=Attr('flusher').eq(current['flusher']),
+                    ExpressionAttributeValues={
+                        ':flusher': flusher,
+                        ':due': now + ROSTER_FLUSH_INTERVAL,
+                    },
+                )
+            except self.db.meta.client.exceptions.ConditionalCheckFailedException:
+                return  # Another invocation took over first
+            current['flusher'] = flusher
+
+        # Have the worker flush once the interval has passed (unless another invocation will)
+        if current['flusher'] == flusher:
+            queue_roster_flush(self, room_id, flusher, ROSTER_FLUSH_INTERVAL)
+
+
+    def flush_room_clients_diffs(self, room_id, flusher):
+        """Broadcast the diffs queued for a room (see `queue_room_clients_diff`)
+
+        Run by the room queue's worker once the flush interval has passed. Diffs are only removed
+        from the queue once sent, so if the worker fails they're sent when the flush is retried
+        (clients ignore diffs they've already applied). If more were queued meanwhile, they're
+        left to be flushed after another interval (without another flusher being needed).
+
+        """
+        roster = self.db_rosters.get_item(Key={'room_id': room_id}, ConsistentRead=True,
+            ProjectionExpression='pending, flusher, flushed').get('Item')
+        if not roster or roster.get('flusher') != flusher:
+            return  # Already flushed (queue delivered the flush more than once)
+        pending = roster['pending']
+        flushed = roster['flushed']
+
+        # Send the diffs (unless the room has gone, in which case they're just discarded)
+        room = self.db_rooms.get_item(Key={'id': room_id}, ConsistentRead=True).get('Item')
+        if room and not room.get('deleted'):
+            self.send_room_clients_diffs(merge_room_clients_diffs(pending), room=room)
+            self.flush_outbox()
+
+        # Stop being the flusher if no more diffs were queued meanwhile
+        try:
+            self.db_rosters.update_item(
+                Key={'room_id': room_id},
+                UpdateExpression='REMOVE pending, flusher, flush_due, flushed',
+                ConditionExpression='flusher=:flusher AND flushed=:flushed AND size(pending)=:sent',
+                ExpressionAttributeValues={
+                    ':flusher': flusher,
+                    ':flushed': flushed,
+                    ':sent': len(pending),
+                },
+            )
+            return
+        except self.db.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+        # Otherwise remove those sent (always the first, as diffs are only ever appended)
+        # NOTE Conditional on the count removed so far, so if the queue delivered the flush twice
+        #      at once only one removes them (and if the worker fails meanwhile the rest are resent)
+        try:
+            for start in range(0, len(pending), ROSTER_FLUSH_CHUNK):
+                count = min(ROSTER_FLUSH_CHUNK, len(pending) - start)
+                self.db_rosters.update_item(
+                    Key={'room_id': room_id},
+                    UpdateExpression='REMOVE ' + ', '.join(f'pending[{n}]' for n in range(count))
+                        + ' ADD flushed :count',
+                    ConditionExpression='flusher=:flusher AND flushed=:flushed',
+                    ExpressionAttributeValues={
+                        ':flusher': flusher,
+                        ':flushed': flushed,
+                        ':count': count,
+                    },
+                )
+                flushed += count
+
+            # Flush those queued meanwhile after another interval
+            self.db_rosters.update_item(
+                Key={'room_id': room_id},
+                UpdateExpression='SET flush_due=:due',
+                ConditionExpression='flusher=:flusher AND flushed=:flushed',
+                ExpressionAttributeValues={
+                    ':flusher': flusher,
+                    ':flushed': flushed,
+                    ':due': time() + ROSTER_FLUSH_INTERVAL,
+                },
+            )
+        except self.db.meta.client.exceptions.ConditionalCheckFailedException:
+            return  # Another delivery of the flush already did (or the room was deleted)
+        queue_roster_flush(self, room_id, flusher, ROSTER_FLUSH_INTERVAL)
+
+
+# Handler and schema of every message type
+# NOTE Compiled once per container so messages aren't dispatched or validated via reflection
+DISPATCH = compile_dispatch(WebsocketHandlers)
@@ -2,6 +2,11 @@
 from datetime import datetime, timedelta
 
 
+# How long client records are kept after connecting (in case `$disconnect` isn't received)
+# NOTE Longer than sockets can last (see `SOCKET_MAX_DURATION` in reaper.py)
+CLIENT_RECORD_LIFETIME = timedelta(days=1)
+
+
 class HandlersAWS:
     """Handlers for AWS socket connect/disconnect events
 
@@ -16,7 +21,7 @@ class HandlersAWS:
         # NOTE AWS has a max socket connection duration of 2 hours
         #      See https://docs.aws.amazon.com/apigateway/latest/developerguide/limits.html
         now = datetime.now()
-        expire = now + timedelta(days=1)
+        expire = now + CLIENT_RECORD_LIFETIME
 
         self.db_clients.put_item(Item={
             'socket': self.sender,
@@ -37,8 +42,14 @@ class HandlersAWS:
 
         """
 
+        # Nothing to do if the client was already removed (e.g. reaped, see reaper.py)
+        record = self.db_clients.get_item(Key={'socket': self.sender}).get('Item')
+        if not record:
+            return
+        self.cache.set('clients', self.sender, record)
+
         # If in a room, let other clients know they're leaving
-        self.broadcast_room_clients(exclude_self=True)
+        self.broadcast_room_clients_diff('left')
 
-        # Remove the client's record
-        self.db_clients.delete_item(Key={'socket': self.sender})
+        # Remove the client's record (and from the room's roster summary)
+        self.update_client_room(None)
@@ -2,9 +2,11 @@
 import os
 from datetime import datetime
 
-import boto3
 from boto3.dynamodb.conditions import Attr
 
+from cache import room_cache
+from resources import get_sns
+
 
 class HandlersClient:
     """Handlers for modifying a client record"""
@@ -16,24 +18,33 @@ class HandlersClient:
         Also sets client's name since can't set within handle_aws_connect, and repeat sets harmless
 
         """
-        self.client = {
-            'UpdateExpression': (
-                'SET #_name=:name, room_id=:id, room_joined=:joined, room_admin=:admin, room_synced=:synced'),
-            'ExpressionAttributeNames': {
-                '#_name': 'name',  # name is a reserved word
-            },
-            'ExpressionAttributeValues': {
-                ':name': client_name,
-                ':id': room_id,
-                ':joined': datetime.now().timestamp(),
-                ':admin': is_admin,
-                ':synced': None,
-            },
-        }
+        # NOTE Also updates the room's roster summary (see `update_client_room`)
+        self.update_client_room({
+            'name': client_name,
+            'room_id': room_id,
+            'room_joined': datetime.now().timestamp(),
+            'room_admin': is_admin,
+            'room_synced': None,
+        })
+
+
+    def client_leave_room(self):
+        """Helper for making the sender leave their room (and updating the room's roster summary)"""
+        self.update_client_room({
+            # NOTE See `handle_aws_connect` for notes on default values
+            'room_id': '#',
+            'room_joined': 0,
+            'room_admin': None,
+            'room_synced': None,
+        })
 
 
     def kwargs_client_leave(self, socket):
-        """Helper for generating kwargs for making a client leave a room"""
+        """Helper for generating kwargs for making a client leave a room
+
+        WARN Doesn't update the room's roster summary (only for when deleting room and summary)
+
+        """
         return {
             'Key': {'socket': socket},
             'ConditionExpression': Attr('socket').exists(),  # WARN Important (see handlers.py)
@@ -56,17 +67,17 @@ class HandlersClient:
         # First ensure the room exists
         resp = self.db_rooms.get_item(Key={'id': room_id})
         room = resp.get('Item')
-        if not room:
+        if not room or room.get('deleted'):
             # Tell client the id is invalid so it can give up attempt and return to root route
             self.reply('room_invalid', {'room_id': room_id})
             return
+        if 'media' in room:
+            room = self.migrate_room_media(room)  # See `room` getter
 
         # Add the room to cache so `room_state` can reuse it
         # NOTE Usually cached room will be the one the client is in, but soon will be!
-        self._cached_room = {
-            'id': room_id,
-            'value': room,
-        }
+        self.cache.set('rooms', room_id, room)
+        room_cache.put(room_id, room)
 
         # Tell client if secret no longer valid (can still join room though)
         is_admin = secret == room['secret']
@@ -77,7 +88,7 @@ class HandlersClient:
         self.client_join_room(room_id, is_admin, client_name)
 
         # Send back room's state
-        admin_clients, guest_clients, sockets = self.room_clients()
+        admin_clients, guest_clients = self.room_clients()
         self.reply('room_joined', {
             'room': self.room_state(),
             'clients': admin_clients if is_admin else guest_clients,
@@ -86,7 +97,7 @@ class HandlersClient:
         })
 
         # Let other clients know this client has joined their room
-        self.broadcast_room_clients()
+        self.broadcast_room_clients_diff('joined')
 
 
     def handle_client_leave(self):
@@ -98,11 +109,11 @@ class HandlersClient:
 
         # Let other clients know this client is leaving their room
         # WARN Can't do after actually leaving the room so do briefly before
-        self.broadcast_room_clients(exclude_self=True)
+        self.broadcast_room_clients_diff('left')
 
         # Wipe room data on client's record
         # NOTE Don't reply to this client as client doesn't need response and will leave manually
-        self.client = self.kwargs_client_leave(self.sender)
+        self.client_leave_room()
 
 
     def handle_client_name(self):
@@ -122,8 +133,11 @@ class HandlersClient:
             },
         }
 
+        # Update the client's entry in the room's roster summary (if displayed)
+        self.update_roster_entry(['name'])
+
         # Tell other clients about this client's new name
-        self.broadcast_room_clients()
+        self.broadcast_room_clients_diff('changed', ['name'])
 
 
     def handle_client_synced(self):
@@ -141,8 +155,11 @@ class HandlersClient:
             },
         }
 
+        # Update the client's entry in the room's roster summary (if displayed)
+        self.update_roster_entry(['room_synced'])
+
         # Tell other clients about this client's new sync status
-        self.broadcast_room_clients()
+        self.broadcast_room_clients_diff('changed', ['synced'])
 
 
     def handle_client_feedback(self):
@@ -156,7 +173,7 @@ class HandlersClient:
         message = f"\nEmail: {email}\n\nUA: {user_agent}\n\n{feedback}"
 
         # Publish to topic
-        boto3.client('sns').publish(
+        get_sns().publish(
             TopicArn=os.environ['TOPIC_CONTACT'],
             Subject="Selah Feedback: " + feedback[:50].replace('\n', ' ') + "...",
             Message=message,
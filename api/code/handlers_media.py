@@ -1,8 +1,11 @@
 
 from secrets import token_urlsafe
-from urllib.parse import quote_plus
 
-import bleach
+from schemas import Schema
+
+
+# Schemas of the content of each media type
+CONTENT_YOUTUBE = Schema({'id': str}, ['id'])
 
 
 class HandlersMedia:
@@ -21,7 +24,8 @@ class HandlersMedia:
 
         if media_type == 'youtube':
             # Require the video id and ensure no URL injection risks
-            youtube_id = self.expect_from(content, {'id': str}, ['id'])
+            youtube_id = self.expect_from(content, CONTENT_YOUTUBE)
+            from urllib.parse import quote_plus
             clean_content['id'] = quote_plus(youtube_id)
 
         # elif media_type == 'text':
@@ -31,6 +35,7 @@ class HandlersMedia:
         #     html, img = self.expect_from(content, types, nullable=['html', 'img'])
         #     # Sanitize html
         #     if html:
+        #         import bleach  # NOTE Slow to import so only when needed
         #         html = bleach.clean(html, strip=True, tags=('strong', 'em'))
         #     clean_content['html'] = html
         #     # Sanitize image url
@@ -43,26 +48,24 @@ class HandlersMedia:
             self.client_error("Invalid media type: " + media_type)
 
         # If the first media item, then will also load it ready for play
-        set_loaded = '' if self.room['media'] else ', loaded = :loaded, paused = :paused'
-        set_loaded_values = {} if self.room['media'] else {':loaded': 0, ':paused': 0}
+        is_first = not self.media
 
         # Add the media to end of list
-        # WARN Whenever loaded set, also set media, to avoid rare case of index off due to db lag
-        self.room = {
-            'UpdateExpression': 'SET media=:media' + set_loaded,
-            'ExpressionAttributeValues': {
-                ':media': [*self.room['media'], {
-                    'id': token_urlsafe(6),  # Certain to be unique amongst fellow items
-                    'name': name,
-                    'type': media_type,
-                    'content': clean_content,
-                }],
-                **set_loaded_values,
-            }
+        item = {
+            'id': token_urlsafe(6),  # Certain to be unique amongst fellow items
+            'pos': self.room['media_end'] + 1,
+            'name': name,
+            'type': media_type,
+            'content': clean_content,
         }
+        room_changes = {'media_end': item['pos']}
+        if is_first:
+            room_changes.update({'loaded_id': item['id'], 'paused': 0})
+
+        self.update_room_media(put=[item], room_changes=room_changes)
 
         # Update all room's clients
-        self.broadcast_room_state()
+        self.broadcast_room_patch(['paused'] if is_first else [], media_put=[item])
 
 
     def handle_room_media_rearrange(self):
@@ -79,38 +82,22 @@ class HandlersMedia:
         self.check_permission(room_id, 'dj')
 
         # Ensure both media items exist in the room
-        media_ids = tuple(item['id'] for item in self.room['media'])
-        try:
-            before_index = media_ids.index(before_id)
-            after_index = media_ids.index(after_id)
-        except ValueError:
+        items = {item['id']: item for item in self.media}
+        if before_id not in items or after_id not in items:
             return
+        before, after = items[before_id], items[after_id]
 
         # Ensure order not correct already
-        if before_index < after_index:
+        if before['pos'] < after['pos']:
             return
 
-        # Swap the items
-        # NOTE Overwritting values in `self.room` so broadcast will later use correct ones
-        before_item = self.room['media'][before_index]
-        self.room['media'][before_index] = self.room['media'][after_index]
-        self.room['media'][after_index] = before_item
-
-        # Correct loaded if changed
-        if self.room['loaded'] in (before_index, after_index):
-            self.room['loaded'] = before_index if self.room['loaded'] == after_index else after_index
-
-        # Update the room
-        self.room = {
-            'UpdateExpression': 'SET media=:media, loaded=:loaded',
-            'ExpressionAttributeValues': {
-                ':media': self.room['media'],
-                ':loaded': self.room['loaded'],
-            }
-        }
+        # Swap the items' positions
+        # NOTE Loaded item is referred to by id so doesn't need correcting
+        moved = [{**before, 'pos': after['pos']}, {**after, 'pos': before['pos']}]
+        self.update_room_media(put=moved)
 
         # Update all room's clients
-        self.broadcast_room_state()
+        self.broadcast_room_patch(media_put=moved)
 
 
     def handle_room_media_play(self):
@@ -122,23 +109,14 @@ class HandlersMedia:
         self.check_permission(room_id, 'dj')
 
         # Ensure media items exist in the room
-        if self.room['loaded'] is None:
+        if self.room['loaded_id'] is None:
             self.client_confused("No media item to play")
 
         # Play
-        self.room = {
-            'UpdateExpression': 'SET #_start = :start, paused = :paused',
-            'ExpressionAttributeNames': {
-                '#_start': 'start',
-            },
-            'ExpressionAttributeValues': {
-                ':start': start,
-                ':paused': None,
-            }
-        }
+        self.update_room_fields({'start': start, 'paused': None})
 
         # Update all room's clients
-        self.broadcast_room_state()
+        self.broadcast_room_patch(['start', 'paused'])
 
 
     def handle_room_media_pause(self):
@@ -151,23 +129,14 @@ class HandlersMedia:
             self.client_error("Value for 'paused' cannot be negative")
 
         # Ensure media items exist in the room
-        if self.room['loaded'] is None:
+        if self.room['loaded_id'] is None:
             self.client_confused("No media item to pause")
 
         # Pause
-        self.room = {
-            'UpdateExpression': 'SET #_start = :start, paused = :paused',
-            'ExpressionAttributeNames': {
-                '#_start': 'start',
-            },
-            'ExpressionAttributeValues': {
-                ':start': None,
-                ':paused': paused,
-            }
-        }
+        self.update_room_fields({'start': None, 'paused': paused})
 
         # Update all room's clients
-        self.broadcast_room_state()
+        self.broadcast_room_patch(['start', 'paused'])
 
 
     def handle_room_media_load(self):
@@ -177,28 +146,20 @@ class HandlersMedia:
         room_id, media_id = self.expect(['room_id', 'media_id'])
         self.check_permission(room_id, 'dj')
 
-        # Get item's index / ensure it exists
-        media_ids = tuple(item['id'] for item in self.room['media'])
-        if media_id not in media_ids:
+        # Ensure item exists
+        if not any(item['id'] == media_id for item in self.media):
             self.client_confused("Chosen media item does not exist")
 
         # Change loaded media
-        # WARN Whenever loaded set, also set media, to avoid rare case of index off due to db lag
-        self.room = {
-            'UpdateExpression': 'SET #_start=:start, paused=:paused, loaded=:loaded, media=:media',
-            'ExpressionAttributeNames': {
-                '#_start': 'start',
-            },
-            'ExpressionAttributeValues': {
-                ':start': None,
-                ':paused': 0,
-                ':loaded': media_ids.index(media_id),
-                ':media': self.room['media'],
-            }
-        }
+        # NOTE Version check in `update_room_media` ensures item wasn't removed meanwhile
+        self.update_room_media(room_changes={
+            'loaded_id': media_id,
+            'start': None,
+            'paused': 0,
+        })
 
         # Update all room's clients
-        self.broadcast_room_state()
+        self.broadcast_room_patch(['loaded', 'start', 'paused'])
 
 
     def handle_room_media_remove(self):
@@ -209,58 +170,34 @@ class HandlersMedia:
         self.check_permission(room_id, 'dj')
 
         # Get item's index / ensure it exists
-        media_ids = tuple(item['id'] for item in self.room['media'])
+        media_ids = [item['id'] for item in self.media]
         if media_id not in media_ids:
             self.client_confused("Playlist item already removed")
         item_index = media_ids.index(media_id)
 
         # See if need to make additional updates
-        extra_updates = ''
-        extra_values = {}
+        room_changes = {}
         # If was the last item, reset playback properties
         if len(media_ids) == 1:
-            extra_updates = ', loaded=:loaded, #_start=:start, paused=:paused'
-            extra_values = {
-                ':loaded': None,
-                ':start': None,
-                ':paused': None,
+            room_changes = {
+                'loaded_id': None,
+                'start': None,
+                'paused': None,
             }
         # If was the loaded item, load instead the next item (or previous if no next)
-        # NOTE If loading next then keeping loaded the same will achieve this
-        elif item_index == self.room['loaded']:
-            last_index_after_rm = len(media_ids) - 2
-            extra_updates = ', loaded=:loaded, #_start=:start, paused=:paused'
-            extra_values = {
-                ':loaded': min(item_index, last_index_after_rm),
-                ':start': None,
-                ':paused': 0,
-            }
-        # If removing the item will disalign the loaded index, fix it
-        elif item_index < self.room['loaded']:
-            extra_updates = ', loaded=:loaded'
-            extra_values = {
-                ':loaded': self.room['loaded'] - 1,
+        elif media_id == self.room['loaded_id']:
+            next_index = item_index + 1 if item_index + 1 < len(media_ids) else item_index - 1
+            room_changes = {
+                'loaded_id': media_ids[next_index],
+                'start': None,
+                'paused': 0,
             }
 
-        # Create copy of media with item removed
-        # WARN Set whole media key again rather than use "REMOVE" to avoid wrong index if db lag
-        media = self.room['media'].copy()
-        del media[item_index]
-
         # Remove from db
-        update_dict = {
-            # WARN Keep space at end in case extra_updates
-            # NOTE New actions merely separated by a space (e.g. "SET a=a, b=b REMOVE c[0]")
-            'UpdateExpression': 'SET media=:media' + extra_updates,
-            'ExpressionAttributeValues': {
-                ':media': media,
-                **extra_values,
-            },
-        }
-        # NOTE This key cannot exist if empty
-        if '#_start' in extra_updates:
-            update_dict['ExpressionAttributeNames'] = {'#_start': 'start'}
-        self.room = update_dict
+        # NOTE Loaded item is referred to by id so other items being removed doesn't affect it
+        removed = self.media[item_index]
+        self.update_room_media(delete=[removed], room_changes=room_changes)
 
         # Update all room's clients
-        self.broadcast_room_state()
+        self.broadcast_room_patch(['start', 'paused'] if room_changes else [],
+            media_delete=[removed])
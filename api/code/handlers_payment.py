@@ -1,5 +1,16 @@
 
-from urllib.parse import urlparse, urlencode, urlunparse, parse_qsl
+from time import time
+
+from fanout import fan_out
+
+
+# Seconds to cache that an email address has paid (in the payments table)
+# NOTE Not paid isn't cached, as the user may be about to pay (and sessions don't know the email
+#      address until the user enters it at checkout, so can't update the cache then)
+PAID_CACHE_TTL = 60 * 60 * 24 * 90
+
+# Max Stripe customers to check for charges at once
+PAYMENT_CONCURRENCY = 4
 
 
 class HandlersPayment:
@@ -18,6 +29,7 @@ class HandlersPayment:
         amount, return_url = self.expect(['payment_amount', 'payment_return_url'])
         if amount < 100:
             self.client_error("Amount cannot be less than 100 cents")
+        from urllib.parse import urlparse, urlencode, urlunparse, parse_qsl
         try:
             url_parts = urlparse(return_url)
         except:
@@ -74,18 +86,49 @@ class HandlersPayment:
         # Input
         email = self.expect(['client_email'])
 
+        # Use cached status if paid
+        # NOTE Keyed by the address exactly as given, as Stripe's lookup by email is case sensitive
+        # NOTE Items saying not paid may remain from before they stopped being cached, so ignored
+        cached = self.db_payments.get_item(Key={'email': email}).get('Item')
+        if cached and cached['paid'] and cached['expire'] > time():  # TTL deletion can lag days
+            self.reply('payment_paid', True)
+            return
+
+        paid = self.stripe_email_paid(email)
+        if paid:
+            self.db_payments.put_item(Item={
+                'email': email,
+                'paid': True,
+                'expire': time() + PAID_CACHE_TTL,
+            })
+        self.reply('payment_paid', paid)
+
+
+    def stripe_email_paid(self, email):
+        """Return whether any Stripe customer with the given email address has a successful charge
+
+        Customers are checked concurrently, stopping as soon as one is found to have paid
+
+        """
+
         # Setup stripe
         import stripe
         stripe.api_key = self.config['secrets']['stripe_key_private']
 
-        # Try get customer with given email address who has paid something
-        customers = stripe.Customer.list(email=email)
-        for customer in customers['data']:
+        def customer_paid(customer):
             charges = stripe.Charge.list(customer=customer['id'])
-            for charge in charges['data']:
-                if charge['status'] == 'succeeded':
-                    self.reply('payment_paid', True)
-                    return
+            return any(charge['status'] == 'succeeded' for charge in charges['data'])
 
-        # Didn't find a charge so return false
-        self.reply('payment_paid', False)
+        # Try get customer with given email address who has paid something
+        # NOTE Stripe's client is thread safe (uses a session per thread)
+        customers = stripe.Customer.list(email=email)['data']
+        exception = None
+        for customer, paid, exc, seconds in fan_out(customer_paid, customers, PAYMENT_CONCURRENCY):
+            if paid:
+                return True  # NOTE fan_out cancels calls not yet started
+            exception = exception or exc
+
+        # Only certain hasn't paid if all customers were checked
+        if exception:
+            raise exception
+        return False
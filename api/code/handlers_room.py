@@ -1,12 +1,19 @@
 
-from html import escape
+import json
 from secrets import token_urlsafe
 from datetime import datetime, timedelta
 
-from bleach import linkify
-from bleach.callbacks import nofollow, target_blank
+from boto3.dynamodb.conditions import Attr
 
 from names import get_random_name
+from cache import room_cache
+from fanout import fan_out
+from resources import SEND_CONCURRENCY
+from tracing import tag
+
+
+# Milliseconds before function times out that should stop evicting clients (so can finish cleanly)
+EVICT_TIME_MARGIN = 3000
 
 
 class HandlersRoom:
@@ -22,8 +29,15 @@ class HandlersRoom:
         # Get copy of existing room if copying
         # NOTE If room doesn't exist will create blank one, as if can't copy would still want a room
         copy = None
+        copy_media = []
+        copy_loaded_id = None
         if copy_id:
             copy = self.db_rooms.get_item(Key={'id': copy_id}, ConsistentRead=True).get('Item')
+        if copy and 'media' in copy:
+            copy_media, copy_loaded_id = self.legacy_room_media(copy)
+        elif copy:
+            copy_media = self.query_room_media(copy_id)
+            copy_loaded_id = copy.get('loaded_id')
 
         # Generate id and admin secret
         # NOTE Room id should be safe enough, and yet not too difficult to type manually if needed
@@ -60,23 +74,44 @@ class HandlersRoom:
             'expire': expire.timestamp(),  # TODO Update when room modified (not when clients join as bots could keep open forever)
 
             'name': room_name,
-            'media': copy['media'] if copy else [],
-            'loaded': copy['loaded'] if copy else None,
+            'media_end': copy_media[-1]['pos'] if copy_media else -1,  # Position of last item
+            'loaded_id': copy_loaded_id,
             'start': copy['start'] if copy else None,
             'paused': copy['paused'] if copy else None,
 
             'admins_only_dj': True,
             'admins_only_see_clients': False,
             'admins_only_chat': False,
+
+            'version': 0,  # Increased with every update (see `room` setter)
         }
 
         # Create the room
         # NOTE This will override existing, but id generated server-side and random enough
         self.db_rooms.put_item(Item=room)
 
+        # Copy media items (stored separately, see `update_room_media`)
+        media = [{**item, 'room_id': room_id, 'expire': room['expire']} for item in copy_media]
+        with self.db_media.batch_writer() as batch:
+            for item in media:
+                batch.put_item(Item=item)
+
         # Cache otherwise value may not be available when room_state() gets it
-        self._cached_room['id'] = room_id
-        self._cached_room['value'] = room
+        self.cache.set('rooms', room_id, room)
+        self.cache.set('media', room_id, media)
+        room_cache.put(room_id, room)
+
+        # Start the room's roster summary (only summaries started with the room have exact counts)
+        # NOTE See ROSTER SUMMARIES in handlers.py
+        self.db_rosters.put_item(Item={
+            'room_id': room_id,
+            'exact': True,
+            'total': 0,
+            'admins': 0,
+            'revision': 0,
+            'changed': now.timestamp(),
+            'expire': expire.timestamp(),
+        })
 
         # Assign creator to this room
         self.client_join_room(room_id, is_admin=True, client_name=client_name)
@@ -97,7 +132,13 @@ class HandlersRoom:
 
 
     def handle_room_delete(self):
-        """Delete a room and remove all clients from it"""
+        """Delete a room and remove all clients from it
+
+        NOTE If there are too many clients to remove before the function times out, the room is
+             left marked as deleted (so can't be used) and the sweeper finishes removing them
+             (see `sweep_deleted_rooms`), though sending the request again also resumes it
+
+        """
         room_id, secret = self.expect(['room_id', 'room_secret'])
 
         # Check room exists
@@ -113,17 +154,104 @@ class HandlersRoom:
         if secret != room['secret']:
             self.client_confused("Cannot delete room as you are not an admin")
 
-        # Delete room first so that new clients can't join
-        self.db_rooms.delete_item(Key={'id': room_id})
+        # Mark room as deleted first so that new clients can't join (and members can't use it)
+        # NOTE Not deleting yet so that can resume if don't finish removing clients, and noting
+        #      the API to post to so the sweeper can resume it (see `sweep_deleted_rooms`)
+        context = self.event['requestContext']
+        self.db_rooms.update_item(
+            Key={'id': room_id},
+            UpdateExpression='SET deleted=:deleted, deleted_api=:api',
+            ExpressionAttributeValues={
+                ':deleted': True,
+                ':api': {'domain': context['domainName'], 'stage': context['stage']},
+            },
+        )
+        room_cache.invalidate(room_id)
 
-        # Boot all existing clients out of room
-        for socket in self.get_client_sockets(force_room_id=room_id):
-            self.send(socket, 'room_invalid', {'room_id': room_id})
-            with self.condition_to_client_error():
-                self.db_clients.update_item(**self.kwargs_client_leave(socket))
+        # Remove clients and delete the room
+        # NOTE Count evicted is traced and told to the sender, as deleting big rooms is costly
+        evicted, complete = self.delete_room(room_id)
+        tag(evicted=evicted)
+        if not complete:
+            self.client_confused(f"Removed {evicted} people from the room so far, the rest will be"
+                " removed and the room deleted soon")
 
         # Finally, let sender know it was deleted (even if they weren't in room)
-        self.reply('room_invalid', {'room_id': room_id})
+        self.reply('room_invalid', {'room_id': room_id, 'evicted': evicted})
+
+
+    def delete_room(self, room_id):
+        """Evict all clients of a room already marked deleted, and then delete it
+
+        Returns count of clients evicted and whether finished (False if ran out of time, leaving
+        the room marked deleted)
+
+        """
+
+        # Boot all existing clients out of room
+        evicted, complete = self.evict_room_clients(room_id)
+        if not complete:
+            return (evicted, False)
+
+        # Delete the room (and its roster summary and media) now that it has no clients
+        # NOTE Evicting doesn't update the summary, so it's only accurate again once deleted
+        self.db_rooms.delete_item(Key={'id': room_id})
+        self.db_rosters.delete_item(Key={'room_id': room_id})
+        with self.db_media.batch_writer() as batch:
+            for item in self.query_room_media(room_id):
+                batch.delete_item(Key={'room_id': room_id, 'id': item['id']})
+        return (evicted, True)
+
+
+    def evict_room_clients(self, room_id):
+        """Tell all clients of a room it's invalid and remove them from it
+
+        Clients are evicted concurrently (up to SEND_CONCURRENCY at once), and no more are started
+        once the function is close to timing out, so that it can finish cleanly and be resumed.
+        Clients that disconnect or leave the room in the meantime are skipped.
+
+        Returns count of clients evicted and whether all were (False if ran out of time)
+
+        """
+        data = json.dumps({'type': 'room_invalid', 'info': {'room_id': room_id}}).encode('utf-8')
+        complete = True
+
+        def sockets():
+            # Stop providing sockets if running out of time
+            nonlocal complete
+            for socket in self.get_client_sockets(force_room_id=room_id):
+                if self.context.get_remaining_time_in_millis() < EVICT_TIME_MARGIN:
+                    complete = False
+                    return
+                yield socket
+
+        def evict(socket):
+            # Tell client first, as it's harmless if they then fail to be removed
+            try:
+                self.sockets.post_to_connection(Data=data, ConnectionId=socket)
+            except self.sockets.exceptions.GoneException:
+                pass  # Will still remove in case record not deleted (as AWS doesn't guarantee it)
+
+            # Only remove if client still in this room (may have disconnected or left already)
+            # NOTE Table methods only call the db client which is thread safe
+            kwargs = self.kwargs_client_leave(socket)
+            kwargs['ConditionExpression'] &= Attr('room_id').eq(room_id)
+            try:
+                self.db_clients.update_item(**kwargs)
+            except self.db.meta.client.exceptions.ConditionalCheckFailedException:
+                return False
+            return True
+
+        evicted = 0
+        exception = None
+        for socket, removed, exc, seconds in fan_out(evict, sockets(), SEND_CONCURRENCY):
+            if exc:
+                exception = exception or exc  # Report the first after trying all the others
+            elif removed:
+                evicted += 1
+        if exception:
+            raise exception
+        return (evicted, complete)
 
 
     def handle_room_name(self):
@@ -135,18 +263,38 @@ class HandlersRoom:
         self.check_permission(room_id, admins_only=True)
 
         # Change the room name
-        self.room = {
-            'UpdateExpression': 'SET #_name=:name',
-            'ExpressionAttributeNames': {
-                '#_name': 'name',
-            },
-            'ExpressionAttributeValues': {
-                ':name': name,
-            },
-        }
+        self.update_room_fields({'name': name})
 
         # Update all room's clients
-        self.broadcast_room_state()
+        self.broadcast_room_patch(['name'])
+
+
+    def handle_room_state_resync(self):
+        """Reply with the full state of the room (if client missed a patch)"""
+
+        # Input
+        room_id = self.expect(['room_id'])
+        self.check_permission(room_id)
+
+        # Ensure latest version (as client already has a later version than that seen before)
+        room_cache.invalidate(room_id)
+        self.cache.discard('rooms', room_id)
+        self.reply('room_state', self.room_state())
+
+
+    def handle_room_clients_resync(self):
+        """Reply with the full list of the room's clients (if client's copy has got out of sync)"""
+
+        # Input
+        room_id = self.expect(['room_id'])
+        self.check_permission(room_id)
+
+        # Reply with version of list the client is allowed to see
+        admin_clients, guest_clients = self.room_clients()
+        self.reply('room_clients', {
+            'room_id': room_id,
+            'clients': admin_clients if self.client['room_admin'] else guest_clients,
+        })
 
 
     def handle_room_message(self):
@@ -156,13 +304,10 @@ class HandlersRoom:
         room_id, message = self.expect(['room_id', 'room_message'])
         self.check_permission(room_id, 'chat')
 
-        # Convert message to html but only allowing <br>
-        html = '<br>'.join(escape(line) for line in message.split('\n'))
-
-        # Create links for any URLs in the text
-        # WARN linkify doesn't sanitize and accepts html, so escape first
-        # NOTE links have rel=nofollow and target=_blank added
-        html = linkify(html, [nofollow, target_blank])
+        # Convert message to html with only <br> and links (with rel=nofollow and target=_blank)
+        # NOTE Only imported when needed as compiles a large url regex
+        from chat import message_to_html
+        html = message_to_html(message)
 
         # Update all room's clients
         self.send(self.get_client_sockets(), 'room_message', {
@@ -183,15 +328,10 @@ class HandlersRoom:
         self.check_permission(room_id, admins_only=True)
 
         # Change admins_only value
-        self.room = {
-            'UpdateExpression': f'SET admins_only_{permission}=:admins_only',
-            'ExpressionAttributeValues': {
-                ':admins_only': admins_only,
-            }
-        }
+        self.update_room_fields({f'admins_only_{permission}': admins_only})
 
         # Update all room's clients
-        self.broadcast_room_state()
+        self.broadcast_room_patch([f'admins_only_{permission}'])
 
         # If changing see_clients then will also need to rebroadcast clients
         if permission == 'see_clients':
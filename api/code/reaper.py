@@ -0,0 +1,187 @@
+
+# Removal of clients whose sockets have gone without a `$disconnect` being handled
+# NOTE AWS ends sockets after 2 hours at most and doesn't guarantee `$disconnect` is sent, so their
+#      records could otherwise stay in rooms (being queried and posted to) until they expire
+# NOTE Clients are reaped when posting to them finds them gone (see `flush_outbox`), and by a
+#      periodic sweep of those connected for longer than sockets can last (see `sweep_clients`)
+# NOTE The sweep also finishes deleting rooms whose clients weren't all evicted in time when the
+#      room was deleted (see `sweep_deleted_rooms`)
+
+
+from time import time
+
+from handlers import ROSTER_ENTRY_PREFIX, ROSTER_EXPIRE
+from handlers_aws import CLIENT_RECORD_LIFETIME
+
+
+# Max seconds API Gateway keeps a socket connected
+# See https://docs.aws.amazon.com/apigateway/latest/developerguide/limits.html
+SOCKET_MAX_DURATION = 60 * 60 * 2
+
+# Max clients deleted per transaction
+# NOTE Each room they're in adds another item to the transaction (which has a max of 100)
+REAP_BATCH = 25
+
+# Max keys DynamoDB allows per batch get
+BATCH_GET_KEYS = 100
+
+# Fields of a client record needed to remove it from its room
+REAP_FIELDS = 'socket, room_id, room_joined, room_admin'
+
+
+def get_clients(db, table, sockets):
+    """Return the records of those of the given sockets that have one (only fields for reaping)
+
+    NOTE Any keys DynamoDB leaves unprocessed after a few attempts are skipped (reaped later)
+
+    """
+    sockets = list(sockets)
+    clients = []
+    for start in range(0, len(sockets), BATCH_GET_KEYS):
+        request = {table.name: {
+            'Keys': [{'socket': socket} for socket in sockets[start:start + BATCH_GET_KEYS]],
+            'ProjectionExpression': REAP_FIELDS,
+        }}
+        for attempt in range(3):
+            resp = db.batch_get_item(RequestItems=request)
+            clients.extend(resp['Responses'].get(table.name, ()))
+            request = resp.get('UnprocessedKeys')
+            if not request:
+                break
+    return clients
+
+
+def reap_clients(db, clients_table, rosters_table, clients):
+    """Delete client records and remove them from their rooms' roster summaries
+
+    Clients are deleted in batches, each in one transaction with one update per room's summary.
+    Like `update_client_room`, records are only deleted if still in the same stay of a room as
+    given, so counts are only adjusted once if a client changes concurrently. If a batch is
+    cancelled because of that, its clients are retried individually (skipping those changed).
+
+    Returns the clients that were deleted
+
+    """
+    reaped = []
+    for start in range(0, len(clients), REAP_BATCH):
+        batch = clients[start:start + REAP_BATCH]
+        if _delete_clients(db, clients_table, rosters_table, batch):
+            reaped.extend(batch)
+        elif len(batch) > 1:
+            reaped.extend(client for client in batch
+                if _delete_clients(db, clients_table, rosters_table, [client]))
+    return reaped
+
+
+def _delete_clients(db, clients_table, rosters_table, clients):
+    """Delete clients and update their rooms' summaries in one transaction (False if cancelled)"""
+    items = []
+    rosters = {}
+    for client in clients:
+        items.append({'Delete': {
+            'TableName': clients_table.name,
+            'Key': {'socket': client['socket']},
+            'ConditionExpression': 'room_id=:_old_room AND room_joined=:_old_joined',
+            'ExpressionAttributeValues': {
+                ':_old_room': client['room_id'],
+                ':_old_joined': client['room_joined'],
+            },
+        }})
+        # NOTE '#' represents not being in a room (see `handle_aws_connect`)
+        if client['room_id'] != '#':
+            roster = rosters.setdefault(client['room_id'], {'total': 0, 'admins': 0, 'entries': []})
+            roster['total'] -= 1
+            roster['admins'] -= 1 if client['room_admin'] else 0
+            roster['entries'].append(ROSTER_ENTRY_PREFIX + client['socket'])
+
+    # Adjust counters and remove entries the same way `update_client_room` does
+    now = time()
+    for room_id, roster in rosters.items():
+        names = {'#total': 'total'}
+        names.update({f'#_entry{n}': entry for n, entry in enumerate(roster['entries'])})
+        items.append({'Update': {
+            'TableName': rosters_table.name,
+            'Key': {'room_id': room_id},
+            'UpdateExpression': ('ADD #total :total, admins :admins, revision :one'
+                ' SET changed=:now, expire=:expire REMOVE '
+                + ', '.join(f'#_entry{n}' for n in range(len(roster['entries'])))),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': {
+                ':total': roster['total'],
+                ':admins': roster['admins'],
+                ':one': 1,
+                ':now': now,
+                ':expire': now + ROSTER_EXPIRE,
+            },
+        }})
+
+    try:
+        db.meta.client.transact_write_items(TransactItems=items)
+    except db.meta.client.exceptions.TransactionCanceledException:
+        return False
+    return True
+
+
+def sweep_clients(db, clients_table, rosters_table, now=None):
+    """Reap all clients that connected longer ago than sockets can last, returning how many
+
+    NOTE Records don't store when connected, but expire a set time after (see `handle_aws_connect`)
+    WARN Scans the whole clients table, so only run periodically (see template.yaml)
+
+    """
+    now = time() if now is None else now
+    cutoff = now - SOCKET_MAX_DURATION + CLIENT_RECORD_LIFETIME.total_seconds()
+    scan = {
+        'ProjectionExpression': REAP_FIELDS,
+        'FilterExpression': 'expire < :cutoff',
+        'ExpressionAttributeValues': {':cutoff': cutoff},
+    }
+    reaped = 0
+    while True:
+        resp = clients_table.scan(**scan)
+        reaped += len(reap_clients(db, clients_table, rosters_table, resp.get('Items', [])))
+        if 'LastEvaluatedKey' not in resp:
+            return reaped
+        scan['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def sweep_deleted_rooms(rooms_table, context):
+    """Finish deleting rooms left marked deleted (see `handle_room_delete`)
+
+    Returns how many rooms were deleted and how many clients were evicted from them
+
+    Rooms are deleted one at a time until done or the function is close to timing out (the rest
+    are then finished by the next sweep)
+
+    """
+    from handlers import WebsocketHandlers
+
+    scan = {
+        'ProjectionExpression': 'id, deleted_api',
+        'FilterExpression': 'deleted=:deleted',
+        'ExpressionAttributeValues': {':deleted': True},
+    }
+    deleted = 0
+    evicted = 0
+    while True:
+        resp = rooms_table.scan(**scan)
+        for room in resp.get('Items', []):
+            # Evict as if the room's admin were deleting it again (via the API they used)
+            # NOTE Rooms marked before the API was noted can't be posted to, so are left to expire
+            api = room.get('deleted_api')
+            if not api:
+                continue
+            handlers = WebsocketHandlers({'requestContext': {
+                'connectionId': None,
+                'domainName': api['domain'],
+                'stage': api['stage'],
+                'eventType': 'SWEEP',
+            }}, context)
+            room_evicted, complete = handlers.delete_room(room['id'])
+            evicted += room_evicted
+            if not complete:
+                return (deleted, evicted)  # Ran out of time
+            deleted += 1
+        if 'LastEvaluatedKey' not in resp:
+            return (deleted, evicted)
+        scan['ExclusiveStartKey'] = resp['LastEvaluatedKey']
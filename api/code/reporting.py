@@ -0,0 +1,112 @@
+
+# Reporting of errors to the errors SNS topic
+# NOTE The same error often happens many times at once (e.g. a bad client build, or a db hiccup
+#      during a busy room), so each container only publishes the first of each kind per window,
+#      and says how many more there were when it's next published
+# NOTE Publishing is done in a background thread so it doesn't delay handling (or replies sent)
+# WARN Lambda freezes a container once it has responded, so a publish may only complete when the
+#      container is next invoked (and be lost if it never is), so invocations wait for their
+#      reports (up to ERROR_REPORT_WAIT) before returning (see `finish_reports` in entrypoint.py)
+
+
+import os
+import threading
+import traceback
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from resources import get_sns
+
+
+# Seconds after reporting an error that others like it are only counted (0 = report all)
+ERROR_REPORT_WINDOW = float(os.environ.get('ERROR_REPORT_WINDOW', 60))
+
+# Max seconds an invocation waits for its reports to be published before returning
+ERROR_REPORT_WAIT = 2
+
+
+def fingerprint(exc):
+    """Return what identifies an exception as being like another
+
+    Uses its type and where it was raised from (but not its message, which often includes ids)
+
+    """
+    frames = tuple((frame.filename, frame.lineno, frame.name)
+        for frame in traceback.extract_tb(exc.__traceback__))
+    return (type(exc).__qualname__, frames)
+
+
+class ErrorReporter:
+    """Publishes errors, suppressing those like one already published within the window
+
+    `publish(subject, message)` is called for each error published (see `report_error` for default)
+
+    """
+
+    def __init__(self, publish, window=ERROR_REPORT_WINDOW, clock=monotonic):
+        self.publish = publish
+        self.window = window
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.seen = {}  # Fingerprint -> [time last published, count suppressed since]
+
+    def report(self, exc):
+        """Publish an exception (with traceback) unless suppressed, returning whether published"""
+        key = fingerprint(exc)
+        now = self.clock()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry and now - entry[0] < self.window:
+                entry[1] += 1
+                return False
+            suppressed = entry[1] if entry else 0
+            self.seen[key] = [now, 0]
+
+        message = ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+        if suppressed:
+            message = (f"{suppressed} more like this occurred (but weren't reported) since last"
+                f" reported by this container\n\n{message}")
+        self.publish(f"{os.environ['STACK']} API Error", message)
+        return True
+
+
+# Thread that publishes reports (only created when first needed)
+# NOTE Locked as the self-hosted server reports from many threads at once (see server/server.py)
+_executor = None
+_pending = []
+_lock = threading.Lock()
+
+
+def _publish_in_background(subject, message):
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1)
+        _pending[:] = [future for future in _pending if not future.done()]
+        _pending.append(_executor.submit(get_sns().publish, TopicArn=os.environ['TOPIC_ERRORS'],
+            Subject=subject, Message=message))
+
+
+_reporter = ErrorReporter(_publish_in_background)
+
+
+def report_error(exc):
+    """Report an exception to the errors topic in the background (unless suppressed)"""
+    return _reporter.report(exc)
+
+
+def wait_for_reports(timeout=None):
+    """Wait for reports to be published (up to timeout seconds), returning whether all were
+
+    NOTE Failures to publish are only logged, as there's nowhere else to report them
+
+    """
+    with _lock:
+        waiting = list(_pending)
+    done, not_done = wait(waiting, timeout)
+    with _lock:
+        _pending[:] = [future for future in _pending if future not in done]
+    for future in done:
+        if future.exception():
+            print(f"Failed to publish error report: {future.exception()!r}")
+    return not not_done
@@ -0,0 +1,124 @@
+
+# Resources that are slow to create, so are created once per container and reused
+# NOTE Lambda keeps containers warm between invocations and anything cached at module level persists
+#      So later invocations don't re-read the config or create new clients, which also means their
+#      HTTPS connections are kept alive and reused rather than negotiated again every time
+# WARN Used by the sync fast path, so nothing may be imported at module level except `os`
+#      (which Python always loads on startup anyway)
+
+
+import os
+
+
+# Services to use ('aws', 'local' for those of the self-hosted server, see server/local.py, or
+# 'memory' for in-process stand-ins, see bench/memory.py)
+# NOTE Neither is deployed, so 'local' can only be used by the server and 'memory' by scripts in
+#      bench/ (each being a module of the same name, with the same services)
+BACKEND = os.environ.get('BACKEND', 'aws')
+
+# Whether to time requests made by each invocation and log them (see tracing.py)
+TRACE_IO = os.environ.get('TRACE_IO', 'false') == 'true'
+
+# Max number of sockets to post to at once when sending to multiple connections
+SEND_CONCURRENCY = int(os.environ.get('SEND_CONCURRENCY', 16))
+
+
+# Resources already created (see functions below for keys)
+_cache = {}
+
+
+def get_config():
+    """Return the app config
+
+    WARN Shared by all invocations so must not be modified
+
+    """
+    if 'config' not in _cache:
+        import json
+        from pathlib import Path
+        _cache['config'] = json.loads((Path(__file__).parent / 'app_config.json').read_text())
+    return _cache['config']
+
+
+def _in_process(name):
+    """Return a service of the in-process backend (see BACKEND)"""
+    from importlib import import_module
+    return getattr(import_module(BACKEND), name)
+
+
+def _instrument(client):
+    """Time the client's requests if tracing is enabled
+
+    NOTE tracing.py only imported if enabled as this is also used by the sync fast path
+
+    """
+    if TRACE_IO:
+        from tracing import instrument
+        instrument(client)
+    return client
+
+
+def get_sockets(domain, stage):
+    """Return a client for posting to the sockets of the given API stage"""
+    # See https://docs.aws.amazon.com/apigateway/latest/developerguide/apigateway-how-to-call-websocket-api-connections.html
+    key = ('sockets', domain, stage)
+    if BACKEND != 'aws':
+        key = 'sockets'  # The same for any stage
+    if key not in _cache:
+        if BACKEND != 'aws':
+            _cache[key] = _instrument(_in_process('sockets'))
+        else:
+            import boto3
+            from botocore.config import Config
+            # NOTE Connection pool must be at least as large as concurrency or sends will wait
+            _cache[key] = _instrument(boto3.client('apigatewaymanagementapi',
+                endpoint_url=f'https://{domain}/{stage}',
+                config=Config(max_pool_connections=SEND_CONCURRENCY, tcp_keepalive=True)))
+    return _cache[key]
+
+
+def get_db():
+    """Return the DynamoDB service (with the interface of boto3's resource, see dynamo.py)"""
+    if 'db' not in _cache:
+        if BACKEND != 'aws':
+            _cache['db'] = _in_process('database')
+        else:
+            import boto3
+            from botocore.config import Config
+            from dynamo import Database
+            # NOTE Connection pool must be at least as large as concurrency (see `fan_out` usage)
+            _cache['db'] = Database(boto3.client('dynamodb',
+                config=Config(max_pool_connections=SEND_CONCURRENCY, tcp_keepalive=True)))
+        # NOTE Tables' requests are all made by the db's client
+        _instrument(_cache['db'].meta.client)
+    return _cache['db']
+
+
+def get_table(name):
+    """Return the stack's DynamoDB table of the given name (e.g. 'rooms')"""
+    key = ('table', name)
+    if key not in _cache:
+        _cache[key] = get_db().Table(f"{os.environ['STACK']}-{name}")
+    return _cache[key]
+
+
+def get_sns():
+    """Return the SNS client"""
+    if 'sns' not in _cache:
+        if BACKEND != 'aws':
+            _cache['sns'] = _instrument(_in_process('sns'))
+        else:
+            import boto3
+            _cache['sns'] = _instrument(boto3.client('sns'))
+    return _cache['sns']
+
+
+def get_queue():
+    """Return the SQS client"""
+    if 'queue' not in _cache:
+        if BACKEND != 'aws':
+            _cache['queue'] = _instrument(_in_process('queue'))
+        else:
+            import boto3
+            _cache['queue'] = _instrument(boto3.client('sqs'))
+    return _cache['queue']
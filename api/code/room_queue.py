@@ -0,0 +1,198 @@
+
+# Optional queue for messages that change a room, so they're applied in order and in batches
+# NOTE Enabled by ROOM_QUEUE (see template.yaml), in which case messages of QUEUED_TYPES are only
+#      checked by the invocation that receives them (see `handle`) and then sent to a FIFO queue,
+#      grouped by room so a room's messages are received in order and never concurrently
+# NOTE The worker (see `drain_records`) applies each room's batch of messages to one copy of the
+#      room (via the usual handlers, see `room_draft`), then writes it once and broadcasts one
+#      patch, so a burst of N changes to a room costs 1 write and 1 broadcast rather than N of each
+# NOTE The worker also flushes rooms' queued clients diffs, which the invocation that queued a
+#      room's first diff sends to a separate (standard) queue, delayed by the flush interval
+#      (see `queue_room_clients_diff`), so no invocation has to wait out the interval itself
+# NOTE Uses an in-memory queue when BACKEND=memory (see `MemoryQueue` in bench/memory.py)
+
+
+import os
+import json
+from secrets import token_urlsafe
+
+from resources import get_queue
+
+
+# Whether to queue messages that change rooms (otherwise they're handled straight away)
+ROOM_QUEUE = os.environ.get('ROOM_QUEUE', 'false') == 'true'
+
+# Types of messages that are queued
+# NOTE Not room_admins_only_see_clients as it also rebroadcasts clients lists (and rarely changes)
+QUEUED_TYPES = frozenset((
+    'room_name',
+    'room_admins_only_dj',
+    'room_admins_only_chat',
+    'room_media_add',
+    'room_media_rearrange',
+    'room_media_play',
+    'room_media_pause',
+    'room_media_load',
+    'room_media_remove',
+))
+
+# Times to apply a batch if the room is changed by something else meanwhile
+BATCH_ATTEMPTS = 3
+
+
+class RoomDraft:
+    """Changes made to a room by a batch of messages, to be written and broadcast together
+
+    NOTE Items both added and removed within a batch are still deleted (harmless if never written)
+
+    """
+
+    def __init__(self):
+        self.room_changes = {}
+        self.put = {}  # Media items to put, by id
+        self.delete = {}  # Media items to delete, by id
+        self.fields = set()  # Fields of the room's state to broadcast
+
+    def apply(self, put, delete, room_changes):
+        self.room_changes.update(room_changes)
+        for item in put:
+            self.delete.pop(item['id'], None)
+            self.put[item['id']] = item
+        for item in delete:
+            self.put.pop(item['id'], None)
+            self.delete[item['id']] = item
+
+    def __bool__(self):
+        return bool(self.room_changes or self.put or self.delete)
+
+
+def queue_room_message(handlers):
+    """Send the message being handled to the room queue (sender must be in the room)
+
+    Includes what the worker needs to know about the sender and the API to reply via, and is
+    deduplicated by request id so a retried invocation doesn't queue it twice
+
+    """
+    room_id = handlers.msg_info['room_id']
+    handlers.check_permission(room_id)  # NOTE Specific permissions checked when applied
+    context = handlers.event['requestContext']
+    get_queue().send_message(
+        QueueUrl=os.environ['ROOM_QUEUE_URL'],
+        MessageBody=json.dumps({
+            'type': handlers.msg_type,
+            'info': handlers.msg_info,
+            'sender': handlers.sender,
+            'admin': handlers.client['room_admin'],
+            'domain': context['domainName'],
+            'stage': context['stage'],
+        }),
+        MessageGroupId=room_id,
+        MessageDeduplicationId=context.get('requestId') or token_urlsafe(),
+    )
+
+
+def queue_roster_flush(handlers, room_id, flusher, delay):
+    """Have the worker flush a room's queued clients diffs after the given seconds"""
+    context = handlers.event['requestContext']
+    get_queue().send_message(
+        QueueUrl=os.environ['ROSTER_QUEUE_URL'],
+        MessageBody=json.dumps({
+            'room_id': room_id,
+            'flusher': flusher,
+            'domain': context['domainName'],
+            'stage': context['stage'],
+        }),
+        DelaySeconds=delay,
+    )
+
+
+def drain_records(records, context):
+    """Apply records of queued messages (from a Lambda SQS event) a room at a time
+
+    Returns the ids of records that couldn't be applied (all those of a room if any) so only they
+    are retried (see `FunctionResponseTypes` in template.yaml)
+
+    """
+    from reporting import report_error
+
+    # NOTE Only records of the (FIFO) room queue have a group, the rest are roster flushes
+    rooms = {}
+    flushes = []
+    for record in records:
+        if 'MessageGroupId' in record['attributes']:
+            rooms.setdefault(record['attributes']['MessageGroupId'], []).append(record)
+        else:
+            flushes.append(record)
+
+    failed = []
+    for record in flushes:
+        try:
+            flush_roster(json.loads(record['body']), context)
+        except Exception as exc:
+            report_error(exc)
+            failed.append(record['messageId'])
+    for room_id, room_records in rooms.items():
+        try:
+            apply_room_batch(room_id, [json.loads(record['body']) for record in room_records],
+                context)
+        except Exception as exc:
+            report_error(exc)
+            failed.extend(record['messageId'] for record in room_records)
+    return failed
+
+
+def flush_roster(flush, context):
+    """Broadcast a room's queued clients diffs (see `flush_room_clients_diffs`)"""
+    from handlers import WebsocketHandlers
+
+    handlers = WebsocketHandlers({'requestContext': {
+        'connectionId': None,
+        'domainName': flush['domain'],
+        'stage': flush['stage'],
+        'eventType': 'FLUSH',
+    }}, context)
+    handlers.flush_room_clients_diffs(flush['room_id'], flush['flusher'])
+
+
+def apply_room_batch(room_id, messages, context):
+    """Apply a room's messages to one copy of it, in order, then write and broadcast it once
+
+    Each message is handled as if sent by its sender (who is told if it no longer applies), and
+    the whole batch is applied again if the room was changed by something else meanwhile
+
+    """
+    from handlers import WebsocketHandlers
+    from reporting import report_error
+
+    first = messages[0]
+    event = {'requestContext': {
+        'connectionId': first['sender'],
+        'domainName': first['domain'],
+        'stage': first['stage'],
+        'eventType': 'MESSAGE',
+    }}
+    for attempt in range(BATCH_ATTEMPTS):
+        handlers = WebsocketHandlers(event, context)
+        handlers.room_draft = RoomDraft()
+        for message in messages:
+            # Sender's record is known to be in the room (as of queuing) so needn't be read
+            handlers.sender = message['sender']
+            handlers.cache.set('clients', message['sender'], {
+                'socket': message['sender'],
+                'room_id': room_id,
+                'room_admin': message['admin'],
+            })
+            handlers.msg_type = message['type']
+            handlers.msg_info = message['info']
+            try:
+                handlers.handle()
+            except handlers.ClientError as exc:
+                report_error(exc)  # Same as if not queued (see `enter`)
+        if handlers.commit_room_draft():
+            # NOTE Mustn't fail once written, or the batch would be retried and applied again
+            try:
+                handlers.flush_outbox()
+            except Exception as exc:
+                report_error(exc)
+            return
+    raise Exception(f"Room {room_id} kept changing while applying a batch of its messages")
@@ -0,0 +1,122 @@
+
+# Schemas of messages clients can send, compiled once per container rather than per message
+# NOTE Every handler must have an entry in MESSAGES (checked by `compile_dispatch`)
+
+
+from numbers import Number
+
+
+NoneType = type(None)
+
+
+# Types of all fields that messages can have
+FIELD_TYPES = {
+    'room_id': str,
+    'room_id_copy': str,
+    'room_name': str,
+    'room_secret': str,
+    'room_start': Number,
+    'room_paused': Number,
+    'room_loaded': int,
+    'room_admins_only': bool,
+    'room_message': str,
+    'client_name': str,
+    'client_synced': Number,
+    'client_feedback': str,
+    'client_email': str,
+    'client_user_agent': str,
+    'payment_amount': int,
+    'payment_return_url': str,
+    'media_id': str,
+    'media_id_after': str,
+    'media_name': str,
+    'media_type': str,
+    'media_content': dict,
+}
+
+
+# Fields of each message type as (required, nullable), in the order handlers `expect` them
+# NOTE None for messages whose info isn't validated (those created internally or deprecated)
+MESSAGES = {
+    'aws_connect': None,
+    'aws_disconnect': None,
+    'client_join': (['room_id'], ['room_secret', 'client_name']),
+    'client_leave': (['room_id'], []),
+    'client_name': ([], ['client_name']),
+    'client_synced': ([], ['client_synced']),
+    'client_feedback': (['client_feedback', 'client_user_agent'], ['client_email']),
+    'client_time': None,
+    'room_create': ([], ['client_name', 'room_id_copy', 'room_name']),
+    'room_delete': (['room_id', 'room_secret'], []),
+    'room_name': (['room_id', 'room_name'], []),
+    'room_state_resync': (['room_id'], []),
+    'room_clients_resync': (['room_id'], []),
+    'room_message': (['room_id', 'room_message'], []),
+    'room_admins_only_dj': (['room_id', 'room_admins_only'], []),
+    'room_admins_only_see_clients': (['room_id', 'room_admins_only'], []),
+    'room_admins_only_chat': (['room_id', 'room_admins_only'], []),
+    'room_media_add': (['room_id', 'media_name', 'media_type', 'media_content'], []),
+    'room_media_rearrange': (['room_id', 'media_id', 'media_id_after'], []),
+    'room_media_play': (['room_id', 'room_start'], []),
+    'room_media_pause': (['room_id', 'room_paused'], []),
+    'room_media_load': (['room_id', 'media_id'], []),
+    'room_media_remove': (['room_id', 'media_id'], []),
+    'payment_session': (['payment_amount', 'payment_return_url'], []),
+    'payment_paid': (['client_email'], []),
+}
+
+
+class InvalidMessage(Exception):
+    """Raised when data doesn't match a schema (message is suitable for the client)"""
+
+
+class Schema:
+    """Checks data has exactly the given keys, with values of the given types
+
+    Validated values are returned in order of keys, with strings stripped and empty strings mapped
+    to None for consistency (dynamodb also doesn't allow empty strings)
+
+    """
+
+    def __init__(self, types, required=(), nullable=()):
+        self.keys = (*required, *nullable)
+        self.key_set = frozenset(self.keys)
+        self.checks = tuple((key, (types[key], NoneType) if key in nullable else types[key])
+            for key in self.keys)
+
+    def validate(self, data):
+        """Return data's values in order of keys, raising InvalidMessage if not valid"""
+
+        # Don't allow extraneous or missing fields
+        # NOTE Only need to work out which if the keys given aren't exactly those expected
+        if len(data) != len(self.keys) or not self.key_set.issuperset(data):
+            extraneous = set(data) - self.key_set
+            if extraneous:
+                raise InvalidMessage(f"Unknown fields given: {', '.join(extraneous)}")
+            missing = next(key for key in self.keys if key not in data)
+            raise InvalidMessage(f"Missing '{missing}' field")
+
+        # Check types and normalise strings
+        validated = []
+        for key, valid_types in self.checks:
+            val = data[key]
+            if not isinstance(val, valid_types):
+                raise InvalidMessage(f"Invalid value for '{key}' field")
+            if isinstance(val, str):
+                val = val.strip() or None
+            validated.append(val)
+        return validated
+
+
+def compile_dispatch(handlers_class):
+    """Return {msg_type: (handler function, schema or None)} for every handler of a class"""
+    dispatch = {}
+    for name in dir(handlers_class):
+        if name.startswith('handle_'):
+            msg_type = name[len('handle_'):]
+            if msg_type not in MESSAGES:
+                raise Exception(f"No schema declared for '{msg_type}' messages")
+            fields = MESSAGES[msg_type]
+            dispatch[msg_type] = (getattr(handlers_class, name),
+                fields and Schema(FIELD_TYPES, *fields))
+    return dispatch
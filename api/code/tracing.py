@@ -0,0 +1,145 @@
+
+# Tracing of the requests each invocation makes to AWS (DynamoDB, sockets and SNS)
+# NOTE When TRACE_IO is enabled, one line is logged per invocation in CloudWatch's embedded metric
+#      format, so CloudWatch extracts metrics from the log without any extra requests being made
+#      The line also includes which calls were made, so can query it with Logs Insights
+#      See https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+# NOTE Requests are timed via botocore's events, so include serializing, retries and parsing
+#      before-parameter-build is the first event of a request and after-call the last
+
+
+import os
+import json
+import threading
+from time import time, perf_counter
+
+from resources import TRACE_IO
+
+
+# Trace of the invocation each thread is handling (if enabled)
+# NOTE Lambda containers only handle one invocation at a time, but the self-hosted server handles
+#      many at once in a pool of threads (see server/server.py). Threads making requests for an
+#      invocation are given its trace (see fanout.py)
+_local = threading.local()
+
+# Tags that are also reported as metrics when present
+METRIC_TAGS = ('evicted',)
+
+
+class Trace:
+    """The requests made by an invocation"""
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.lock = threading.Lock()
+        self.tags = {}
+        self.calls = {}  # Count per call (e.g. 'dynamodb.GetItem')
+        self.seconds = {}  # Total time per call
+        self.slowest = None  # (seconds, call)
+
+    def record(self, call, seconds):
+        with self.lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+            self.seconds[call] = self.seconds.get(call, 0) + seconds
+            if not self.slowest or seconds > self.slowest[0]:
+                self.slowest = (seconds, call)
+
+    def tag_max(self, name, value):
+        """Set a tag to the given value if larger than its existing value"""
+        with self.lock:
+            self.tags[name] = max(value, self.tags.get(name, value))
+
+    def log_line(self):
+        """Return the trace as a line in embedded metric format"""
+        with self.lock:
+            io_time = sum(self.seconds.values())
+            metrics = [
+                {'Name': 'duration', 'Unit': 'Milliseconds'},
+                {'Name': 'io_time', 'Unit': 'Milliseconds'},
+                {'Name': 'io_calls', 'Unit': 'Count'},
+            ]
+            extra = {}
+            # Counts only some handlers report (e.g. clients evicted when deleting a room)
+            for name in METRIC_TAGS:
+                if name in self.tags:
+                    metrics.append({'Name': name, 'Unit': 'Count'})
+                    extra[name] = self.tags[name]
+            return json.dumps({
+                '_aws': {
+                    'Timestamp': int(time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': os.environ.get('STACK', 'selah'),
+                        'Dimensions': [['handler']],
+                        'Metrics': metrics,
+                    }],
+                },
+                'handler': self.tags.get('handler', 'unknown'),
+                'room_size': self.tags.get('room_size', 0),
+                'duration': round((perf_counter() - self.start) * 1000, 3),
+                'io_time': round(io_time * 1000, 3),
+                'io_calls': sum(self.calls.values()),
+                **extra,
+                'slowest': self.slowest and {
+                    'call': self.slowest[1],
+                    'ms': round(self.slowest[0] * 1000, 3),
+                },
+                'calls': self.calls,
+                'ms': {call: round(seconds * 1000, 3) for call, seconds in self.seconds.items()},
+            })
+
+
+def current_trace():
+    """Return the trace of the invocation the thread is handling (None if disabled)"""
+    return getattr(_local, 'trace', None)
+
+
+def set_trace(trace):
+    """Have the thread's requests recorded in the given trace (e.g. another thread's)"""
+    _local.trace = trace
+
+
+def start_trace():
+    """Start tracing a new invocation and return its trace (None if disabled)"""
+    set_trace(Trace() if TRACE_IO else None)
+    return current_trace()
+
+
+def end_trace():
+    """Log the current invocation's trace (if any) and stop tracing"""
+    trace = current_trace()
+    set_trace(None)
+    if trace:
+        print(trace.log_line())
+
+
+def tag(**tags):
+    """Tag the current invocation's trace (if any)"""
+    trace = current_trace()
+    if trace:
+        with trace.lock:
+            trace.tags.update(tags)
+
+
+def tag_max(name, value):
+    """Tag the current invocation's trace (if any) with the largest of the values given"""
+    trace = current_trace()
+    if trace:
+        trace.tag_max(name, value)
+
+
+def _request_started(context, **kwargs):
+    context['trace_start'] = perf_counter()
+
+
+def _request_finished(event_name, context, **kwargs):
+    trace = current_trace()
+    if trace and 'trace_start' in context:
+        # Event names are e.g. 'after-call.dynamodb.GetItem'
+        trace.record(event_name.split('.', 1)[1], perf_counter() - context['trace_start'])
+
+
+def instrument(client):
+    """Time every request made by a boto3 client (see `resources._instrument`)"""
+    client.meta.events.register('before-parameter-build', _request_started)
+    client.meta.events.register('after-call', _request_finished)
+    client.meta.events.register('after-call-error', _request_finished)
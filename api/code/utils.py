@@ -1,35 +1,47 @@
 
-from decimal import Decimal
+# Max bytes API Gateway allows in a message posted to a socket
+# See https://docs.aws.amazon.com/apigateway/latest/developerguide/limits.html
+MAX_FRAME_SIZE = 128 * 1024
 
-from boto3.dynamodb.types import DYNAMODB_CONTEXT, TypeSerializer, TypeDeserializer
 
+def merge_room_clients_diffs(diffs):
+    """Merge diffs of a room's clients list so there is only one per socket
 
-def add_support_for_floats_to_dynamodb():
-    """Convert to/from Decimal when working with DynamoDB (which only accepts Decimals for numbers)
-
-    WARN There may be a loss of precision but it is assumed to not affect our use-case
+    Diffs are merged in the order given, keeping the position of each socket's first diff:
+        joined/changed + changed = same change with fields merged
+        any + joined = joined (rejoined)
+        any + left = left
+        left + changed = left (change no longer relevant)
 
     """
+    merged = {}
+    for diff in diffs:
+        prev = merged.get(diff['socket'])
+        if prev and diff['change'] == 'changed':
+            if prev['change'] != 'left':
+                merged[diff['socket']] = {**prev, 'fields': {**prev['fields'], **diff['fields']}}
+        else:
+            merged[diff['socket']] = diff
+    return list(merged.values())
 
-    # Ignore loss of precision rather than raising exception
-    DYNAMODB_CONTEXT.clear_traps()
-
-    # Keep a reference to the original serialization methods
-    boto3_serialize_orig = TypeSerializer.serialize
-    boto3_deserialize_orig = TypeDeserializer.deserialize
 
-    # Wrap serialization methods to support floats
-    def boto3_serialize(self, value):
-        if isinstance(value, float):
-            value = Decimal(value)
-        return boto3_serialize_orig(self, value)
+def pack_frames(messages):
+    """Merge JSON encoded messages into as few frames as possible (within MAX_FRAME_SIZE)
 
-    def boto3_deserialize(self, value):
-        value = boto3_deserialize_orig(self, value)
-        if isinstance(value, Decimal):
-            value = float(value)
-        return value
+    A frame with a single message is just the message, while multiple are sent as a JSON array
+    (which the client unpacks). Order is preserved.
 
-    # Replace the serialization methods with wrapped versions
-    TypeSerializer.serialize = boto3_serialize
-    TypeDeserializer.deserialize = boto3_deserialize
+    """
+    frames = []
+    batch = []
+    size = 1  # Array brackets and commas add one byte per message plus one
+    for message in messages:
+        if batch and size + len(message) + 1 > MAX_FRAME_SIZE:
+            frames.append(batch[0] if len(batch) == 1 else b'[' + b','.join(batch) + b']')
+            batch = []
+            size = 1
+        batch.append(message)
+        size += len(message) + 1
+    if batch:
+        frames.append(batch[0] if len(batch) == 1 else b'[' + b','.join(batch) + b']')
+    return frames
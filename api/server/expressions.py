@@ -0,0 +1,479 @@
+
+# DynamoDB's values, errors and expressions, evaluated in process
+# NOTE Shared by the local store the server keeps tables in (see local.py) and the memory backend
+#      benchmarks use (see bench/memory.py), so both apply conditions and updates as DynamoDB does
+# NOTE Stored items are never modified in place, updates return a new item that shares whatever
+#      the update didn't change with the old one (so items can be read without copying them)
+
+
+import re
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+
+
+# VALUES
+
+
+MISSING = object()  # An attribute that doesn't exist (distinct from None which is NULL)
+
+
+def normalize(value):
+    """Return a copy of a value as it would be after a round trip through DynamoDB
+
+    NOTE All numbers come back as floats (see dynamo.py)
+
+    """
+    if isinstance(value, bool) or value is None or isinstance(value, (str, bytes)):
+        return value
+    if isinstance(value, (int, float, Decimal)):
+        return float(value)
+    if isinstance(value, dict):
+        return {key: normalize(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(val) for val in value]
+    if isinstance(value, (set, frozenset)):
+        return {normalize(val) for val in value}
+    raise TypeError(f"Unsupported type for DynamoDB: {type(value)}")
+
+
+def _size(value):
+    """Approximate size of a value in bytes (by DynamoDB's rules)"""
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, float):
+        return len(repr(value).replace('.', '').replace('-', '')) // 2 + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(key) + 1 + _size(val) for key, val in value.items())
+    return 3 + sum(1 + _size(val) for val in value)
+
+
+def item_size(item):
+    """Approximate size of an item in bytes (by DynamoDB's rules)"""
+    return sum(len(key) + _size(val) for key, val in item.items())
+
+
+# ERRORS
+
+
+def error(cls, code, message, operation):
+    return cls({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class ConditionalCheckFailedException(ClientError):
+    pass
+
+
+class TransactionCanceledException(ClientError):
+    pass
+
+
+class ValidationException(ClientError):
+    pass
+
+
+class DynamoExceptions:
+    ConditionalCheckFailedException = ConditionalCheckFailedException
+    TransactionCanceledException = TransactionCanceledException
+    ValidationException = ValidationException
+
+
+# EXPRESSIONS
+
+
+_TOKEN = re.compile(r'\s*(?:(#\w+)|(:\w+)|([A-Za-z_]\w*)|(\d+)|(<>|<=|>=|[=<>(),.\[\]+-]))')
+
+
+class Parser:
+    """Parses condition/update expressions into functions of an item
+
+    Placeholders are resolved when parsing, so functions only need the item they apply to
+
+    """
+
+    def __init__(self, expression, names, values):
+        self.names = names or {}
+        self.values = values or {}
+        self.tokens = []
+        self.pos = 0
+        expression = expression.strip()
+        index = 0
+        while index < len(expression):
+            match = _TOKEN.match(expression, index)
+            if not match or match.end() == index:
+                raise ValueError(f"Invalid expression: {expression}")
+            self.tokens.append(next(group for group in match.groups() if group is not None))
+            index = match.end()
+            while index < len(expression) and expression[index].isspace():
+                index += 1
+
+    def peek(self, upper=False):
+        token = self.tokens[self.pos] if self.pos < len(self.tokens) else None
+        return token.upper() if upper and token else token
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected and token.upper() != expected):
+            raise ValueError(f"Expected {expected or 'more'} but got {token}")
+        self.pos += 1
+        return token
+
+    def done(self):
+        return self.pos >= len(self.tokens)
+
+    def equal_to(self, name):
+        """Return the value the expression requires an attribute to equal (or MISSING)
+
+        NOTE Used to find which partition a key condition is of (e.g. `room_id=:room_id`)
+
+        """
+        for index, token in enumerate(self.tokens[:-2]):
+            if self.names.get(token, token) == name and self.tokens[index + 1] == '=' \
+                    and self.tokens[index + 2] in self.values:
+                return normalize(self.values[self.tokens[index + 2]])
+        return MISSING
+
+    # Operands
+
+    def path(self):
+        """Parse a document path into a list of keys and indexes"""
+        path = [self.element()]
+        while self.peek() in ('.', '['):
+            if self.take() == '.':
+                path.append(self.element())
+            else:
+                path.append(int(self.take()))
+                self.take(']')
+        return path
+
+    def element(self):
+        token = self.take()
+        if token.startswith('#'):
+            if token not in self.names:
+                raise ValueError(f"Name placeholder not provided: {token}")
+            return self.names[token]
+        return token
+
+    def value(self):
+        token = self.take()
+        if token not in self.values:
+            raise ValueError(f"Value placeholder not provided: {token}")
+        value = normalize(self.values[token])
+        return lambda item: value
+
+    def operand(self):
+        token = self.peek()
+        if token.startswith(':'):
+            return self.value()
+        lower = token.lower()
+        if lower in ('size', 'if_not_exists', 'list_append') and self.tokens[self.pos+1] == '(':
+            self.take()
+            self.take('(')
+            if lower == 'size':
+                path = self.path()
+                self.take(')')
+                return lambda item: _size_of(_get(item, path))
+            if lower == 'if_not_exists':
+                path = self.path()
+                self.take(',')
+                default = self.update_value()
+                self.take(')')
+                return lambda item: _if_not_exists(_get(item, path), default(item))
+            first = self.update_value()
+            self.take(',')
+            second = self.update_value()
+            self.take(')')
+            return lambda item: _list_append(first(item), second(item))
+        path = self.path()
+        return lambda item: _get(item, path)
+
+    def update_value(self):
+        left = self.operand()
+        if self.peek() in ('+', '-'):
+            op = self.take()
+            right = self.operand()
+            return lambda item: _arithmetic(left(item), op, right(item))
+        return left
+
+    # Conditions
+
+    def condition(self):
+        left = self.conjunction()
+        while self.peek(True) == 'OR':
+            self.take()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, self.conjunction())
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.peek(True) == 'AND':
+            self.take()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, self.negation())
+        return left
+
+    def negation(self):
+        if self.peek(True) == 'NOT':
+            self.take()
+            inner = self.negation()
+            return lambda item: not inner(item)
+        return self.comparison()
+
+    def comparison(self):
+        token = self.peek()
+        if token == '(':
+            self.take()
+            inner = self.condition()
+            self.take(')')
+            return inner
+        lower = token.lower()
+        if lower in ('attribute_exists', 'attribute_not_exists', 'begins_with', 'contains',
+                'attribute_type'):
+            self.take()
+            self.take('(')
+            path = self.path()
+            arg = None
+            if lower != 'attribute_exists' and lower != 'attribute_not_exists':
+                self.take(',')
+                arg = self.operand()
+            self.take(')')
+            if lower == 'attribute_exists':
+                return lambda item: _get(item, path) is not MISSING
+            if lower == 'attribute_not_exists':
+                return lambda item: _get(item, path) is MISSING
+            if lower == 'begins_with':
+                return lambda item: _begins_with(_get(item, path), arg(item))
+            if lower == 'contains':
+                return lambda item: _contains(_get(item, path), arg(item))
+            return lambda item: _type_of(_get(item, path)) == arg(item)
+        left = self.operand()
+        op = self.take().upper()
+        if op == 'BETWEEN':
+            low = self.operand()
+            self.take('AND')
+            high = self.operand()
+            return lambda item: _compare(left(item), '>=', low(item)) \
+                and _compare(left(item), '<=', high(item))
+        if op == 'IN':
+            self.take('(')
+            options = [self.operand()]
+            while self.peek() == ',':
+                self.take()
+                options.append(self.operand())
+            self.take(')')
+            return lambda item: any(_compare(left(item), '=', opt(item)) for opt in options)
+        right = self.operand()
+        return lambda item: _compare(left(item), op, right(item))
+
+    # Updates
+
+    def update(self):
+        """Parse an update expression into a list of (action, path, value function)"""
+        actions = []
+        while not self.done():
+            clause = self.take().upper()
+            while True:
+                path = self.path()
+                if clause == 'SET':
+                    self.take('=')
+                    actions.append(('SET', path, self.update_value()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', path, None))
+                elif clause in ('ADD', 'DELETE'):
+                    actions.append((clause, path, self.value()))
+                else:
+                    raise ValueError(f"Invalid update clause: {clause}")
+                if self.peek() != ',':
+                    break
+                self.take()
+        return actions
+
+
+def _get(item, path):
+    value = item
+    for key in path:
+        if isinstance(key, int):
+            if not isinstance(value, list) or key >= len(value):
+                return MISSING
+        elif not isinstance(value, dict) or key not in value:
+            return MISSING
+        value = value[key]
+    return value
+
+
+def _size_of(value):
+    if isinstance(value, (str, bytes)):
+        return float(len(value.encode('utf-8') if isinstance(value, str) else value))
+    if isinstance(value, (list, dict, set)):
+        return float(len(value))
+    return MISSING
+
+
+def _if_not_exists(value, default):
+    return default if value is MISSING else value
+
+
+def _list_append(first, second):
+    if not isinstance(first, list) or not isinstance(second, list):
+        raise ValueError("list_append requires lists")
+    return first + second
+
+
+def _arithmetic(left, op, right):
+    if not isinstance(left, float) or not isinstance(right, float):
+        raise ValueError("Arithmetic requires numbers")
+    return left + right if op == '+' else left - right
+
+
+def _compare(left, op, right):
+    if left is MISSING or right is MISSING:
+        return False
+    if op == '=':
+        return left == right and type(left) == type(right)
+    if op == '<>':
+        return not (left == right and type(left) == type(right))
+    if type(left) != type(right) or not isinstance(left, (float, str, bytes)):
+        return False
+    return {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[op]
+
+
+def _begins_with(value, prefix):
+    return isinstance(value, (str, bytes)) and type(value) == type(prefix) \
+        and value.startswith(prefix)
+
+
+def _contains(value, part):
+    if isinstance(value, str):
+        return isinstance(part, str) and part in value
+    return isinstance(value, (list, set)) and part in value
+
+
+def _type_of(value):
+    types = ((bool, 'BOOL'), (type(None), 'NULL'), (str, 'S'), (bytes, 'B'), (float, 'N'),
+        (dict, 'M'), (list, 'L'))
+    return next((code for cls, code in types if isinstance(value, cls)), MISSING)
+
+
+def build_expression(expression, names, values, *, is_key_condition=False):
+    """Return expression as a string, converting condition objects and adding their placeholders"""
+    if not isinstance(expression, ConditionBase):
+        return expression, names, values
+    built = ConditionExpressionBuilder().build_expression(expression,
+        is_key_condition=is_key_condition)
+    # NOTE Builder's placeholders (#n0, :v0) won't clash with those used by handlers
+    return (built.condition_expression, {**(names or {}), **built.attribute_name_placeholders},
+        {**(values or {}), **built.attribute_value_placeholders})
+
+
+def check_condition(expression, names, values, item, operation):
+    if expression is None:
+        return True
+    expression, names, values = build_expression(expression, names, values)
+    parser = Parser(expression, names, values)
+    condition = parser.condition()
+    if not parser.done():
+        raise error(ValidationException, 'ValidationException',
+            f"Invalid ConditionExpression: {expression}", operation)
+    return condition(item if item is not None else {})
+
+
+def apply_update(item, expression, names, values, key_names, operation):
+    """Return a new item with the update applied and the top-level attributes updated"""
+    actions = Parser(expression, names, values).update()
+
+    # Paths may not overlap (e.g. setting a map and a key within it)
+    paths = [path for action, path, value in actions]
+    for index, path in enumerate(paths):
+        for other in paths[index+1:]:
+            if path[:len(other)] == other or other[:len(path)] == path:
+                raise error(ValidationException, 'ValidationException',
+                    "Two document paths overlap with each other", operation)
+        if path[0] in key_names:
+            raise error(ValidationException, 'ValidationException',
+                f"Cannot update attribute {path[0]} as it is part of the key", operation)
+
+    # Evaluate all values against the item before any changes (as DynamoDB does)
+    try:
+        evaluated = [(action, path, value(item) if value else None)
+            for action, path, value in actions]
+    except ValueError as exc:
+        raise error(ValidationException, 'ValidationException', str(exc), operation)
+
+    # Remove list elements last and from the end, as indexes refer to the list before the update
+    removes = sorted((action for action in evaluated
+        if action[0] == 'REMOVE' and isinstance(action[1][-1], int)),
+        key=lambda action: action[1][-1], reverse=True)
+    evaluated = [action for action in evaluated if action not in removes] + removes
+
+    # Only copy the item and the maps/lists updated within it (the rest is shared with the item)
+    new = dict(item)
+    copied = {id(new)}
+    for action, path, value in evaluated:
+        if value is MISSING:
+            raise error(ValidationException, 'ValidationException',
+                "The provided expression refers to an attribute that does not exist in the item",
+                operation)
+        parent = _copy_path(new, path[:-1], copied)
+        last = path[-1]
+        if parent is MISSING or not isinstance(parent, (dict, list)) \
+                or isinstance(last, int) != isinstance(parent, list):
+            raise error(ValidationException, 'ValidationException',
+                "The document path provided in the update expression is invalid for update",
+                operation)
+        if action == 'SET':
+            if isinstance(parent, list) and last >= len(parent):
+                parent.append(value)
+            else:
+                parent[last] = value
+        elif action == 'REMOVE':
+            if isinstance(parent, list):
+                if last < len(parent):
+                    del parent[last]
+            else:
+                parent.pop(last, None)
+        elif action == 'ADD':
+            current = parent.get(last, MISSING) if isinstance(parent, dict) else MISSING
+            if isinstance(value, float):
+                parent[last] = (0.0 if current is MISSING else current) + value
+            else:
+                parent[last] = (set() if current is MISSING else current) | value
+        else:  # DELETE
+            current = parent.get(last, MISSING)
+            if current is not MISSING:
+                parent[last] = current - value
+                if not parent[last]:
+                    del parent[last]
+    return new, {path[0] for path in paths}
+
+
+def _copy_path(item, path, copied):
+    """Return the value at path, copying it and the maps/lists it's within (unless already copied)
+
+    NOTE So changing it doesn't change the item the update is applied to (see `apply_update`)
+
+    """
+    value = item
+    for key in path:
+        parent = value
+        value = _get(parent, [key])
+        if isinstance(value, (dict, list)) and id(value) not in copied:
+            value = type(value)(value)
+            copied.add(id(value))
+            parent[key] = value
+        elif value is MISSING:
+            return MISSING
+    return value
+
+
+def project(item, projection, names):
+    """Return only the attributes of an item in the projection expression (top-level only)"""
+    if not projection:
+        return item
+    attributes = [names.get(name.strip(), name.strip()) if name.strip().startswith('#')
+        else name.strip() for name in projection.split(',')]
+    return {key: item[key] for key in attributes if key in item}
+
@@ -0,0 +1,670 @@
+
+# Services the self-hosted server runs the handlers with, in place of AWS's (see server.py)
+# NOTE Used when BACKEND=local (see resources.py). Tables are kept in process memory and behave
+#      like DynamoDB's for everything the handlers use (conditions, return values, indexes,
+#      transactions, TTL and errors), posts are sent to the server's websockets, messages published
+#      are logged, and queued messages are kept until the server applies them
+# NOTE Made for many invocations at once: writes only lock the partition written (e.g. a room, or
+#      a room's media) and reads of single items don't lock at all. Stored items are never
+#      modified, only replaced (see expressions.py), so they're shared rather than copied
+# WARN All data is lost when the server stops, and only the server's own process can access it
+
+
+import heapq
+import threading
+from time import time, monotonic
+from types import SimpleNamespace
+from uuid import uuid4
+from functools import wraps
+from operator import itemgetter
+from itertools import count
+from collections import deque
+
+from botocore.exceptions import ClientError
+
+from expressions import (MISSING, normalize, error, ConditionalCheckFailedException,
+    TransactionCanceledException, ValidationException, DynamoExceptions, Parser, build_expression,
+    check_condition, apply_update, project)
+
+
+# Schemas of tables (same as in template.yaml) by name without stack prefix
+TABLES = {
+    'rooms': {'hash': 'id', 'range': None, 'ttl': 'expire', 'indexes': {}},
+    'media': {'hash': 'room_id', 'range': 'id', 'ttl': 'expire', 'indexes': {}},
+    'clients': {'hash': 'socket', 'range': None, 'ttl': 'expire', 'indexes': {
+        'by_room': {'hash': 'room_id', 'range': 'room_joined', 'include': None},  # ALL
+        'by_room_lean': {'hash': 'room_id', 'range': 'room_joined',
+            'include': ('name', 'room_admin', 'room_synced')},
+    }},
+    'rosters': {'hash': 'room_id', 'range': None, 'ttl': 'expire', 'indexes': {}},
+    'payments': {'hash': 'email', 'range': None, 'ttl': 'expire', 'indexes': {}},
+}
+
+# Locks per table (and per index), each partition using the one its key hashes to
+# NOTE Far more than the threads writing at once, so partitions rarely wait on others'
+LOCK_STRIPES = 256
+
+# Limits that DynamoDB enforces (and handlers are written to respect)
+MAX_TRANSACT_ITEMS = 100
+MAX_BATCH_GET_KEYS = 100
+
+# Seconds that SQS ignores messages sent with a deduplication id already sent
+QUEUE_DEDUP_INTERVAL = 5 * 60
+
+
+# ERRORS
+
+
+class GoneException(ClientError):
+    pass
+
+
+class SocketsExceptions:
+    GoneException = GoneException
+
+
+# EVENTS
+
+
+class Events:
+    """Minimal version of botocore's event emitter (so handlers can be registered the same way)
+
+    Like botocore, handlers registered for 'a.b' are also called for 'a.b.c' events
+
+    """
+
+    def __init__(self):
+        self.handlers = []
+
+    def register(self, event_name, handler):
+        self.handlers.append((event_name, handler))
+
+    def emit(self, event_name, **kwargs):
+        for name, handler in self.handlers:
+            if event_name == name or event_name.startswith(name + '.'):
+                handler(event_name=event_name, **kwargs)
+
+
+def _operation(service_id, name):
+    """Decorate a method as a request to a service
+
+    Emits the events botocore does when starting and finishing a request, so requests can be
+    traced the same way (see tracing.py)
+
+    """
+    operation = ''.join(word.title() for word in name.split('_'))
+    def decorator(method):
+        @wraps(method)
+        def wrapped(self, *args, **kwargs):
+            events = getattr(self, 'database', self).events
+            if not events.handlers:
+                return method(self, *args, **kwargs)
+            context = {}
+            events.emit(f'before-parameter-build.{service_id}.{operation}', params=kwargs,
+                model=None, context=context)
+            parsed = None
+            try:
+                parsed = method(self, *args, **kwargs)
+                return parsed
+            finally:
+                events.emit(f'after-call.{service_id}.{operation}', http_response=None,
+                    parsed=parsed, model=None, context=context)
+        return wrapped
+    return decorator
+
+
+# DYNAMODB
+
+
+def _copy(item, projection=None, names=None):
+    """Return a copy of a stored item to give the caller (only of the attributes projected)
+
+    NOTE Only the top level is copied, as handlers never modify maps or lists within records
+
+    """
+    return project(item, projection, names or {}) if projection else dict(item)
+
+
+class LocalDatabase:
+    """Tables kept in process memory, with the interface of boto3's DynamoDB resource
+
+    Tables are created when first accessed, using their schema in TABLES
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.events = Events()
+        self.meta = SimpleNamespace(client=LocalDatabaseClient(self))
+
+    def Table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            with self.lock:
+                table = self.tables.get(name)
+                if table is None:
+                    table = LocalTable(self, name, TABLES[name.rsplit('-', 1)[-1]])
+                    self.tables[name] = table
+        return table
+
+    @_operation('dynamodb', 'batch_get_item')
+    def batch_get_item(self, RequestItems):
+        """Get items from multiple tables by key (all are processed)"""
+        if sum(len(request['Keys']) for request in RequestItems.values()) > MAX_BATCH_GET_KEYS:
+            raise error(ValidationException, 'ValidationException', "Too many items requested",
+                'BatchGetItem')
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            items = (table.item(table.key_of(normalize(key))) for key in request['Keys'])
+            responses[name] = [_copy(item, request.get('ProjectionExpression'),
+                request.get('ExpressionAttributeNames')) for item in items if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def sweep(self, now=None):
+        """Delete all expired items (as DynamoDB's TTL does eventually) and return how many"""
+        return sum(table.sweep(now) for table in list(self.tables.values()))
+
+
+class LocalDatabaseClient:
+    """The low-level client of the local tables (only what's used via `db.meta.client`)"""
+
+    exceptions = DynamoExceptions
+
+    def __init__(self, database):
+        self.database = database
+        self.meta = SimpleNamespace(events=database.events)
+
+    @_operation('dynamodb', 'transact_write_items')
+    def transact_write_items(self, TransactItems, **kwargs):
+        """Apply all writes or none (if any condition fails)"""
+        operation = 'TransactWriteItems'
+        if len(TransactItems) > MAX_TRANSACT_ITEMS:
+            raise error(ValidationException, 'ValidationException',
+                "Too many items in transaction", operation)
+
+        targets = []
+        for transact_item in TransactItems:
+            (kind, params), = transact_item.items()
+            table = self.database.Table(params['TableName'])
+            key = table.key_of(normalize(params['Item'] if kind == 'Put' else params['Key']))
+            if any(other is table and other_key == key for _, _, other, other_key in targets):
+                raise error(ValidationException, 'ValidationException',
+                    "Transaction cannot include multiple operations on one item", operation)
+            targets.append((kind, params, table, key))
+
+        # Lock every partition written, always in the same order so transactions can't deadlock
+        locks = sorted({(table.name, table.stripe(key)): table.locks[table.stripe(key)]
+            for _, _, table, key in targets}.items())
+        for _, lock in locks:
+            lock.acquire()
+        try:
+            # Determine the result of every write before applying any
+            writes = []
+            reasons = []
+            for kind, params, table, key in targets:
+                old = table.item(key)
+                ok = check_condition(params.get('ConditionExpression'),
+                    params.get('ExpressionAttributeNames'),
+                    params.get('ExpressionAttributeValues'), old, operation)
+                reasons.append({'Code': 'None' if ok else 'ConditionalCheckFailed'})
+                if kind == 'Put':
+                    new = table.validate(normalize(params['Item']), operation)
+                elif kind == 'Update':
+                    new, updated = apply_update(old or table.key_item(key),
+                        params['UpdateExpression'], params.get('ExpressionAttributeNames'),
+                        params.get('ExpressionAttributeValues'), table.key_names, operation)
+                    new = table.validate(new, operation)
+                elif kind == 'Delete':
+                    new = None
+                else:  # ConditionCheck
+                    new = old
+                writes.append((table, key, new))
+
+            if any(reason['Code'] != 'None' for reason in reasons):
+                exc = error(TransactionCanceledException, 'TransactionCanceledException',
+                    "Transaction cancelled", operation)
+                exc.response['CancellationReasons'] = reasons
+                raise exc
+
+            for table, key, new in writes:
+                table.store(key, new)
+        finally:
+            for _, lock in reversed(locks):
+                lock.release()
+        return {}
+
+
+class LocalTable:
+    """A table kept in process memory, with the interface of boto3's Table resource
+
+    Items are kept by partition (their partition key's value), as are those of each index, so
+    queries only read their partition
+
+    """
+
+    def __init__(self, database, name, schema):
+        self.database = database
+        self.name = name
+        self.schema = schema
+        self.key_names = [key for key in (schema['hash'], schema['range']) if key]
+        self.partitions = {}  # Partition key value -> {key tuple: item}
+        self.indexes = {index: {} for index in schema['indexes']}  # Name -> like partitions
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        # NOTE Only held while changing or copying an index's partition (never with another)
+        self.index_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def key_of(self, item):
+        return tuple(item[key] for key in self.key_names)
+
+    def key_item(self, key):
+        """Return an item of only the given key tuple (what updates of a new item start from)"""
+        return dict(zip(self.key_names, key))
+
+    def stripe(self, key):
+        """Return which lock the partition of a key tuple uses"""
+        return hash(key[0]) % LOCK_STRIPES
+
+    def item(self, key):
+        """Return the item with the given key tuple (None if doesn't exist)
+
+        WARN Stored as is, so must be copied before given to callers (see `_copy`)
+
+        """
+        partition = self.partitions.get(key[0])
+        return partition.get(key) if partition else None
+
+    def store(self, key, new):
+        """Replace the item with the given key tuple (or remove it if None), and update indexes
+
+        WARN The partition's lock must be held
+
+        """
+        partition = self.partitions.get(key[0])
+        old = partition.get(key) if partition else None
+        if new is not None:
+            if partition is None:
+                partition = self.partitions[key[0]] = {}
+            partition[key] = new
+        elif old is not None:
+            del partition[key]
+            if not partition:
+                del self.partitions[key[0]]
+
+        # Items without an index's keys aren't in it
+        for name, schema in self.schema['indexes'].items():
+            index = self.indexes[name]
+            before, after = (item[schema['hash']] if item and schema['hash'] in item
+                and schema['range'] in item else None for item in (old, new))
+            if before is not None and before != after:
+                with self.index_locks[hash(before) % LOCK_STRIPES]:
+                    del index[before][key]
+                    if not index[before]:
+                        del index[before]
+            if after is not None:
+                with self.index_locks[hash(after) % LOCK_STRIPES]:
+                    index.setdefault(after, {})[key] = new
+
+    def validate(self, item, operation):
+        """Return item if it can be stored, otherwise raise a validation error
+
+        NOTE Item size isn't limited, as items aren't sent anywhere
+
+        """
+        for key in self.key_names:
+            if not isinstance(item.get(key), (str, float, bytes)) or item[key] == '':
+                raise error(ValidationException, 'ValidationException',
+                    f"Invalid value for key attribute {key}", operation)
+        return item
+
+    def _conditional_write(self, operation, key, ConditionExpression, ExpressionAttributeNames,
+            ExpressionAttributeValues, make_new):
+        """Replace an item with `make_new(old)` if the condition holds, returning both"""
+        with self.locks[self.stripe(key)]:
+            old = self.item(key)
+            if not check_condition(ConditionExpression, ExpressionAttributeNames,
+                    ExpressionAttributeValues, old, operation):
+                raise error(ConditionalCheckFailedException, 'ConditionalCheckFailedException',
+                    "The conditional request failed", operation)
+            new = make_new(old)
+            self.store(key, new)
+        return old, new
+
+    @_operation('dynamodb', 'get_item')
+    def get_item(self, Key, ConsistentRead=False, ProjectionExpression=None,
+            ExpressionAttributeNames=None):
+        item = self.item(self.key_of(normalize(Key)))
+        if item is None:
+            return {}
+        return {'Item': _copy(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    @_operation('dynamodb', 'put_item')
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+            ExpressionAttributeValues=None, ReturnValues='NONE'):
+        item = self.validate(normalize(Item), 'PutItem')
+        old, _ = self._conditional_write('PutItem', self.key_of(item), ConditionExpression,
+            ExpressionAttributeNames, ExpressionAttributeValues, lambda old: item)
+        return {'Attributes': _copy(old)} if ReturnValues == 'ALL_OLD' and old else {}
+
+    @_operation('dynamodb', 'update_item')
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None,
+            ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues='NONE'):
+        key = self.key_of(normalize(Key))
+        updated = set()  # Top-level attributes updated
+
+        def update(old):
+            new, attributes = apply_update(old or self.key_item(key), UpdateExpression,
+                ExpressionAttributeNames, ExpressionAttributeValues, self.key_names, 'UpdateItem')
+            updated.update(attributes)
+            return self.validate(new, 'UpdateItem')
+        old, new = self._conditional_write('UpdateItem', key, ConditionExpression,
+            ExpressionAttributeNames, ExpressionAttributeValues, update)
+
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': _copy(new)}
+        if ReturnValues == 'ALL_OLD':
+            return {'Attributes': _copy(old)} if old else {}
+        if ReturnValues in ('UPDATED_NEW', 'UPDATED_OLD'):
+            source = new if ReturnValues == 'UPDATED_NEW' else (old or {})
+            attributes = {k: source[k] for k in updated if k in source}
+            return {'Attributes': attributes} if attributes else {}
+        return {}
+
+    @_operation('dynamodb', 'delete_item')
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+            ExpressionAttributeValues=None, ReturnValues='NONE'):
+        old, _ = self._conditional_write('DeleteItem', self.key_of(normalize(Key)),
+            ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+            lambda old: None)
+        return {'Attributes': _copy(old)} if ReturnValues == 'ALL_OLD' and old else {}
+
+    @_operation('dynamodb', 'query')
+    def query(self, KeyConditionExpression, IndexName=None, **kwargs):
+        if IndexName and kwargs.get('ConsistentRead'):
+            raise error(ValidationException, 'ValidationException',
+                "Consistent reads are not supported on global secondary indexes", 'Query')
+        expression, names, values = build_expression(KeyConditionExpression,
+            kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues'),
+            is_key_condition=True)
+        parser = Parser(expression, names, values)
+        condition = parser.condition()
+
+        # Only read the partition queried
+        schema = self.schema['indexes'][IndexName] if IndexName else self.schema
+        value = parser.equal_to(schema['hash'])
+        if value is MISSING:
+            raise error(ValidationException, 'ValidationException',
+                "Query condition missed key schema element", 'Query')
+        if IndexName:
+            partitions, locks = self.indexes[IndexName], self.index_locks
+        else:
+            partitions, locks = self.partitions, self.locks
+        with locks[hash(value) % LOCK_STRIPES]:
+            items = list(partitions.get(value, {}).values())
+        return self._read([item for item in items if condition(item)], IndexName, **kwargs)
+
+    @_operation('dynamodb', 'scan')
+    def scan(self, IndexName=None, **kwargs):
+        if IndexName:
+            partitions, locks = self.indexes[IndexName], self.index_locks
+        else:
+            partitions, locks = self.partitions, self.locks
+        items = []
+        for value in list(partitions):
+            with locks[hash(value) % LOCK_STRIPES]:
+                items.extend(partitions.get(value, {}).values())
+        return self._read(items, IndexName, **kwargs)
+
+    def _read(self, items, index_name, *, ExpressionAttributeNames=None,
+            ExpressionAttributeValues=None, ProjectionExpression=None, FilterExpression=None,
+            ExclusiveStartKey=None, Limit=None, ConsistentRead=False, ScanIndexForward=True):
+        """Return a page of the items read (in key order)
+
+        NOTE Pages aren't limited by size as nothing is sent over a network, so all items are
+             returned at once unless a Limit is given
+
+        """
+
+        # Determine keys to order by (index items also include table's keys)
+        schema = self.schema['indexes'][index_name] if index_name else self.schema
+        index_keys = [key for key in (schema['hash'], schema['range']) if key]
+        order = itemgetter(*index_keys[1:], *self.key_names)
+        items.sort(key=order, reverse=not ScanIndexForward)
+
+        # Continue from end of last page
+        if ExclusiveStartKey:
+            start = order(normalize(ExclusiveStartKey))
+            items = [item for item in items
+                if (order(item) > start if ScanIndexForward else order(item) < start)]
+
+        # Read a page (limited by number of items if given) before filtering
+        resp = {}
+        if Limit and len(items) > Limit:
+            items = items[:Limit]
+            resp['LastEvaluatedKey'] = {key: items[-1][key]
+                for key in {*index_keys, *self.key_names}}
+        resp['ScannedCount'] = len(items)
+
+        # Filter and project (index only has projected attributes)
+        if FilterExpression is not None:
+            expression, names, values = build_expression(FilterExpression,
+                ExpressionAttributeNames, ExpressionAttributeValues)
+            condition = Parser(expression, names, values).condition()
+            items = [item for item in items if condition(item)]
+        if index_name and schema['include'] is not None:
+            keep = {*index_keys, *self.key_names, *schema['include']}
+            items = [{key: val for key, val in item.items() if key in keep} for item in items]
+        resp['Items'] = [_copy(item, ProjectionExpression, ExpressionAttributeNames)
+            for item in items]
+        resp['Count'] = len(items)
+        return resp
+
+    @_operation('dynamodb', 'batch_write_item')
+    def batch_write_item(self, writes):
+        """Apply a batch of ('put', item) and ('delete', key) writes (see LocalBatchWriter)"""
+        for action, item in writes:
+            key = self.key_of(item)
+            with self.locks[self.stripe(key)]:
+                self.store(key, item if action == 'put' else None)
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return LocalBatchWriter(self)
+
+    def sweep(self, now=None):
+        """Delete expired items and return how many"""
+        now = time() if now is None else now
+        ttl = self.schema['ttl']
+        deleted = 0
+        for value in list(self.partitions):
+            with self.locks[hash(value) % LOCK_STRIPES]:
+                partition = self.partitions.get(value, {})
+                expired = [key for key, item in partition.items()
+                    if isinstance(item.get(ttl), float) and item[ttl] < now]
+                for key in expired:
+                    self.store(key, None)
+            deleted += len(expired)
+        return deleted
+
+
+class LocalBatchWriter:
+    """A table's batch writer (writes in batches of 25 when exiting or full)"""
+
+    def __init__(self, table):
+        self.table = table
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def put_item(self, Item):
+        self.pending.append(('put', self.table.validate(normalize(Item), 'BatchWriteItem')))
+        if len(self.pending) >= 25:
+            self.flush()
+
+    def delete_item(self, Key):
+        self.pending.append(('delete', normalize(Key)))
+        if len(self.pending) >= 25:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.table.batch_write_item(self.pending)
+        self.pending = []
+
+
+# SOCKETS
+
+
+class LocalSockets:
+    """Posts to the server's websockets, with the interface of the API Gateway management API client
+
+    The server connects each websocket with a function that sends whatever is posted to it
+
+    """
+
+    exceptions = SocketsExceptions
+
+    def __init__(self):
+        self.connections = {}  # Socket -> function sending data to it
+        self.events = Events()
+        self.meta = SimpleNamespace(events=self.events)
+
+    def connect(self, socket, send):
+        self.connections[socket] = send
+
+    def disconnect(self, socket):
+        self.connections.pop(socket, None)
+
+    @_operation('apigatewaymanagementapi', 'post_to_connection')
+    def post_to_connection(self, Data, ConnectionId):
+        send = self.connections.get(ConnectionId)
+        if send is None:
+            raise error(GoneException, 'GoneException', "Connection is gone", 'PostToConnection')
+        send(Data)
+        return {}
+
+
+# SNS
+
+
+class LocalSNS:
+    """Logs messages published (e.g. error reports), with the interface of the SNS client
+
+    NOTE There's nowhere else to send them, but the server's logs can be monitored instead
+
+    """
+
+    def __init__(self):
+        self.events = Events()
+        self.meta = SimpleNamespace(events=self.events)
+
+    @_operation('sns', 'publish')
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        print(Subject, Message, sep='\n', flush=True)
+        return {'MessageId': str(uuid4())}
+
+
+# SQS
+
+
+class LocalQueue:
+    """Keeps messages sent to each queue until taken, with the interface of the SQS client
+
+    Messages are taken in the order sent (once any delay has passed), in the format Lambda gives
+    them to functions, and those sent with a deduplication id already sent are ignored (as SQS
+    does for FIFO queues, see QUEUE_DEDUP_INTERVAL)
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = {}  # Queue URL -> deque of records
+        self.delayed = {}  # Queue URL -> heap of (when visible, order sent, record)
+        self.dedup_ids = {}  # Deduplication id -> when sent (oldest first)
+        self.order = count()
+        self.events = Events()
+        self.meta = SimpleNamespace(events=self.events)
+
+    @_operation('sqs', 'send_message')
+    def send_message(self, QueueUrl, MessageBody, MessageGroupId=None, MessageDeduplicationId=None,
+            DelaySeconds=0):
+        now = monotonic()
+        message_id = str(uuid4())
+        # NOTE Only messages of FIFO queues have a group
+        record = {
+            'messageId': message_id,
+            'body': MessageBody,
+            'attributes': {} if MessageGroupId is None else {'MessageGroupId': MessageGroupId},
+        }
+        with self.lock:
+            # Forget ids sent long enough ago (so a long running server doesn't keep them all)
+            while self.dedup_ids:
+                dedup_id, sent = next(iter(self.dedup_ids.items()))
+                if now - sent < QUEUE_DEDUP_INTERVAL:
+                    break
+                del self.dedup_ids[dedup_id]
+            if MessageDeduplicationId in self.dedup_ids:
+                return {'MessageId': None}
+            if MessageDeduplicationId:
+                self.dedup_ids[MessageDeduplicationId] = now
+            if DelaySeconds:
+                heapq.heappush(self.delayed.setdefault(QueueUrl, []),
+                    (now + DelaySeconds, next(self.order), record))
+            else:
+                self.ready.setdefault(QueueUrl, deque()).append(record)
+        return {'MessageId': message_id}
+
+    def take(self, queue_url, limit=10):
+        """Return (and remove) up to limit messages, as the records of a Lambda SQS event"""
+        now = monotonic()
+        with self.lock:
+            ready = self.ready.setdefault(queue_url, deque())
+            delayed = self.delayed.get(queue_url)
+            while delayed and delayed[0][0] <= now:
+                ready.append(heapq.heappop(delayed)[2])
+            return [ready.popleft() for _ in range(min(limit, len(ready)))]
+
+    def put_back(self, queue_url, records):
+        """Return records to the front of a queue (e.g. those that failed to be processed)"""
+        with self.lock:
+            self.ready.setdefault(queue_url, deque()).extendleft(reversed(records))
+
+
+# LAMBDA
+
+
+class LambdaContext:
+    """Stand-in for the Lambda context object (only what handlers use)"""
+
+    def __init__(self, timeout=30):
+        self.deadline = monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - monotonic()) * 1000))
+
+
+def make_event(socket, event_type='MESSAGE', body=None, domain='localhost', stage='local'):
+    """Return an event like those API Gateway gives the function for websockets"""
+    event = {
+        'requestContext': {
+            'connectionId': socket,
+            'domainName': domain,
+            'stage': stage,
+            'eventType': event_type,
+            'requestTimeEpoch': int(time() * 1000),
+        },
+    }
+    if body is not None:
+        event['body'] = body
+    return event
+
+
+# Services shared by all invocations (like AWS's are)
+database = LocalDatabase()
+sockets = LocalSockets()
+sns = LocalSNS()
+queue = LocalQueue()
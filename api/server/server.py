@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+""" Usage
+
+Self-hosted websocket server that runs the same handlers as the Lambda function, so the app can be
+served from our own machines without API Gateway and Lambda
+
+    python server.py
+
+Rooms, clients and payments are kept in process memory by the local store (see local.py), which
+locks only the partition written (e.g. a room) and shares items rather than copying them, so many
+events can be handled at once. Configured via SERVER_HOST, SERVER_PORT and SERVER_THREADS (see
+below), and the same environment variables as the function (see template.yaml). Requires the
+packages in requirements.txt (boto3 being built into Lambda) and those of the function (see
+code/requirements.txt)
+
+WARN All state is lost when the server stops (clients then reconnect to empty rooms), and rooms
+can't be shared by multiple servers, so scale by giving each server its own rooms (e.g. by domain)
+
+The local sockets are given a function for each connection that sends to that connection's
+websocket, so handlers post to sockets and read and write tables exactly as they do on AWS.
+Handlers block, so each event is run in a pool of threads (much like concurrent invocations),
+while time syncs are replied to straight away on the event loop. Also does what AWS would
+otherwise do: deletes expired items, finishes deleting rooms, applies the room queue if enabled,
+and flushes rooms' queued clients diffs once due (see room_queue.py)
+
+"""
+
+import os
+import sys
+import json
+import asyncio
+from pathlib import Path
+from secrets import token_urlsafe
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'code'))
+
+# WARN Must be set before importing anything that imports resources.py
+os.environ['BACKEND'] = 'local'
+os.environ.setdefault('STACK', 'selah')
+os.environ.setdefault('TOPIC_ERRORS', 'errors')
+os.environ.setdefault('TOPIC_CONTACT', 'contact')
+os.environ.setdefault('ROOM_QUEUE_URL', 'rooms')
+os.environ.setdefault('ROSTER_QUEUE_URL', 'rosters')
+
+import local
+import entrypoint
+from local import make_event, LambdaContext
+from resources import get_table
+from room_queue import ROOM_QUEUE
+from handlers import ROSTER_FLUSH_INTERVAL
+
+
+# Address to listen on
+SERVER_HOST = os.environ.get('SERVER_HOST', 'localhost')
+SERVER_PORT = int(os.environ.get('SERVER_PORT', 8001))
+
+# Max events handled at once (like a limit on concurrent invocations)
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 32))
+
+# Seconds an event may be handled for (same as the Timeout of FunctionMain and FunctionRoomQueue
+# in template.yaml)
+SERVER_TIMEOUT = 20
+
+# Seconds between sweeps of expired items and deleted rooms
+SERVER_SWEEP_INTERVAL = 30 * 60
+
+# Tables whose expired items are swept (see `sweep`)
+SWEPT_TABLES = ('rooms', 'media', 'rosters', 'payments')
+
+# Seconds to wait before checking a queue again when it's empty
+SERVER_QUEUE_POLL = 0.02
+
+# Max messages given to the queue worker at once (same as its BatchSize in template.yaml)
+SERVER_QUEUE_BATCH = 10
+
+# Max bytes of a message (same as API Gateway's limit)
+MAX_MESSAGE_SIZE = 128 * 1024
+
+
+class Server:
+    """Serves websockets, handling their events with the usual entrypoint (see entrypoint.py)"""
+
+    def __init__(self, threads=SERVER_THREADS):
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(threads)
+        self.loop = None
+
+    async def run(self, host=SERVER_HOST, port=SERVER_PORT):
+        """Serve until cancelled"""
+        import websockets  # NOTE Only needed when self-hosting (see above)
+        self.loop = asyncio.get_running_loop()
+        worker = asyncio.create_task(self.work())
+        # NOTE Not compressed, as API Gateway doesn't compress either (and it costs more CPU than
+        #      anything else the server does)
+        try:
+            async with websockets.serve(self.serve_socket, host, port,
+                    max_size=MAX_MESSAGE_SIZE, compression=None):
+                print(f"Serving on ws://{host}:{port} with {self.threads} threads", flush=True)
+                await asyncio.Future()
+        finally:
+            worker.cancel()
+
+    async def work(self):
+        """Do what AWS would otherwise do (see `sweep` and `drain`) until cancelled"""
+        self.loop = asyncio.get_running_loop()
+        tasks = [self.sweep()]
+        if ROOM_QUEUE:
+            tasks.append(self.drain(os.environ['ROOM_QUEUE_URL']))
+        if ROSTER_FLUSH_INTERVAL:
+            tasks.append(self.drain(os.environ['ROSTER_QUEUE_URL']))
+        await asyncio.gather(*tasks)
+
+    async def serve_socket(self, websocket):
+        """Handle a websocket's connect, messages and disconnect as API Gateway would"""
+
+        # Give the socket an id like API Gateway's and send whatever is posted to it
+        # NOTE Posts come from the handlers' threads so are passed to the loop to send in order
+        socket = token_urlsafe(12)
+        outbox = asyncio.Queue()
+        local.sockets.connect(socket,
+            lambda data: self.loop.call_soon_threadsafe(outbox.put_nowait, data))
+        writer = asyncio.create_task(self.write(websocket, outbox))
+
+        # Connect before receiving messages (as API Gateway waits for $connect's function)
+        # NOTE Messages are then handled concurrently, as API Gateway would invoke the function
+        from websockets.exceptions import ConnectionClosed
+        await self.invoke(make_event(socket, 'CONNECT'))
+        handling = set()
+        try:
+            async for body in websocket:
+                if isinstance(body, bytes):
+                    body = body.decode('utf-8', errors='replace')
+                event = make_event(socket, 'MESSAGE', body)
+                if entrypoint.is_sync_request(event):
+                    entrypoint.reply_to_sync_request(event)
+                else:
+                    task = asyncio.create_task(self.invoke(event))
+                    handling.add(task)
+                    task.add_done_callback(handling.discard)
+        except ConnectionClosed:
+            pass
+        finally:
+            # Finish handling messages already received, then disconnect
+            # NOTE Posts to the socket fail from here on, as they would for a closed socket on AWS
+            await asyncio.gather(*handling)
+            local.sockets.disconnect(socket)
+            await self.invoke(make_event(socket, 'DISCONNECT'))
+            writer.cancel()
+
+    async def write(self, websocket, outbox):
+        """Send data posted to a socket, in the order posted, until cancelled"""
+        while True:
+            data = await outbox.get()
+            try:
+                await websocket.send(data.decode('utf-8') if isinstance(data, bytes) else data)
+            except Exception:
+                return  # Connection lost, so remaining data can't be sent either
+
+    async def invoke(self, event):
+        """Handle an event in the pool of threads, as an invocation of the function would be"""
+        event['requestContext']['requestId'] = token_urlsafe()
+        await self.loop.run_in_executor(self.executor, self.enter, event)
+
+    def enter(self, event):
+        """Handle an event, telling its client if failed (as API Gateway does)"""
+        try:
+            entrypoint.enter(event, LambdaContext(SERVER_TIMEOUT))
+        except Exception:
+            # NOTE Already reported by `enter`
+            context = event['requestContext']
+            try:
+                local.sockets.post_to_connection(ConnectionId=context['connectionId'],
+                    Data=json.dumps({
+                        'message': "Internal server error",
+                        'connectionId': context['connectionId'],
+                        'requestId': context['requestId'],
+                    }))
+            except local.sockets.exceptions.GoneException:
+                pass
+
+    async def sweep(self):
+        """Periodically delete expired items (as DynamoDB's TTL does) and finish deleting rooms
+        (as the scheduled sweep does, see reaper.py) until cancelled
+
+        NOTE Unlike AWS, clients are always deleted when their socket closes and sockets can be
+             connected for any length of time, so clients are neither reaped nor expired (see
+             CLIENT_RECORD_LIFETIME)
+
+        """
+        from reaper import sweep_deleted_rooms
+        while True:
+            await asyncio.sleep(SERVER_SWEEP_INTERVAL)
+            for name in SWEPT_TABLES:
+                await self.loop.run_in_executor(self.executor, get_table(name).sweep)
+            deleted, evicted = await self.loop.run_in_executor(self.executor,
+                sweep_deleted_rooms, get_table('rooms'), LambdaContext(SERVER_TIMEOUT))
+            if deleted:
+                print(f"Deleted {deleted} rooms ({evicted} clients evicted)", flush=True)
+
+    async def drain(self, url):
+        """Apply messages from a queue as the queue's function would, until cancelled
+
+        NOTE Batches are applied one at a time (rather than one per room at once) so a room's
+             messages are always applied in order, as SQS ensures for FIFO queues
+
+        """
+        while True:
+            records = local.queue.take(url, SERVER_QUEUE_BATCH)
+            if not records:
+                await asyncio.sleep(SERVER_QUEUE_POLL)
+                continue
+            resp = await self.loop.run_in_executor(self.executor, entrypoint.drain,
+                {'Records': records}, LambdaContext(SERVER_TIMEOUT))
+            failed = {item['itemIdentifier'] for item in resp['batchItemFailures']}
+            if failed:
+                local.queue.put_back(url, [record for record in records
+                    if record['messageId'] in failed])
+                await asyncio.sleep(SERVER_QUEUE_POLL)
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(Server().run())
+    except KeyboardInterrupt:
+        pass
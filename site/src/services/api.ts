@@ -8,6 +8,10 @@ import {debug} from '@/services/misc'
 type QueueItem = [string, {}]
 
 
+// Number of time sync probes to send at once (see `init_sync`)
+const SYNC_PROBES = 3
+
+
 export default class {
 
     ws
@@ -35,19 +39,28 @@ export default class {
 
         // Handle incoming messages
         this.ws.addEventListener('message', event => {
-            // See if a normal JSON message or a time sync
+            // See if a normal JSON message, multiple messages merged together, or a time sync
             if (event.data[0] === '{'){
                 this.receive(event.data)
+            } else if (event.data[0] === '['){
+                // Server merges all messages to a client from the same invocation (see api outbox)
+                for (const message of JSON.parse(event.data)){
+                    this.receive(message, false)
+                }
             } else {
                 // Convert time sync responses into normal message format
                 const client_end = new Date().getTime()  // Set final time ASAP!
-                const [client_start, server] = event.data.split('\n')
+                const [client_start, server, server_entry, server_delta] = event.data.split('\n')
+                // NOTE Probes are prefixed with 'p' and have extra server timings (see api)
+                const probe = client_start[0] === 'p'
                 const data = {
                     type: 'client_time',
                     info: {
-                        client_start: Number(client_start),
+                        client_start: Number(probe ? client_start.slice(1) : client_start),
                         client_end: Number(client_end),
                         server: Number(server),
+                        server_entry: probe ? Number(server_entry) : null,
+                        server_delta: probe ? Number(server_delta) : null,
                     },
                 }
                 this.receive(data, false)
@@ -85,14 +98,17 @@ export default class {
 
         // Do extra time syncs as a keep-alive for the client which has a 10 min idle limit
         // See https://docs.aws.amazon.com/apigateway/latest/developerguide/limits.html
-        setInterval(() => this.init_sync(), 9 * 60 * 1000)  // Every 9 mins
+        setInterval(() => this.init_sync(1), 9 * 60 * 1000)  // Every 9 mins (one probe enough)
     }
 
-    init_sync(){
-        // Init a sync exchange with server
+    init_sync(probes=SYNC_PROBES){
+        // Init a sync exchange with server by sending a burst of probes
+        // NOTE Replies include time spent by server, so can use the one with least network delay
         // NOTE Avoid regular send wrapper to make as fast as possible
         if (this.connected){
-            this.ws.send('' + new Date().getTime())
+            for (let i = 0; i < probes; i++){
+                this.ws.send('p' + new Date().getTime())
+            }
         }
     }
 
@@ -119,7 +135,7 @@ export default class {
     receive(data, json=true){
         // Handle a message from the server
 
-        // Decode unless passed custom data from a socket or sync event
+        // Decode unless passed data already decoded (e.g. from a socket or sync event)
         let message = json ? JSON.parse(data) : data
 
         // If no message type, then probably an Internal Server Error from AWS
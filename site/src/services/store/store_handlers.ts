@@ -6,6 +6,10 @@ export {getters_ as getters}
 const getters_ = {}
 
 
+// Max clients displayed in a room's clients list (must match server)
+const ROOM_CLIENTS_DISPLAY_LIMIT = 100
+
+
 // System messages
 // WARN Do not use <p> as not normally allowed and adds margin
 // TODO Make tips version for Singit
@@ -69,20 +73,32 @@ export function actions(db, api){return {
 
     // CLIENT
 
-    handle_client_time({state, commit}, {client_start, client_end, server}){
+    handle_client_time({state, commit}, {client_start, client_end, server, server_entry,
+            server_delta}){
         // Process the results of a time sync
         // NOTE Times are in milliseconds
 
         // Keep track of how many successful checks so far
         commit('tmp_set', ['time_diff_checks', state.tmp.time_diff_checks + 1])
 
-        // Calculate one-way latency
-        const latency = (client_end - client_start) / 2
-
-        // Calculate difference between server and client time
-        // Guess what client's time would have been when message reached server by adding latency
-        const client_mid_guess = client_start + latency
-        const time_diff = client_mid_guess - server
+        let latency
+        let time_diff
+        if (server_entry === null){
+            // Calculate one-way latency
+            latency = (client_end - client_start) / 2
+
+            // Calculate difference between server and client time
+            // Guess what client's time would have been when message reached server
+            const client_mid_guess = client_start + latency
+            time_diff = client_mid_guess - server
+        } else {
+            // Probes also say when server replied, so exclude time spent on server (like NTP)
+            // NOTE Gateway and function clocks may differ slightly, so never less than no time
+            const server_time = Math.max(0, server_entry + server_delta - server)
+            const server_end = server + server_time
+            latency = (client_end - client_start - server_time) / 2
+            time_diff = ((client_start - server) + (client_end - server_end)) / 2
+        }
 
         // Update time diff if lowest latency so far (i.e. most accurate time diff)
         const prev_latency = state.tmp.time_diff_latency
@@ -184,6 +200,11 @@ export function actions(db, api){return {
             return
         }
 
+        // Ignore if already have a later version (e.g. patches received while requesting this)
+        if (room.version < state.tmp.room.version){
+            return
+        }
+
         // Update room state
         commit('tmp_set', ['room', room])
 
@@ -195,6 +216,37 @@ export function actions(db, api){return {
         }
     },
 
+    handle_room_patch({state, dispatch}, {room_id, changes, media}){
+        // Apply changes to the room state (only including fields that changed)
+        // NOTE Only update if room id matches, otherwise could prevent leaving room if lag
+        const room = state.tmp.room
+        if (room_id !== room?.id){
+            return
+        }
+
+        // Ignore patches for versions already have (e.g. received out of order due to lag)
+        if (changes.version <= room.version){
+            return
+        }
+
+        // Can only apply to the previous version, so if missed one then get the full state instead
+        if (changes.version !== room.version + 1){
+            dispatch('room_state_resync')
+            return
+        }
+
+        // Apply changes to media items (keeping them ordered by position)
+        const patched = {...room, ...changes}
+        if (media){
+            const replaced = new Set([...media.delete, ...media.put.map(item => item.id)])
+            patched.media = room.media.filter(item => !replaced.has(item.id)).concat(media.put)
+            patched.media.sort((a, b) => a.pos - b.pos)
+        }
+
+        // Reuse state handler so the same side effects apply
+        dispatch('handle_room_state', patched)
+    },
+
     handle_room_clients({state, commit}, {room_id, clients}){
         // Update the room state with latest values
         // WARN Only update if room id matches, otherwise could display wrong room's clients if lag
@@ -203,6 +255,73 @@ export function actions(db, api){return {
         }
     },
 
+    handle_room_clients_diff({state, commit, dispatch}, {room_id, diffs}){
+        // Apply changes to individual clients to the existing clients list
+        // WARN Only update if room id matches, otherwise could display wrong room's clients if lag
+        const current = state.tmp.room_clients
+        if (room_id !== state.tmp.room?.id || !current){
+            return
+        }
+
+        // Work on copies so all changes are committed at once
+        const clients = {
+            admins: current.admins.slice(),
+            guests: current.guests.slice(),
+            limited: current.limited,
+            total: current.total,
+        }
+
+        for (const {change, socket, fields} of diffs){
+
+            // Find the client's existing entry (if any)
+            // NOTE If clients hidden then socket will be null and only total is known
+            let list = null
+            let index = -1
+            for (const key of ['admins', 'guests']){
+                const key_index = clients[key].findIndex(client => client.socket === socket)
+                if (key_index !== -1){
+                    list = clients[key]
+                    index = key_index
+                }
+            }
+
+            if (change === 'joined'){
+                // Already known clients are just updated (moving to end as they rejoined)
+                if (list){
+                    list.splice(index, 1)
+                } else {
+                    clients.total += 1
+                }
+                // Only display if list isn't already at the limit (same as server's limit)
+                if (socket !== null){
+                    if (clients.admins.length + clients.guests.length < ROOM_CLIENTS_DISPLAY_LIMIT){
+                        clients[fields.admin ? 'admins' : 'guests'].push({socket, ...fields})
+                    } else {
+                        clients.limited = true
+                    }
+                }
+            } else if (change === 'left'){
+                // If full list known and client not in it, then must have already been removed
+                if (list){
+                    list.splice(index, 1)
+                    clients.total = Math.max(0, clients.total - 1)
+                } else if (socket === null || clients.limited){
+                    clients.total = Math.max(0, clients.total - 1)
+                }
+            } else if (change === 'changed'){
+                if (list){
+                    list.splice(index, 1, {...list[index], ...fields})
+                } else if (!clients.limited){
+                    // Client should be in the list, so the list must have got out of sync
+                    dispatch('room_clients_resync')
+                    return
+                }
+            }
+        }
+
+        commit('tmp_set', ['room_clients', clients])
+    },
+
     handle_room_message({state, dispatch}, message){
         // Add the message to the list of received messages
         // WARN Only add if room id matches, otherwise could receive from wrong room if lag
@@ -77,6 +77,20 @@ export function actions(db, api){return {
         })
     },
 
+    room_state_resync({state}){
+        // Request the full room state (when a patch has been missed)
+        api.send('room_state_resync', {
+            room_id: state.tmp.room.id,
+        })
+    },
+
+    room_clients_resync({state}){
+        // Request the full clients list (when own copy has got out of sync)
+        api.send('room_clients_resync', {
+            room_id: state.tmp.room.id,
+        })
+    },
+
     room_message_send({state}, message){
         // Send a chat message
         api.send('room_message', {
@@ -42,6 +42,7 @@ export interface AppState {
         // Generic room state
         room:{
             id:string,
+            version:number,  // Increases with every change (see `handle_room_patch`)
             name:string,
 
             // Media
@@ -88,6 +89,7 @@ interface AppKnownRoom {
 
 interface AppRoomMedia {
     id:string
+    pos:number  // Items are ordered by this
     name:string
     type:string
     content:{}  // Different depending on the type